@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, List, Optional
+
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .busqueda import IndiceBusqueda
+from .database import AsyncSessionLocal, escribir
+
+# === CONFIG ARCHIVO ===
+# Conversaciones sin actividad en N días salen de messages a
+# conversation_archives, comprimidas. Opcional: sin ARCHIVO_DIAS (o con 0) no
+# se archiva nada. Los mensajes archivados no salen en /search (sólo el
+# título) hasta que la conversación se vuelve a abrir y se rehidrata
+ARCHIVO_DIAS: int = int(os.getenv("ARCHIVO_DIAS") or "0")
+# Cada cuánto lo comprueba el servidor (0 = sólo `python -m backend.cli archivar`)
+ARCHIVO_INTERVALO_MIN: float = float(os.getenv("ARCHIVO_INTERVALO_MIN") or "60")
+# Conversaciones por transacción: el escritor único queda ocupado lo que
+# dura el lote, así que los turnos de chat esperan como mucho eso
+ARCHIVO_LOTE: int = int(os.getenv("ARCHIVO_LOTE") or "25")
+ARCHIVO_NIVEL_ZLIB = 6
+
+# === CONFIG EXPORTACIÓN ===
+# Filas que trae cada viaje del cursor del servidor
+EXPORTAR_FILAS_LOTE: int = int(os.getenv("EXPORTAR_FILAS_LOTE") or "500")
+# Exportaciones a la vez: cada una retiene una conexión mientras dura
+EXPORTAR_CONCURRENTES: int = int(os.getenv("EXPORTAR_CONCURRENTES") or "2")
+# Se acumulan líneas hasta este tamaño antes de enviarlas (y comprimirlas)
+_TROZO_EXPORTAR = 64 * 1024
+
+
+def comprimir(mensajes: List[list]) -> bytes:
+    """[[id, role, content, created_at ISO], …] → JSON comprimido."""
+    return zlib.compress(
+        json.dumps(mensajes, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        ARCHIVO_NIVEL_ZLIB,
+    )
+
+
+def descomprimir(datos: bytes) -> List[list]:
+    return json.loads(zlib.decompress(datos))
+
+
+def _linea_mensaje(conv_id: str, msg_id: int, role: str, content: str, fecha: str) -> str:
+    return json.dumps(
+        {
+            "type": "message",
+            "conversation_id": conv_id,
+            "id": msg_id,
+            "role": role,
+            "content": content,
+            "created_at": fecha,
+        },
+        ensure_ascii=False,
+    )
+
+
+class ArchivoConversaciones:
+    """
+    Archivo de conversaciones inactivas y exportación de una cuenta.
+
+    Archivar mueve los mensajes de la conversación a un JSON comprimido
+    (conversation_archives) y los quita de messages y del índice de
+    búsqueda de mensajes; la fila de conversations se queda (la barra
+    lateral y la búsqueda por título no cambian). Cualquier escritura o
+    lectura del historial la rehidrata antes, dentro de su transacción,
+    y vuelve a indexar sus mensajes. Con `dias` = 0 (por defecto) sólo
+    archiva quien pase los días a `archivar_antiguas`.
+    """
+
+    def __init__(
+        self,
+        busqueda: IndiceBusqueda,
+        dias: int = ARCHIVO_DIAS,
+        lote: int = ARCHIVO_LOTE,
+        max_exportaciones: int = EXPORTAR_CONCURRENTES,
+    ):
+        self.busqueda = busqueda
+        self.dias = dias
+        self.lote = max(1, lote)
+        self.max_exportaciones = max_exportaciones
+        self.exportando = 0
+        self.stats = {
+            "conversaciones_archivadas": 0,
+            "mensajes_archivados": 0,
+            "bytes_originales": 0,
+            "bytes_comprimidos": 0,
+            "conversaciones_rehidratadas": 0,
+            "mensajes_rehidratados": 0,
+            "errores": 0,
+            "exportaciones": 0,
+            "mensajes_exportados": 0,
+            "bytes_exportados": 0,
+        }
+
+    # --- Archivar (dentro de database.escribir) ---
+    async def archivar_lote(
+        self, db: AsyncSession, antes_de: datetime, desde_id: str = ""
+    ) -> List[str]:
+        """
+        Archiva hasta `lote` conversaciones con updated_at < antes_de, en
+        orden de id a partir de `desde_id` (cada lote sigue donde acabó el
+        anterior, sin volver a recorrer la tabla). Devuelve sus ids.
+        """
+        C, M = models.Conversation, models.Message
+        conv_ids = list(
+            await db.scalars(
+                select(C.id)
+                .where(
+                    C.id > desde_id,
+                    C.updated_at < antes_de,
+                    C.archived_at.is_(None),
+                    exists().where(M.conversation_id == C.id),
+                )
+                .order_by(C.id)
+                .limit(self.lote)
+            )
+        )
+        if not conv_ids:
+            return conv_ids
+
+        filas = await db.execute(
+            select(
+                M.conversation_id,
+                M.id,
+                M.role,
+                M.content,
+                M.created_at,
+                M.has_image,
+                M.local_reply,
+            )
+            .where(M.conversation_id.in_(conv_ids))
+            .order_by(M.conversation_id, M.created_at, M.id)
+        )
+        archivos = []
+        for conv_id, grupo in itertools.groupby(filas, key=lambda f: f.conversation_id):
+            mensajes = [
+                [
+                    f.id,
+                    f.role.value,
+                    f.content,
+                    f.created_at.isoformat(),
+                    int(f.has_image),
+                    int(f.local_reply),
+                ]
+                for f in grupo
+            ]
+            datos = comprimir(mensajes)
+            archivos.append(
+                {"conversation_id": conv_id, "message_count": len(mensajes), "data": datos}
+            )
+            self.stats["mensajes_archivados"] += len(mensajes)
+            self.stats["bytes_originales"] += sum(len(m[2].encode("utf-8")) for m in mensajes)
+            self.stats["bytes_comprimidos"] += len(datos)
+
+        # El índice sin contenido necesita el texto de messages para borrar
+        await self.busqueda.borrar_mensajes(db, conv_ids)
+        await db.execute(insert(models.ConversationArchive), archivos)
+        await db.execute(
+            delete(M)
+            .where(M.conversation_id.in_(conv_ids))
+            .execution_options(synchronize_session=False)
+        )
+        # Archivar no es actividad: updated_at (orden de la barra lateral) igual.
+        # message_count, image_count y el extracto cuentan también lo archivado
+        await db.execute(
+            update(C)
+            .where(C.id.in_(conv_ids))
+            .values(archived_at=func.now(), updated_at=C.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        self.stats["conversaciones_archivadas"] += len(conv_ids)
+        return conv_ids
+
+    async def archivar_antiguas(self, dias: Optional[int] = None) -> int:
+        """Archiva por lotes todo lo inactivo desde hace `dias` días."""
+        dias = self.dias if dias is None else dias
+        if dias <= 0:
+            return 0
+        antes_de = datetime.utcnow() - timedelta(days=dias)
+        total = 0
+        desde_id = ""
+        while True:
+            conv_ids = await escribir(self.archivar_lote, antes_de, desde_id)
+            total += len(conv_ids)
+            if len(conv_ids) < self.lote:
+                return total
+            desde_id = conv_ids[-1]
+            # Hueco para los turnos de chat que esperan al escritor
+            await asyncio.sleep(0)
+
+    async def periodico(self, intervalo_min: float = ARCHIVO_INTERVALO_MIN) -> None:
+        """Tarea de fondo del servidor (lifespan)."""
+        while True:
+            await asyncio.sleep(intervalo_min * 60)
+            try:
+                await self.archivar_antiguas()
+            except Exception as e:
+                self.stats["errores"] += 1
+                print("Error archivando conversaciones:", repr(e))
+
+    # --- Rehidratar (dentro de database.escribir) ---
+    async def rehidratar(self, db: AsyncSession, conv_id: str) -> Callable[[int], int]:
+        """
+        Devuelve los mensajes archivados de la conversación a messages (y
+        al índice de búsqueda) con ids nuevos. Devuelve la traducción de un
+        id "hasta" viejo (como summary_upto_id) al nuevo; si no estaba
+        archivada, la identidad.
+        """
+        C, A = models.Conversation, models.ConversationArchive
+        datos = await db.scalar(select(A.data).where(A.conversation_id == conv_id))
+        if datos is None:
+            return lambda hasta: hasta
+        mensajes = descomprimir(datos)
+
+        # Escritor único: los ids nuevos siguen a éste, en el mismo orden
+        ultimo_id = await db.scalar(select(func.max(models.Message.id))) or 0
+        await db.execute(
+            insert(models.Message),
+            [
+                {
+                    "conversation_id": conv_id,
+                    "role": models.RoleEnum(role),
+                    "content": content,
+                    "created_at": datetime.fromisoformat(fecha),
+                    "has_image": bool(resto and resto[0]),
+                    "local_reply": bool(resto[1:] and resto[1]),
+                }
+                for _, role, content, fecha, *resto in mensajes
+            ],
+        )
+        await self.busqueda.indexar_mensajes_desde(db, ultimo_id)
+
+        def remapear(hasta: int) -> int:
+            """Al último id nuevo que cubre `hasta` (0 si ninguno)."""
+            nuevo_hasta = 0
+            for i, (msg_id, *_resto) in enumerate(mensajes):
+                if msg_id <= hasta:
+                    nuevo_hasta = ultimo_id + 1 + i
+            return nuevo_hasta
+
+        # summary_upto_id apuntaba a ids viejos
+        hasta = await db.scalar(select(C.summary_upto_id).where(C.id == conv_id)) or 0
+        await db.execute(
+            update(C)
+            .where(C.id == conv_id)
+            .values(archived_at=None, summary_upto_id=remapear(hasta), updated_at=C.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(delete(A).where(A.conversation_id == conv_id))
+        self.stats["conversaciones_rehidratadas"] += 1
+        self.stats["mensajes_rehidratados"] += len(mensajes)
+        return remapear
+
+    # --- Exportar ---
+    def reservar_exportacion(self) -> Optional["_Reserva"]:
+        """
+        Plaza para una exportación, o None si ya hay max_exportaciones. Se
+        pide en el handler (antes de que StreamingResponse empiece a leer
+        el generador) para que peticiones simultáneas no pasen todas.
+        """
+        if self.exportando >= self.max_exportaciones:
+            return None
+        return _Reserva(self)
+
+    async def exportar(
+        self,
+        user_id: int,
+        username: str,
+        gzip: bool = False,
+        reserva: Optional["_Reserva"] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        NDJSON con todas las conversaciones y mensajes del usuario (también
+        los archivados, sin rehidratarlos): una línea "account", y por
+        conversación su línea "conversation" seguida de sus "message".
+
+        Un solo SELECT recorrido con un cursor del servidor en el orden de
+        los índices (SQLite sólo ordena los mensajes de cada conversación),
+        en una sesión propia: la memoria no depende del tamaño de la cuenta
+        y las filas salen de una misma foto de la base de datos.
+        """
+        C, M, A = models.Conversation, models.Message, models.ConversationArchive
+        consulta = (
+            select(
+                C.id,
+                C.title,
+                C.created_at,
+                C.updated_at,
+                C.archived_at,
+                M.id.label("mensaje_id"),
+                M.role,
+                M.content,
+                M.created_at.label("mensaje_fecha"),
+                A.data,
+            )
+            .select_from(C)
+            .outerjoin(M, M.conversation_id == C.id)
+            .outerjoin(A, A.conversation_id == C.id)
+            .where(C.user_id == user_id)
+            .order_by(C.updated_at.desc(), C.id.desc(), M.created_at, M.id)
+            .execution_options(yield_per=EXPORTAR_FILAS_LOTE)
+        )
+        compresor = zlib.compressobj(ARCHIVO_NIVEL_ZLIB, zlib.DEFLATED, 31) if gzip else None
+        pendiente: List[str] = []
+        tam = 0
+
+        def trozo() -> bytes:
+            nonlocal tam
+            datos = "".join(pendiente).encode("utf-8")
+            pendiente.clear()
+            tam = 0
+            self.stats["bytes_exportados"] += len(datos)
+            return compresor.compress(datos) if compresor else datos
+
+        def anadir(linea: str) -> None:
+            nonlocal tam
+            pendiente.append(linea + "\n")
+            tam += len(linea) + 1
+
+        # Sin reserva (tareas internas, benchmarks): cuenta igualmente
+        reserva = reserva or _Reserva(self)
+        self.stats["exportaciones"] += 1
+        try:
+            anadir(
+                json.dumps(
+                    {
+                        "type": "account",
+                        "username": username,
+                        "exported_at": datetime.utcnow().isoformat(timespec="seconds"),
+                    },
+                    ensure_ascii=False,
+                )
+            )
+            async with AsyncSessionLocal() as db:
+                resultado = await db.stream(consulta)
+                actual = None
+                async for f in resultado:
+                    if f.id != actual:
+                        actual = f.id
+                        anadir(
+                            json.dumps(
+                                {
+                                    "type": "conversation",
+                                    "id": f.id,
+                                    "title": f.title,
+                                    "created_at": f.created_at.isoformat(),
+                                    "updated_at": f.updated_at.isoformat(),
+                                    "archived": f.archived_at is not None,
+                                },
+                                ensure_ascii=False,
+                            )
+                        )
+                        if f.data is not None:
+                            archivados = descomprimir(f.data)
+                            for msg_id, role, content, fecha, *_ in archivados:
+                                anadir(_linea_mensaje(f.id, msg_id, role, content, fecha))
+                            self.stats["mensajes_exportados"] += len(archivados)
+                    if f.mensaje_id is not None:
+                        anadir(
+                            _linea_mensaje(
+                                f.id,
+                                f.mensaje_id,
+                                f.role.value,
+                                f.content,
+                                f.mensaje_fecha.isoformat(),
+                            )
+                        )
+                        self.stats["mensajes_exportados"] += 1
+                    if tam >= _TROZO_EXPORTAR:
+                        datos = trozo()
+                        if datos:
+                            yield datos
+            datos = trozo()
+            if compresor:
+                datos += compresor.flush()
+            if datos:
+                yield datos
+        finally:
+            reserva.liberar()
+
+
+class _Reserva:
+    """
+    Plaza ocupada en ArchivoConversaciones.exportando. La libera el
+    `finally` de exportar(); si el generador no llega a arrancar (el
+    cliente se va antes del primer byte) se libera al recogerse.
+    """
+
+    def __init__(self, archivo: ArchivoConversaciones):
+        self._archivo = archivo
+        self._activa = True
+        archivo.exportando += 1
+
+    def liberar(self) -> None:
+        if self._activa:
+            self._activa = False
+            self._archivo.exportando -= 1
+
+    def __del__(self) -> None:
+        self.liberar()
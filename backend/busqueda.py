@@ -0,0 +1,488 @@
+from __future__ import annotations
+
+import html
+import os
+import re
+import unicodedata
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .titulos import TITULO_POR_DEFECTO
+
+# === CONFIG BÚSQUEDA ===
+# Índice FTS5 de SQLite sobre messages.content y conversations.title. Con
+# otra base de datos (o un SQLite sin FTS5) la búsqueda queda desactivada.
+BUSQUEDA_ACTIVA: bool = (os.getenv("BUSQUEDA_ACTIVA") or "1") == "1"
+# Peso de un acierto en el título frente a uno en un mensaje
+BUSQUEDA_PESO_TITULO: float = float(os.getenv("BUSQUEDA_PESO_TITULO") or "2")
+# Palabras del fragmento de un mensaje alrededor del acierto
+BUSQUEDA_PALABRAS_FRAGMENTO: int = int(os.getenv("BUSQUEDA_PALABRAS_FRAGMENTO") or "16")
+# Sólo se ordenan por relevancia los N aciertos más recientes del usuario:
+# con una palabra que está en media cuenta, bm25 de todos costaría cientos
+# de ms y lo que se busca suele ser reciente
+BUSQUEDA_MAX_CANDIDATOS: int = int(os.getenv("BUSQUEDA_MAX_CANDIDATOS") or "2000")
+BUSQUEDA_MAX_TERMINOS = 8
+# Mensajes por transacción al reconstruir el índice
+BUSQUEDA_LOTE_REINDEXAR = 50_000
+
+# Sin tildes ni mayúsculas: "pimenton" encuentra "Pimentón"
+_TOKENIZADOR = "tokenize='unicode61 remove_diacritics 2'"
+_DDL = (
+    # Sin contenido (content=''): el texto ya está en messages. El índice
+    # ocupa ~4 veces menos y cada lote de turnos escribe muchas menos páginas
+    "CREATE VIRTUAL TABLE IF NOT EXISTS busqueda_mensajes USING fts5("
+    f"contenido, content='', {_TOKENIZADOR})",
+    # conversacion indexada: así se localiza la fila del título al renombrar
+    "CREATE VIRTUAL TABLE IF NOT EXISTS busqueda_titulos USING fts5("
+    f"titulo, conversacion, {_TOKENIZADOR})",
+)
+_TABLAS = ("busqueda_mensajes", "busqueda_titulos")
+
+# rowid = user_id << 40 | id: las filas de cada usuario quedan contiguas y
+# la consulta (rowid BETWEEN) sólo lee su tramo de cada lista de términos,
+# no la lista entera de todos los usuarios. 40 bits dan para 10^12 mensajes.
+# Se insertan en orden de rowid: FTS5 vuelca un segmento nuevo cada vez
+# que recibe un rowid menor que el anterior de la transacción
+_BITS_ID = 40
+_MASCARA_ID = (1 << _BITS_ID) - 1
+_ROWID_MENSAJE = f"(c.user_id << {_BITS_ID}) | m.id"
+
+# Marcas del acierto en los títulos (se convierten en <mark> después de
+# escapar el texto, que puede traer HTML del usuario)
+_INI, _FIN = "\x02", "\x03"
+_PALABRA_RE = re.compile(r"\w+")
+
+_SQL_CORTE = text(
+    """
+    SELECT rowid FROM busqueda_mensajes
+    WHERE busqueda_mensajes MATCH :consulta AND rowid BETWEEN :primero AND :ultimo
+    ORDER BY rowid DESC
+    LIMIT 1 OFFSET :candidatos
+    """
+)
+_SQL_MENSAJES = text(
+    """
+    WITH aciertos AS (
+        SELECT rowid & :mascara AS id, bm25(busqueda_mensajes) AS rango
+        FROM busqueda_mensajes
+        WHERE busqueda_mensajes MATCH :consulta AND rowid BETWEEN :primero AND :ultimo
+        ORDER BY rango
+        LIMIT :n
+    )
+    SELECT aciertos.id, aciertos.rango, m.conversation_id, m.role, m.content,
+           m.created_at, c.display_title
+    FROM aciertos
+    JOIN messages m ON m.id = aciertos.id
+    JOIN conversations c ON c.id = m.conversation_id AND c.user_id = :user_id
+    ORDER BY aciertos.rango
+    """
+)
+_SQL_TITULOS = text(
+    """
+    WITH aciertos AS (
+        SELECT conversacion,
+               highlight(busqueda_titulos, 0, :ini, :fin) AS fragmento,
+               bm25(busqueda_titulos, 1.0, 0.0) AS rango
+        FROM busqueda_titulos
+        WHERE busqueda_titulos MATCH :consulta AND rowid BETWEEN :primero AND :ultimo
+        ORDER BY rango
+        LIMIT :n
+    )
+    SELECT aciertos.conversacion, aciertos.fragmento, aciertos.rango,
+           c.display_title, c.updated_at
+    FROM aciertos
+    JOIN conversations c ON c.id = aciertos.conversacion AND c.user_id = :user_id
+    ORDER BY aciertos.rango
+    """
+)
+_SQL_INDEXAR_MENSAJES = (
+    "INSERT INTO busqueda_mensajes (rowid, contenido) "
+    f"SELECT {_ROWID_MENSAJE}, m.content "
+    "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+)
+
+
+def _tramo(user_id: int) -> dict:
+    """Primer y último rowid posibles del usuario."""
+    return {"primero": user_id << _BITS_ID, "ultimo": (user_id << _BITS_ID) | _MASCARA_ID}
+
+
+def normalizar(palabra: str) -> str:
+    """Como el tokenizador: minúsculas y sin tildes."""
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", palabra.lower())
+        if not unicodedata.combining(c)
+    )
+
+
+def variantes(palabra: str) -> List[str]:
+    """
+    La palabra normalizada con su singular / plural aproximado
+    ("lenteja" ↔ "lentejas", "limón" ↔ "limones"). Son términos exactos:
+    mucho más baratos que una búsqueda por prefijo, que mezcla las listas
+    de todos los términos que empiezan igual.
+    """
+    p = normalizar(palabra)
+    if len(p) <= 2:
+        return [p]
+    formas = {p}
+    if len(p) > 4 and p.endswith("es"):
+        formas |= {p[:-1], p[:-2]}
+    elif p.endswith("s"):
+        formas.add(p[:-1])
+    elif p[-1] in "aeiou":
+        formas.add(p + "s")
+    else:
+        formas.add(p + "es")
+    return sorted(formas)
+
+
+def terminos(texto: str) -> List[List[str]]:
+    """Variantes de cada palabra del texto libre del usuario."""
+    return [variantes(p) for p in _PALABRA_RE.findall(texto)[:BUSQUEDA_MAX_TERMINOS]]
+
+
+def consulta_fts(grupos: List[List[str]]) -> str:
+    """
+    Expresión FTS5: todas las palabras, cada una con sus variantes. Van
+    entre comillas, así que el usuario no puede escribir sintaxis FTS.
+    """
+    return " AND ".join(
+        "(" + " OR ".join(f'"{v}"' for v in grupo) + ")" for grupo in grupos
+    )
+
+
+def fragmento(
+    texto: str, buscados: set, palabras: int = BUSQUEDA_PALABRAS_FRAGMENTO
+) -> str:
+    """
+    `palabras` palabras del mensaje alrededor del primer acierto, con los
+    aciertos entre <mark> y el resto escapado. El índice no guarda el
+    texto, así que snippet() de FTS5 no sirve: se hace aquí y sólo para la
+    página de resultados.
+    """
+    tokens = list(_PALABRA_RE.finditer(texto))
+    if not tokens:
+        return html.escape(texto[:200])
+    marcados = {i for i, t in enumerate(tokens) if normalizar(t.group()) in buscados}
+    primero = min(marcados, default=0)
+    # Un poco de contexto antes del acierto
+    inicio = max(0, min(primero - palabras // 4, len(tokens) - palabras))
+    fin = min(len(tokens), inicio + palabras)
+
+    partes = ["…"] if inicio > 0 else [html.escape(texto[: tokens[0].start()])]
+    pos = tokens[inicio].start()
+    for i in range(inicio, fin):
+        t = tokens[i]
+        partes.append(html.escape(texto[pos : t.start()]))
+        palabra = html.escape(t.group())
+        partes.append(f"<mark>{palabra}</mark>" if i in marcados else palabra)
+        pos = t.end()
+    partes.append("…" if fin < len(tokens) else html.escape(texto[pos:]))
+    return "".join(partes).strip()
+
+
+def _fila_titulo(conv_id: str) -> Optional[str]:
+    """Frase FTS5 con los tokens del id (None si no tiene ninguno)."""
+    palabras = _PALABRA_RE.findall(conv_id)
+    if not palabras:
+        return None
+    return 'conversacion : "' + " ".join(palabras) + '"'
+
+
+def _iso(fecha) -> Optional[str]:
+    """
+    Fecha como en /conversations/ y /history (isoformat): las consultas
+    de texto devuelven el valor guardado, "2026-01-31 12:00:00".
+    """
+    if fecha is None:
+        return None
+    if isinstance(fecha, str):
+        fecha = datetime.fromisoformat(fecha)
+    return fecha.isoformat()
+
+
+def _resaltado(texto: Optional[str]) -> str:
+    return (
+        html.escape(texto or "")
+        .replace(_INI, "<mark>")
+        .replace(_FIN, "</mark>")
+    )
+
+
+class IndiceBusqueda:
+    """
+    Índice de búsqueda de texto completo de mensajes y títulos.
+
+    Los helpers de escritura de main.py lo mantienen al día dentro de su
+    propia transacción (database.escribir), así que índice y tablas nunca
+    divergen. `reconstruir` lo rellena desde cero para bases de datos
+    existentes (python -m backend.cli reindexar-busqueda).
+    """
+
+    def __init__(self, activa: bool = BUSQUEDA_ACTIVA):
+        self.activa = activa
+        self.stats = {
+            "busquedas": 0,
+            "mensajes_indexados": 0,
+            "titulos_indexados": 0,
+            "conversaciones_borradas": 0,
+        }
+
+    def preparar(self, bind, aviso: Optional[Callable[[str], None]] = print) -> bool:
+        """
+        Crea las tablas FTS5 si faltan. Si el índice es nuevo y ya hay
+        mensajes, avisa de que hay que reconstruirlo. Devuelve si la
+        búsqueda queda activa.
+        """
+        if not self.activa or bind.dialect.name != "sqlite":
+            self.activa = False
+            return False
+        nuevo = not inspect(bind).has_table("busqueda_mensajes")
+        try:
+            with bind.begin() as conn:
+                for ddl in _DDL:
+                    conn.exec_driver_sql(ddl)
+                hay_mensajes = conn.exec_driver_sql(
+                    "SELECT 1 FROM messages LIMIT 1"
+                ).first()
+        except Exception as e:
+            # SQLite compilado sin FTS5
+            if aviso:
+                aviso(f"⚠️ Búsqueda desactivada: {e!r}")
+            self.activa = False
+            return False
+        if nuevo and hay_mensajes and aviso:
+            aviso(
+                "⚠️ Índice de búsqueda nuevo sobre mensajes existentes: "
+                "ejecuta `python -m backend.cli reindexar-busqueda`"
+            )
+        return True
+
+    # --- Mantenimiento (dentro de la transacción de database.escribir) ---
+    async def indexar_mensajes_desde(self, db: AsyncSession, desde_id: int) -> None:
+        """Indexa los mensajes con id > desde_id (el lote recién insertado)."""
+        if not self.activa:
+            return
+        result = await db.execute(
+            text(_SQL_INDEXAR_MENSAJES + "WHERE m.id > :desde ORDER BY 1"),
+            {"desde": desde_id},
+        )
+        self.stats["mensajes_indexados"] += max(0, result.rowcount)
+
+    async def indexar_titulo(self, db: AsyncSession, conv_id: str, titulo: str) -> None:
+        """Sustituye el título indexado de la conversación."""
+        if not self.activa:
+            return
+        await self._borrar_titulo(db, conv_id)
+        # El título por defecto no dice nada de la conversación
+        if not titulo or titulo == TITULO_POR_DEFECTO:
+            return
+        # Siguiente rowid libre del tramo del usuario (escritor único)
+        await db.execute(
+            text(
+                "INSERT INTO busqueda_titulos (rowid, titulo, conversacion) "
+                "SELECT coalesce("
+                "  (SELECT max(rowid) FROM busqueda_titulos"
+                f"   WHERE rowid BETWEEN c.user_id << {_BITS_ID}"
+                f"   AND (c.user_id << {_BITS_ID}) | {_MASCARA_ID}),"
+                f"  c.user_id << {_BITS_ID}) + 1, :titulo, c.id "
+                "FROM conversations c WHERE c.id = :conv_id"
+            ),
+            {"titulo": titulo, "conv_id": conv_id},
+        )
+        self.stats["titulos_indexados"] += 1
+
+    async def borrar_conversacion(self, db: AsyncSession, conv_id: str) -> None:
+        """Quita mensajes y título (antes de borrar las filas de messages)."""
+        if not self.activa:
+            return
+        await self.borrar_mensajes(db, [conv_id])
+        await self._borrar_titulo(db, conv_id)
+        self.stats["conversaciones_borradas"] += 1
+
+    async def borrar_mensajes(self, db: AsyncSession, conv_ids: List[str]) -> None:
+        """Quita sólo los mensajes (antes de borrarlos o archivarlos)."""
+        if not self.activa or not conv_ids:
+            return
+        # Un índice sin contenido se borra repitiendo el texto indexado. Sólo
+        # las filas que están en el índice (docsize): borrar una que no está
+        # descuadraría las estadísticas de bm25
+        await db.execute(
+            text(
+                "INSERT INTO busqueda_mensajes (busqueda_mensajes, rowid, contenido) "
+                f"SELECT 'delete', {_ROWID_MENSAJE} AS fila, m.content "
+                "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE m.conversation_id IN :conv_ids AND EXISTS ("
+                f"  SELECT 1 FROM busqueda_mensajes_docsize d WHERE d.id = {_ROWID_MENSAJE}"
+                ") ORDER BY fila"
+            ).bindparams(bindparam("conv_ids", expanding=True)),
+            {"conv_ids": list(conv_ids)},
+        )
+
+    async def _borrar_titulo(self, db: AsyncSession, conv_id: str) -> None:
+        frase = _fila_titulo(conv_id)
+        params = {"conv_id": conv_id}
+        if frase is None:
+            sql = "SELECT rowid FROM busqueda_titulos WHERE conversacion = :conv_id"
+        else:
+            # La frase usa el índice; la igualdad descarta ids que la contienen
+            sql = (
+                "SELECT rowid FROM busqueda_titulos "
+                "WHERE busqueda_titulos MATCH :frase AND conversacion = :conv_id"
+            )
+            params["frase"] = frase
+        await db.execute(
+            text(f"DELETE FROM busqueda_titulos WHERE rowid IN ({sql})"), params
+        )
+
+    # --- Consulta ---
+    async def buscar(
+        self, db: AsyncSession, user_id: int, texto: str, limite: int, desde: int = 0
+    ) -> List[dict]:
+        """
+        Aciertos del usuario en títulos y mensajes, de más a menos
+        relevante (bm25, con el título pesando BUSQUEDA_PESO_TITULO veces
+        más) entre los BUSQUEDA_MAX_CANDIDATOS mensajes más recientes que
+        coinciden. Cada acierto trae un fragmento con el texto encontrado
+        marcado con <mark> y el resto escapado.
+        """
+        grupos = terminos(texto)
+        if not grupos:
+            return []
+        self.stats["busquedas"] += 1
+        consulta = consulta_fts(grupos)
+        tramo = _tramo(user_id)
+        params = {**tramo, "user_id": user_id, "n": limite + desde}
+
+        # Sin bm25: sólo recorre hacia atrás la lista de rowids del usuario
+        corte = await db.scalar(
+            _SQL_CORTE,
+            {**tramo, "consulta": consulta, "candidatos": BUSQUEDA_MAX_CANDIDATOS - 1},
+        )
+        mensajes = await db.execute(
+            _SQL_MENSAJES,
+            {
+                **params,
+                "primero": corte if corte is not None else tramo["primero"],
+                "consulta": consulta,
+                "mascara": _MASCARA_ID,
+            },
+        )
+        titulos = await db.execute(
+            _SQL_TITULOS,
+            {**params, "consulta": f"titulo : ({consulta})", "ini": _INI, "fin": _FIN},
+        )
+
+        # bm25 es negativo: cuanto menor, más relevante
+        aciertos = [
+            (
+                fila.rango * BUSQUEDA_PESO_TITULO,
+                {
+                    "type": "title",
+                    "conversation_id": fila.conversacion,
+                    "title": fila.display_title or TITULO_POR_DEFECTO,
+                    "message_id": None,
+                    "role": None,
+                    "snippet": _resaltado(fila.fragmento),
+                    "date": _iso(fila.updated_at),
+                },
+            )
+            for fila in titulos
+        ]
+        aciertos += [(fila.rango, fila) for fila in mensajes]
+        aciertos.sort(key=lambda a: a[0])
+
+        buscados = {v for grupo in grupos for v in grupo}
+        resultados = []
+        for _, acierto in aciertos[desde : desde + limite]:
+            if not isinstance(acierto, dict):
+                acierto = {
+                    "type": "message",
+                    "conversation_id": acierto.conversation_id,
+                    "title": acierto.display_title or TITULO_POR_DEFECTO,
+                    "message_id": acierto.id,
+                    "role": acierto.role,
+                    "snippet": fragmento(acierto.content, buscados),
+                    "date": _iso(acierto.created_at),
+                }
+            resultados.append(acierto)
+        return resultados
+
+    def indexar_importados(self, conn, desde_mensaje: int, desde_conversacion: int) -> None:
+        """
+        Versión síncrona para importaciones masivas (importador.py), en la
+        transacción del lote: mensajes con id > desde_mensaje y títulos de
+        las conversaciones con rowid > desde_conversacion (las recién
+        insertadas).
+        """
+        if not self.activa:
+            return
+        self.stats["mensajes_indexados"] += max(0, conn.exec_driver_sql(
+            _SQL_INDEXAR_MENSAJES + "WHERE m.id > ? ORDER BY 1", (desde_mensaje,)
+        ).rowcount)
+        # Numeradas a continuación del último título de cada usuario
+        self.stats["titulos_indexados"] += max(0, conn.exec_driver_sql(
+            "WITH nuevas AS MATERIALIZED ("
+            "  SELECT coalesce("
+            "    (SELECT max(rowid) FROM busqueda_titulos"
+            f"     WHERE rowid BETWEEN c.user_id << {_BITS_ID}"
+            f"     AND (c.user_id << {_BITS_ID}) | {_MASCARA_ID}),"
+            f"    c.user_id << {_BITS_ID})"
+            "  + row_number() OVER (PARTITION BY c.user_id ORDER BY c.rowid) AS fila,"
+            "  c.title, c.id"
+            "  FROM conversations c"
+            "  WHERE c.rowid > ? AND c.title IS NOT NULL AND c.title != ?"
+            ") "
+            "INSERT INTO busqueda_titulos (rowid, titulo, conversacion) "
+            "SELECT fila, title, id FROM nuevas ORDER BY fila",
+            (desde_conversacion, TITULO_POR_DEFECTO),
+        ).rowcount)
+
+    # --- Reconstrucción completa (CLI) ---
+    def reconstruir(
+        self, bind, progreso: Optional[Callable[[int, int], None]] = None
+    ) -> dict:
+        """
+        Rehace el índice desde messages y conversations, en lotes de
+        BUSQUEDA_LOTE_REINDEXAR mensajes por transacción, y lo compacta al
+        final. `progreso(hechos, total)` se llama tras cada lote.
+        """
+        with bind.begin() as conn:
+            for tabla in _TABLAS:
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {tabla}")
+        if not self.preparar(bind, aviso=None):
+            raise RuntimeError("La búsqueda necesita SQLite con FTS5")
+        with bind.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO busqueda_titulos (rowid, titulo, conversacion) "
+                f"SELECT (user_id << {_BITS_ID}) "
+                "| row_number() OVER (PARTITION BY user_id ORDER BY id), title, id "
+                "FROM conversations WHERE title IS NOT NULL AND title != ? ORDER BY 1",
+                (TITULO_POR_DEFECTO,),
+            )
+            titulos = conn.exec_driver_sql("SELECT count(*) FROM busqueda_titulos").scalar()
+            total = conn.exec_driver_sql("SELECT count(*) FROM messages").scalar()
+            maximo = conn.exec_driver_sql("SELECT max(id) FROM messages").scalar() or 0
+
+        hechos = 0
+        desde = 0
+        while desde < maximo:
+            hasta = desde + BUSQUEDA_LOTE_REINDEXAR
+            with bind.begin() as conn:
+                hechos += conn.exec_driver_sql(
+                    _SQL_INDEXAR_MENSAJES + "WHERE m.id > ? AND m.id <= ? ORDER BY 1",
+                    (desde, hasta),
+                ).rowcount
+            desde = hasta
+            if progreso:
+                progreso(hechos, total)
+
+        # Fusiona los segmentos de los lotes: consultas más rápidas
+        with bind.begin() as conn:
+            for tabla in _TABLAS:
+                conn.exec_driver_sql(f"INSERT INTO {tabla} ({tabla}) VALUES ('optimize')")
+        return {"mensajes": hechos, "titulos": titulos}
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+# === CONFIG CACHÉ DE RESPUESTAS ===
+RESPUESTAS_CACHE_ACTIVA: bool = (os.getenv("RESPUESTAS_CACHE_ACTIVA") or "1") == "1"
+RESPUESTAS_CACHE_MAX: int = int(os.getenv("RESPUESTAS_CACHE_MAX") or "5000")
+RESPUESTAS_CACHE_MB: float = float(os.getenv("RESPUESTAS_CACHE_MB") or "64")
+RESPUESTAS_CACHE_TTL_S: float = float(os.getenv("RESPUESTAS_CACHE_TTL_S") or str(6 * 3600))
+# Similitud mínima (Jaccard de trigramas) para dar por buena una casi-duplicada.
+# Por defecto 1: sólo coincidencia exacta de la pregunta normalizada. Con menos
+# de 1 además tienen que coincidir negaciones y cantidades (ver _criticas)
+RESPUESTAS_CACHE_SIMILITUD: float = float(os.getenv("RESPUESTAS_CACHE_SIMILITUD") or "1")
+# Reproducción: tamaño aproximado de cada trozo y pausa entre trozos
+RESPUESTAS_CACHE_CHUNK_CHARS: int = int(os.getenv("RESPUESTAS_CACHE_CHUNK_CHARS") or "120")
+RESPUESTAS_CACHE_CHUNK_MS: float = float(os.getenv("RESPUESTAS_CACHE_CHUNK_MS") or "20")
+
+# En la respuesta guardada el nombre del usuario se sustituye por esta marca
+MARCA_USUARIO = "\x00usuario\x00"
+# Nombres más cortos no se sustituyen: si aparecen, la respuesta no se guarda
+RESPUESTAS_CACHE_NOMBRE_MIN = 3
+
+# Saludos, cortesías y artículos que no cambian la pregunta
+_RELLENO = {
+    "hola", "oye", "buenas", "buenos", "dias", "tardes", "noches", "por",
+    "favor", "porfa", "porfavor", "gracias", "chefito", "please",
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del",
+    "me", "dame", "quiero", "puedes", "podrias", "dime",
+}
+_NO_PALABRA_RE = re.compile(r"[^a-z0-9ñ ]+")
+# Palabras que cambian la respuesta aunque apenas cambien los trigramas:
+# "sin gluten" / "con gluten", "no picante", "para 2" / "para 6"
+_CRITICAS = {
+    "sin", "con", "no", "ni", "nada", "nunca", "tampoco", "sino", "menos", "mas",
+    "poco", "poca", "mucho", "mucha", "muy", "extra", "cero", "uno", "dos",
+    "tres", "cuatro", "cinco", "seis", "siete", "ocho", "nueve", "diez", "once",
+    "doce", "quince", "veinte", "treinta", "cien", "mil", "medio", "media",
+    "mitad", "cuarto", "doble", "triple", "docena", "par",
+}
+
+
+def normalizar_pregunta(texto: str) -> str:
+    """Minúsculas, sin tildes ni puntuación ni saludos, espacios simples."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c) or c == "̃")
+    texto = unicodedata.normalize("NFC", texto)
+    texto = _NO_PALABRA_RE.sub(" ", texto)
+    return " ".join(p for p in texto.split() if p not in _RELLENO)
+
+
+def _clave(version: str, pregunta: str) -> str:
+    return f"{version}\x1f{pregunta}"
+
+
+def _criticas(pregunta: str) -> Tuple[str, ...]:
+    """Negaciones, cantidades y números de la pregunta normalizada, en orden."""
+    return tuple(
+        p for p in pregunta.split() if p in _CRITICAS or any(c.isdigit() for c in p)
+    )
+
+
+def _trigramas(pregunta: str) -> Set[str]:
+    s = f"  {pregunta} "
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
+
+def trocear(texto: str, tam: int = RESPUESTAS_CACHE_CHUNK_CHARS):
+    """Trozos de ~`tam` caracteres cortados en espacios, como llegan del modelo."""
+    inicio = 0
+    while inicio < len(texto):
+        fin = min(len(texto), inicio + tam)
+        if fin < len(texto):
+            corte = texto.rfind(" ", inicio + tam // 2, fin)
+            if corte != -1:
+                fin = corte + 1
+        yield texto[inicio:fin]
+        inicio = fin
+
+
+@dataclass
+class _Entrada:
+    texto: str
+    creada: float
+    bytes: int
+    trigramas: Set[str]
+    criticas: Tuple[str, ...]
+
+
+class CacheRespuestas:
+    """
+    Caché en memoria de respuestas a preguntas de un solo turno.
+
+    La clave es la versión del system prompt más la pregunta normalizada
+    (si el prompt cambia, las respuestas viejas dejan de servir). Con
+    `similitud` < 1, si no hay coincidencia exacta busca casi-duplicadas
+    con un índice invertido de trigramas, sólo entre las que tienen las
+    mismas negaciones y cantidades. Expulsa por LRU, TTL, número de
+    entradas y tamaño en MB.
+    """
+
+    def __init__(
+        self,
+        max_entradas: int = RESPUESTAS_CACHE_MAX,
+        max_mb: float = RESPUESTAS_CACHE_MB,
+        ttl_s: float = RESPUESTAS_CACHE_TTL_S,
+        similitud: float = RESPUESTAS_CACHE_SIMILITUD,
+    ):
+        self.max_entradas = max_entradas
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_s = ttl_s
+        self.similitud = similitud
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._indice: Dict[str, Set[str]] = defaultdict(set)
+        self._bytes = 0
+        self.stats = {
+            "consultas": 0,
+            "aciertos_exactos": 0,
+            "aciertos_similares": 0,
+            "fallos": 0,
+            "llamadas_ahorradas": 0,
+            "tokens_ahorrados_estimados": 0,
+            "guardadas": 0,
+            # No guardadas por llevar un nombre corto imposible de sustituir
+            "personalizadas": 0,
+            "expulsadas": 0,
+        }
+
+    # --- API ---
+    def buscar(self, version: str, pregunta: str, username: str) -> Optional[str]:
+        """Respuesta cacheada (con el nombre de `username`) o None."""
+        self.stats["consultas"] += 1
+        pregunta = normalizar_pregunta(pregunta)
+        clave = _clave(version, pregunta)
+        entrada = self._vigente(clave) if pregunta else None
+        if entrada is not None:
+            self.stats["aciertos_exactos"] += 1
+        elif pregunta and self.similitud < 1:
+            similar = self._mas_parecida(version, pregunta)
+            entrada = self._vigente(similar) if similar else None
+            if entrada is not None:
+                self.stats["aciertos_similares"] += 1
+        if entrada is None:
+            self.stats["fallos"] += 1
+            return None
+
+        self.stats["llamadas_ahorradas"] += 1
+        self.stats["tokens_ahorrados_estimados"] += len(entrada.texto) // 4
+        return entrada.texto.replace(MARCA_USUARIO, username)
+
+    def guardar(self, version: str, pregunta: str, username: str, respuesta: str) -> None:
+        pregunta = normalizar_pregunta(pregunta)
+        if not pregunta or not respuesta:
+            return
+        clave = _clave(version, pregunta)
+        # Nunca texto personalizado en la caché compartida: el nombre pasa a
+        # la marca. Un nombre de 1-2 letras ("Al") también es una palabra
+        # normal; sustituirlo estropearía la respuesta, así que no se guarda
+        nombre = re.compile(rf"(?<!\w){re.escape(username)}(?!\w)", re.IGNORECASE)
+        if len(username) < RESPUESTAS_CACHE_NOMBRE_MIN and nombre.search(respuesta):
+            self.stats["personalizadas"] += 1
+            return
+        texto = nombre.sub(MARCA_USUARIO, respuesta)
+        tam = len(clave.encode()) + len(texto.encode())
+        if tam > self.max_bytes:
+            return
+
+        self._quitar(clave)
+        entrada = _Entrada(
+            texto, time.monotonic(), tam, _trigramas(pregunta), _criticas(pregunta)
+        )
+        self._entradas[clave] = entrada
+        for t in entrada.trigramas:
+            self._indice[t].add(clave)
+        self._bytes += tam
+        self.stats["guardadas"] += 1
+
+        while self._entradas and (
+            len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes
+        ):
+            self._quitar(next(iter(self._entradas)))
+            self.stats["expulsadas"] += 1
+
+    async def reproducir(self, texto: str) -> AsyncIterator[str]:
+        """Emite la respuesta en trozos con una pausa corta entre ellos."""
+        pausa = RESPUESTAS_CACHE_CHUNK_MS / 1000
+        for trozo in trocear(texto):
+            yield trozo
+            if pausa:
+                await asyncio.sleep(pausa)
+
+    def resumen(self) -> dict:
+        s = self.stats
+        aciertos = s["aciertos_exactos"] + s["aciertos_similares"]
+        return {
+            **s,
+            "tasa_acierto": round(aciertos / s["consultas"], 4) if s["consultas"] else 0.0,
+            "entradas": len(self._entradas),
+            "mb": round(self._bytes / (1024 * 1024), 3),
+        }
+
+    # --- interno ---
+    def _vigente(self, clave: str) -> Optional[_Entrada]:
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if time.monotonic() - entrada.creada > self.ttl_s:
+            self._quitar(clave)
+            self.stats["expulsadas"] += 1
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def _mas_parecida(self, version: str, pregunta: str) -> Optional[str]:
+        trigramas = _trigramas(pregunta)
+        criticas = _criticas(pregunta)
+        prefijo = _clave(version, "")
+        comunes: Dict[str, int] = defaultdict(int)
+        for t in trigramas:
+            for otra in self._indice.get(t, ()):
+                if otra.startswith(prefijo):
+                    comunes[otra] += 1
+
+        mejor, mejor_sim = None, self.similitud
+        for otra, n in comunes.items():
+            # "sin gluten" no es "con gluten" por mucho que se parezcan
+            if self._entradas[otra].criticas != criticas:
+                continue
+            total = len(trigramas) + len(self._entradas[otra].trigramas) - n
+            sim = n / total
+            if sim >= mejor_sim:
+                mejor, mejor_sim = otra, sim
+        return mejor
+
+    def _quitar(self, clave: str) -> None:
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        self._bytes -= entrada.bytes
+        for t in entrada.trigramas:
+            claves = self._indice.get(t)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._indice[t]
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from .cache_respuestas import normalizar_pregunta
+
+# === CONFIG CLASIFICADOR FUERA DE TEMA ===
+CLASIFICADOR_ACTIVO: bool = (os.getenv("CLASIFICADOR_ACTIVO") or "1") == "1"
+# Probabilidad de "fuera de tema" a partir de la cual se responde en local
+CLASIFICADOR_UMBRAL: float = float(os.getenv("CLASIFICADOR_UMBRAL") or "0.97")
+# Palabras distintas que apuntan a fuera de tema necesarias además del umbral:
+# con una sola ("historia del sushi", "juego de cuchillos") decide el modelo
+CLASIFICADOR_MIN_SENALES: int = int(os.getenv("CLASIFICADOR_MIN_SENALES") or "2")
+# Mensajes guardados que se usan para entrenar al arrancar
+CLASIFICADOR_MAX_MUESTRAS: int = int(os.getenv("CLASIFICADOR_MAX_MUESTRAS") or "20000")
+
+# Frase exacta que el system prompt pide para consultas fuera de la cocina
+MENSAJE_FUERA_DE_TEMA = "Este es un tema que no manejo, mi especialidad es la cocina"
+
+# Vocabulario semilla (ya normalizado: minúsculas y sin tildes). Las
+# palabras de cocina también vetan la respuesta local: incluye utensilios,
+# dietas y alergias, gastronomía y seguridad alimentaria, que suelen llegar
+# junto a palabras de fuera ("novia celiaca", "historia del sushi").
+VOCABULARIO_COCINA = set(
+    """
+    receta recetas cocinar cocina cocino cocinando hornear horno freir frito
+    hervir asar asado plancha sarten olla ingredientes ingrediente comida
+    comer cena cenar almuerzo almorzar desayuno desayunar merienda postre
+    postres plato platos sopa salsa pollo carne cerdo res pescado atun salmon
+    camarones arroz pasta espaguetis huevo huevos queso tomate cebolla ajo
+    papa papas patata patatas verduras vegetales frutas fruta harina azucar
+    sal aceite mantequilla leche chocolate pan tortilla ensalada vegano
+    vegetariano gluten calorias proteina proteinas nutricion dieta sabor
+    picante especias marinar licuadora batidora microondas congelar
+    descongelar coccion hambre bebida jugo batido galletas pastel torta
+    bizcocho masa lentejas frijoles garbanzos aguacate pizza hamburguesa
+    tacos arepa arepas empanadas guiso estofado cuchara taza gramos hornito
+    saludable cocido crudo lasana ceviche paella flan brownie yogur avena
+    preparar preparo preparas prepara preparacion cocinero cocinera chef
+    cuchillo cuchillos utensilios cazuela cacerola rallador batidor espatula
+    molde moldes bandeja freidora vaporera tostadora cafetera mortero colador
+    celiaco celiaca celiacos alergia alergias alergico alergica intolerancia
+    intolerante lactosa keto diabetico diabetica vegana vegetariana vegetarianos
+    gastronomia gastronomica gastronomico culinaria culinario restaurante
+    platillo platillos tipica tipico sushi marisco mariscos intoxicacion
+    caducado caducidad vencido conservar refrigerar nevera refrigerador
+    salmonela higiene cilantro perejil oregano albahaca comino canela pimienta
+    alimentos alimento alimentacion
+    """.split()
+)
+VOCABULARIO_FUERA = set(
+    """
+    matematicas matematica ecuacion ecuaciones derivada derivadas integral
+    integrales algebra teorema geometria fisica quimica programacion programar
+    codigo python javascript java html css sql computadora software
+    historia guerra presidente politica elecciones gobierno futbol partido
+    jugador mundial pelicula peliculas serie series cancion canciones musica
+    novela libro poema capital pais paises geografia planeta universo
+    astronomia bitcoin criptomonedas inversion tarea ensayo traducir ingles
+    idioma coche carro motor celular iphone android windows linux enfermedad
+    sintomas abogado ley demanda empleo curriculum novia novio chiste chistes
+    videojuego videojuegos juego examen universidad filosofia economia
+    resuelve resolver calcula calcular teoria relatividad fisica planetas solar
+    estrellas galaxia netflix youtube instagram tiktok poema poesia escritor
+    autor gripe fiebre medico medicina virus vacuna despido despidos contrato
+    sueldo salario valores acciones web pagina configurar configuro instalar
+    instalo ingenieria
+    """.split()
+)
+# Peso de cada palabra semilla frente a una aparición en una muestra real
+_PESO_SEMILLA = 20
+# Una palabra cuenta como señal de fuera de tema si es al menos e veces más
+# probable en esa clase (log-razón >= 1)
+_SENAL_MIN_LOGP = 1.0
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Palabras normalizadas más bigramas (capturan "cuanto es", "quien gano")."""
+    palabras = normalizar_pregunta(texto).split()
+    return palabras + [f"{a}_{b}" for a, b in zip(palabras, palabras[1:])]
+
+
+def muestras_de_mensajes(filas: Iterable[tuple]) -> List[Tuple[str, bool]]:
+    """
+    (texto, es_fuera_de_tema) a partir de filas (conversation_id, role,
+    content[, local_reply]) ordenadas por conversación y fecha: cada
+    mensaje del usuario se etiqueta con la respuesta que lo sigue. Los que
+    contestó el propio clasificador se descartan: si no, sus falsos
+    positivos serían ejemplos del siguiente modelo.
+    """
+    muestras: List[Tuple[str, bool]] = []
+    pendiente: Optional[Tuple[str, str]] = None
+    for conv_id, role, content, *local in filas:
+        role = getattr(role, "value", role)
+        if role == "user":
+            pendiente = (conv_id, content or "")
+        elif local and local[0]:
+            pendiente = None
+        elif pendiente is not None and pendiente[0] == conv_id:
+            fuera = MENSAJE_FUERA_DE_TEMA.lower() in (content or "").lower()
+            muestras.append((pendiente[1], fuera))
+            pendiente = None
+    return muestras
+
+
+class ClasificadorTema:
+    """
+    Naive Bayes multinomial de dos clases (cocina / fuera de tema) en
+    Python puro: tokenizar y sumar log-probabilidades de un diccionario
+    tarda microsegundos.
+
+    Se entrena con el vocabulario semilla y, al arrancar, con los mensajes
+    guardados: un mensaje de usuario cuya respuesta del modelo fue la frase
+    de fuera de tema es un ejemplo negativo; el resto, positivos.
+    """
+
+    def __init__(
+        self,
+        umbral: float = CLASIFICADOR_UMBRAL,
+        min_senales: int = CLASIFICADOR_MIN_SENALES,
+    ):
+        self.umbral = umbral
+        self.min_senales = min_senales
+        self._cuentas = {"cocina": Counter(), "fuera": Counter()}
+        self._logp: dict = {}
+        self._prior = 0.0
+        self.muestras = 0
+        self.stats = {
+            "consultas": 0,
+            "fuera_de_tema_local": 0,
+            "al_modelo": 0,
+            "ms_max": 0.0,
+        }
+        for palabra in VOCABULARIO_COCINA:
+            self._cuentas["cocina"][palabra] += _PESO_SEMILLA
+        for palabra in VOCABULARIO_FUERA:
+            self._cuentas["fuera"][palabra] += _PESO_SEMILLA
+        # Sin muestras reales, clases equiprobables; con ellas, el prior
+        # refleja que casi todo lo que llega es de cocina
+        self._docs = {"cocina": 1, "fuera": 1}
+        self._recalcular()
+
+    def entrenar(self, muestras: Iterable[Tuple[str, bool]]) -> None:
+        """Añade (texto, es_fuera_de_tema) y recalcula el modelo."""
+        for texto, fuera in muestras:
+            clase = "fuera" if fuera else "cocina"
+            self._cuentas[clase].update(tokenizar(texto))
+            self._docs[clase] += 1
+            self.muestras += 1
+        self._recalcular()
+
+    def _recalcular(self) -> None:
+        vocab = set(self._cuentas["cocina"]) | set(self._cuentas["fuera"])
+        totales = {c: sum(cnt.values()) + len(vocab) for c, cnt in self._cuentas.items()}
+        # log P(w|fuera) - log P(w|cocina) con suavizado de Laplace
+        self._logp = {
+            w: math.log((self._cuentas["fuera"][w] + 1) / totales["fuera"])
+            - math.log((self._cuentas["cocina"][w] + 1) / totales["cocina"])
+            for w in vocab
+        }
+        self._prior = math.log(self._docs["fuera"] / self._docs["cocina"])
+
+    def probabilidad_fuera(self, texto: str) -> Optional[float]:
+        """P(fuera de tema); None si no hay ni una palabra conocida."""
+        tokens = [t for t in tokenizar(texto) if t in self._logp]
+        if not tokens:
+            return None
+        z = self._prior + sum(self._logp[t] for t in tokens)
+        z = max(-30.0, min(30.0, z))
+        return 1 / (1 + math.exp(-z))
+
+    def es_fuera_de_tema(self, texto: str) -> bool:
+        """
+        True sólo si está claramente fuera de tema (se responde en local):
+        al menos `min_senales` palabras distintas de fuera de tema y
+        probabilidad >= `umbral`. Lo dudoso, o cualquier mensaje con una
+        palabra de cocina, va al modelo.
+        """
+        t0 = time.perf_counter()
+        self.stats["consultas"] += 1
+        palabras = set(normalizar_pregunta(texto).split())
+        fuera = False
+        if not palabras & VOCABULARIO_COCINA:
+            senales = sum(1 for p in palabras if self._logp.get(p, 0.0) >= _SENAL_MIN_LOGP)
+            if senales >= self.min_senales:
+                p = self.probabilidad_fuera(texto)
+                fuera = p is not None and p >= self.umbral
+        if fuera:
+            self.stats["fuera_de_tema_local"] += 1
+        else:
+            self.stats["al_modelo"] += 1
+        ms = (time.perf_counter() - t0) * 1000
+        self.stats["ms_max"] = max(self.stats["ms_max"], round(ms, 3))
+        return fuera
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# === CONFIG HASH DE CONTRASEÑAS ===
+# Rondas de pbkdf2_sha256; los hashes con menos se rehacen al hacer login
+PBKDF2_ROUNDS: int = int(os.getenv("PBKDF2_ROUNDS") or "29000")
+# Procesos dedicados al hash (0 = threadpool del loop, sin procesos)
+HASH_PROCESOS: int = int(os.getenv("HASH_PROCESOS") or "2")
+# Hashes en curso o en cola como máximo; el resto espera su turno
+HASH_MAX_PENDIENTES: int = int(os.getenv("HASH_MAX_PENDIENTES") or "16")
+# Espera máxima por un turno antes de rechazar con 503
+HASH_ESPERA_MAX_S: float = float(os.getenv("HASH_ESPERA_MAX_S") or "5")
+# Prioridad (nice) de los procesos de hash: con pocos núcleos el sistema
+# operativo da preferencia al proceso del event loop
+HASH_NICE: int = int(os.getenv("HASH_NICE") or "10")
+
+
+@lru_cache(maxsize=4)
+def contexto_claves(rounds: int = PBKDF2_ROUNDS) -> CryptContext:
+    return CryptContext(
+        schemes=["pbkdf2_sha256"],
+        deprecated="auto",
+        pbkdf2_sha256__default_rounds=rounds,
+        # needs_update() marca los hashes con menos rondas que las actuales
+        pbkdf2_sha256__min_rounds=rounds,
+    )
+
+
+# Se ejecutan en los procesos del pool: funciones de módulo (picklables)
+def _iniciar_proceso(nice: int) -> None:
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return contexto_claves(rounds).hash(password)
+
+
+def _verificar(plain: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    # (válida, hash nuevo si el guardado usa parámetros viejos)
+    return contexto_claves(rounds).verify_and_update(plain, hashed)
+
+
+class HashSaturado(Exception):
+    """No hubo turno para hashear en HASH_ESPERA_MAX_S (tormenta de logins)."""
+
+
+class ServicioClaves:
+    """
+    Hash y verificación de contraseñas fuera del proceso del event loop.
+
+    Un ProcessPoolExecutor acotado hace el trabajo de CPU (no compite por el
+    GIL con los streams) y un semáforo limita cuántas operaciones pueden
+    estar pendientes: si no hay turno en `espera_max_s` se lanza
+    HashSaturado en vez de acumular una cola sin fin.
+    """
+
+    def __init__(
+        self,
+        procesos: int = HASH_PROCESOS,
+        max_pendientes: int = HASH_MAX_PENDIENTES,
+        espera_max_s: float = HASH_ESPERA_MAX_S,
+        rounds: int = PBKDF2_ROUNDS,
+        nice: int = HASH_NICE,
+    ):
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self.espera_max_s = espera_max_s
+        self.rounds = rounds
+        self.nice = nice
+        self._pool: Optional[Executor] = None
+        self._turnos: Optional[asyncio.Semaphore] = None
+        self.stats = {
+            "hashes": 0,
+            "verificaciones": 0,
+            "rehashes": 0,
+            "rechazados": 0,
+            "espera_max_ms": 0.0,
+        }
+
+    def iniciar(self) -> None:
+        """Crea el pool de procesos (idempotente)."""
+        if self._pool is None and self.procesos > 0:
+            # spawn: no heredar los hilos del servidor (aiosqlite, anyio)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.procesos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_proceso,
+                initargs=(self.nice,),
+            )
+        if self._turnos is None:
+            self._turnos = asyncio.Semaphore(self.max_pendientes)
+
+    def detener(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _ejecutar(self, fn, *args):
+        self.iniciar()
+        assert self._turnos is not None
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        try:
+            await asyncio.wait_for(self._turnos.acquire(), self.espera_max_s)
+        except asyncio.TimeoutError:
+            self.stats["rechazados"] += 1
+            raise HashSaturado()
+        espera_ms = (loop.time() - t0) * 1000
+        self.stats["espera_max_ms"] = max(self.stats["espera_max_ms"], espera_ms)
+        try:
+            # pool None -> executor por defecto del loop (hilos)
+            return await loop.run_in_executor(self._pool, fn, *args)
+        finally:
+            self._turnos.release()
+
+    async def hash(self, password: str) -> str:
+        self.stats["hashes"] += 1
+        return await self._ejecutar(_hash, password, self.rounds)
+
+    async def verificar(self, plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        (válida, hash_nuevo). hash_nuevo no es None cuando la contraseña es
+        correcta pero el hash guardado usa parámetros viejos y hay que
+        reemplazarlo.
+        """
+        self.stats["verificaciones"] += 1
+        valida, nuevo = await self._ejecutar(_verificar, plain, hashed, self.rounds)
+        if nuevo:
+            self.stats["rehashes"] += 1
+        return valida, nuevo
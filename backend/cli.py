@@ -0,0 +1,203 @@
+"""
+Tareas de mantenimiento de la base de datos, fuera del servidor:
+
+    python -m backend.cli reindexar-busqueda
+    python -m backend.cli importar [rutas…] [--crear-usuarios]
+    python -m backend.cli archivar [--dias N]
+    python -m backend.cli reparar-estadisticas
+
+Usan la misma base de datos que la app (CHEFITO_DB_URL, también desde .env).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# Antes de importar database: CHEFITO_DB_URL puede venir de .env
+load_dotenv()
+
+from . import models  # noqa: E402  (registra las tablas en Base)
+from .archivo import ARCHIVO_DIAS, ArchivoConversaciones  # noqa: E402
+from .busqueda import IndiceBusqueda  # noqa: E402
+from .database import Base, async_engine, engine, migrar_esquema  # noqa: E402
+from .estadisticas import reparar_estadisticas  # noqa: E402
+from .importador import IMPORTAR_LOTE_MENSAJES, RUTAS_LEGADAS, ImportadorLegado  # noqa: E402
+
+
+def _preparar_esquema() -> None:
+    """Mismo esquema que al arrancar el servidor."""
+    Base.metadata.create_all(bind=engine)
+    migrar_esquema(engine)
+
+
+def reindexar_busqueda(_args) -> None:
+    _preparar_esquema()
+    inicio = time.perf_counter()
+
+    def progreso(hechos: int, total: int) -> None:
+        segundos = time.perf_counter() - inicio
+        print(
+            f"  {hechos:,}/{total:,} mensajes "
+            f"({hechos / max(segundos, 1e-9):,.0f}/s)",
+            flush=True,
+        )
+
+    print("Reconstruyendo el índice de búsqueda…")
+    resultado = IndiceBusqueda(activa=True).reconstruir(engine, progreso)
+    print(
+        f"✅ {resultado['mensajes']:,} mensajes y {resultado['titulos']:,} títulos "
+        f"indexados en {time.perf_counter() - inicio:.1f} s"
+    )
+
+
+def importar(args) -> None:
+    rutas = args.rutas or [r for r in RUTAS_LEGADAS if os.path.exists(r)]
+    if not rutas:
+        raise RuntimeError("No hay archivos que importar")
+    _preparar_esquema()
+    # Índice de búsqueda al día en la misma transacción que cada lote
+    busqueda = IndiceBusqueda()
+    busqueda.preparar(engine, aviso=None)
+    inicio = time.perf_counter()
+
+    def progreso(stats: dict, leidos: int, total: int) -> None:
+        segundos = time.perf_counter() - inicio
+        print(
+            f"  {leidos / 2**20:,.0f}/{total / 2**20:,.0f} MB · "
+            f"{stats['conversaciones']:,} conversaciones, {stats['mensajes']:,} mensajes "
+            f"({stats['mensajes'] / max(segundos, 1e-9):,.0f}/s)",
+            flush=True,
+        )
+
+    importador = ImportadorLegado(
+        engine,
+        busqueda,
+        crear_usuarios=args.crear_usuarios,
+        lote=args.lote,
+        progreso=progreso,
+    )
+    for ruta in rutas:
+        print(f"Importando {ruta}…")
+        importador.importar(ruta)
+    stats = importador.stats
+    print(
+        f"✅ {stats['conversaciones']:,} conversaciones y {stats['mensajes']:,} mensajes "
+        f"importados en {time.perf_counter() - inicio:.1f} s"
+    )
+    print(
+        f"   Saltadas: {stats['existentes']:,} ya importadas, {stats['ajenas']:,} con el id "
+        f"de otro usuario, {stats['sin_usuario']:,} de usuarios desconocidos, "
+        f"{stats['descartadas']:,} vacías o no válidas. "
+        f"Usuarios creados: {stats['usuarios_creados']:,}"
+    )
+
+
+def archivar(args) -> None:
+    if args.dias <= 0:
+        raise RuntimeError("--dias (o ARCHIVO_DIAS) tiene que ser mayor que 0")
+    _preparar_esquema()
+    busqueda = IndiceBusqueda()
+    busqueda.preparar(engine, aviso=None)
+    archivo = ArchivoConversaciones(busqueda, dias=args.dias)
+    inicio = time.perf_counter()
+
+    async def _archivar() -> int:
+        try:
+            return await archivo.archivar_antiguas()
+        finally:
+            await async_engine.dispose()
+
+    print(f"Archivando conversaciones sin actividad en {args.dias} días…")
+    total = asyncio.run(_archivar())
+    stats = archivo.stats
+    print(
+        f"✅ {total:,} conversaciones y {stats['mensajes_archivados']:,} mensajes archivados "
+        f"en {time.perf_counter() - inicio:.1f} s "
+        f"({stats['bytes_originales'] / 2**20:,.1f} MB de texto → "
+        f"{stats['bytes_comprimidos'] / 2**20:,.1f} MB)"
+    )
+
+
+def reparar(_args) -> None:
+    _preparar_esquema()
+    inicio = time.perf_counter()
+
+    def progreso(stats: dict) -> None:
+        revisadas = stats["conversaciones"] + stats["archivadas"]
+        print(
+            f"  {revisadas:,} conversaciones revisadas "
+            f"({revisadas / max(time.perf_counter() - inicio, 1e-9):,.0f}/s)",
+            flush=True,
+        )
+
+    print("Recalculando contadores y extractos de la barra lateral…")
+    stats = reparar_estadisticas(engine, progreso=progreso)
+    print(
+        f"✅ {stats['conversaciones'] + stats['archivadas']:,} conversaciones revisadas "
+        f"({stats['archivadas']:,} archivadas) en {time.perf_counter() - inicio:.1f} s; "
+        f"corregidas: {stats['reparadas'] + stats['archivadas_reparadas']:,}"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.cli")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandos.add_parser(
+        "reindexar-busqueda",
+        help="vacía y reconstruye el índice FTS5 de /search",
+    )
+    p.set_defaults(func=reindexar_busqueda)
+
+    p = comandos.add_parser(
+        "importar",
+        help="importa historiales legados conversaciones.json (también .json.gz)",
+    )
+    p.add_argument(
+        "rutas",
+        nargs="*",
+        help=f"archivos a importar (por defecto: {', '.join(RUTAS_LEGADAS)})",
+    )
+    p.add_argument(
+        "--crear-usuarios",
+        action="store_true",
+        help="crea los usuarios que no existen (sin contraseña utilizable)",
+    )
+    p.add_argument("--lote", type=int, default=IMPORTAR_LOTE_MENSAJES, help="mensajes por transacción")
+    p.set_defaults(func=importar)
+
+    p = comandos.add_parser(
+        "archivar",
+        help="comprime fuera de messages las conversaciones inactivas",
+    )
+    p.add_argument(
+        "--dias",
+        type=int,
+        default=ARCHIVO_DIAS,
+        help=f"días sin actividad (por defecto ARCHIVO_DIAS={ARCHIVO_DIAS}; "
+        "los mensajes archivados salen de la búsqueda hasta rehidratarse)",
+    )
+    p.set_defaults(func=archivar)
+
+    p = comandos.add_parser(
+        "reparar-estadisticas",
+        help="recalcula contadores y extractos de la barra lateral desde los mensajes",
+    )
+    p.set_defaults(func=reparar)
+
+    args = parser.parse_args(argv)
+    try:
+        args.func(args)
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
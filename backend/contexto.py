@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import List, Optional, Tuple
+
+from google.genai import types
+
+# === CONFIG DEL CONTEXTO ===
+# Turnos (usuario + bot) que se reenvían literalmente al modelo
+CONTEXTO_TURNOS_VERBATIM: int = int(os.getenv("CONTEXTO_TURNOS_VERBATIM") or "6")
+# Presupuesto aproximado de tokens para el historial literal
+CONTEXTO_MAX_TOKENS: int = int(os.getenv("CONTEXTO_MAX_TOKENS") or "6000")
+# Tamaño máximo del resumen acumulado (se descartan las líneas más viejas)
+RESUMEN_MAX_CHARS: int = int(os.getenv("RESUMEN_MAX_CHARS") or "2000")
+
+_TITULOS_RE = re.compile(r"\*\*(.+?)\*\*|^#+\s*(.+)$", re.MULTILINE)
+
+
+def estimar_tokens(texto: str) -> int:
+    # ~4 caracteres por token en español es suficiente para presupuestar
+    return len(texto) // 4 + 1
+
+
+def _recortar(texto: str, limite: int) -> str:
+    texto = " ".join(texto.split())
+    if len(texto) > limite:
+        return texto[:limite].rstrip() + "…"
+    return texto
+
+
+def resumir_turno(user: str, bot: str) -> str:
+    """
+    Resumen extractivo de un turno: la petición del usuario y los títulos
+    en negrita / encabezados de la respuesta (las recetas propuestas).
+    """
+    titulos: List[str] = []
+    for m in _TITULOS_RE.finditer(bot or ""):
+        t = (m.group(1) or m.group(2) or "").strip(" :*#")
+        if t and t not in titulos:
+            titulos.append(t)
+        if len(titulos) == 4:
+            break
+
+    linea = f"- Usuario: {_recortar(user or '', 160)}"
+    if titulos:
+        linea += f" | Chefito propuso: {_recortar('; '.join(titulos), 200)}"
+    elif bot:
+        linea += f" | Chefito: {_recortar(bot, 160)}"
+    return linea
+
+
+def _limitar_resumen(resumen: str) -> str:
+    lineas = resumen.splitlines()
+    while len("\n".join(lineas)) > RESUMEN_MAX_CHARS and len(lineas) > 1:
+        lineas.pop(0)
+    return "\n".join(lineas)
+
+
+def plegar_turnos(
+    resumen: Optional[str], historial: List[dict]
+) -> Optional[Tuple[str, int]]:
+    """
+    Incorpora al resumen los turnos que salen de la ventana tras guardar
+    el turno actual. `historial` son los turnos aún no resumidos (sin el
+    actual). Devuelve (nuevo_resumen, id del último mensaje resumido) o
+    None si no hay nada que plegar.
+    """
+    sobrantes = len(historial) + 1 - CONTEXTO_TURNOS_VERBATIM
+    if sobrantes <= 0:
+        return None
+
+    plegados = historial[:sobrantes]
+    lineas = [resumir_turno(t["user"], t["bot"] or "") for t in plegados]
+    nuevo = "\n".join(filter(None, [resumen or "", *lineas]))
+    return _limitar_resumen(nuevo), plegados[-1]["ultimo_id"]
+
+
+def construir_contexto(
+    historial: List[dict], resumen: Optional[str]
+) -> Tuple[List[types.Content], str]:
+    """
+    Devuelve los Content del historial reciente (de más nuevo a más viejo
+    hasta agotar el presupuesto) y el texto de resumen para el system prompt.
+    Los turnos que no caben se resumen al vuelo.
+    """
+    inicio = max(0, len(historial) - CONTEXTO_TURNOS_VERBATIM)
+    presupuesto = CONTEXTO_MAX_TOKENS
+    for i in range(len(historial) - 1, inicio - 1, -1):
+        item = historial[i]
+        coste = estimar_tokens(item["user"] or "") + estimar_tokens(item["bot"] or "")
+        if coste > presupuesto and i < len(historial) - 1:
+            inicio = i + 1
+            break
+        presupuesto -= coste
+
+    elegidos = historial[inicio:]
+    fuera = historial[:inicio]
+
+    lineas_resumen = [resumen] if resumen else []
+    lineas_resumen += [resumir_turno(t["user"], t["bot"] or "") for t in fuera]
+
+    contents: List[types.Content] = []
+    for item in elegidos:
+        if item["user"]:
+            contents.append(
+                types.Content(role="user", parts=[types.Part(text=item["user"])])
+            )
+        if item["bot"]:
+            contents.append(
+                types.Content(role="model", parts=[types.Part(text=item["bot"])])
+            )
+
+    return contents, "\n".join(lineas_resumen)
@@ -1,17 +1,107 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
+import asyncio
+import os
+from typing import Optional
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # 🔹 Usar SIEMPRE SQLite (tanto local como en Railway)
 # El archivo se llamará chefito.db y quedará en la raíz del proyecto (/app/chefito.db en Railway)
-DATABASE_URL = "sqlite:///./chefito.db"
+# CHEFITO_DB_URL permite apuntar a otro archivo (benchmarks, tests manuales).
+DATABASE_URL = os.getenv("CHEFITO_DB_URL") or "sqlite:///./chefito.db"
 
-# Engine para SQLite (ojo con connect_args)
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+
+def _url_async(url: str) -> str:
+    # Mismo archivo/servidor con driver asíncrono. mysql-connector no tiene
+    # dialecto async en SQLAlchemy: para MySQL usar aiomysql (mismo código).
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("mysql+mysqlconnector:") or url.startswith("mysql:"):
+        return "mysql+aiomysql:" + url.split(":", 1)[1]
+    return url
+
+
+# Engine async de los endpoints (CHEFITO_ASYNC_DB_URL para forzar driver)
+ASYNC_DATABASE_URL = os.getenv("CHEFITO_ASYNC_DB_URL") or _url_async(DATABASE_URL)
+
+# Pool de conexiones async por worker
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE") or "20")
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW") or "20")
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT") or "30")
+
+# === PRAGMAS DE SQLITE (producción) ===
+# WAL: los lectores no esperan al escritor. synchronous=NORMAL es seguro
+# con WAL (sólo se puede perder la última transacción ante un corte de luz).
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE") or "WAL",
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS") or "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS") or "5000"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE") or str(256 * 1024 * 1024)),
+    # Negativo = KiB (aquí 64 MiB por conexión)
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE") or "-65536"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE") or "MEMORY",
+}
+
+
+def _registrar_pragmas(sync_engine, pragmas: dict) -> None:
+    @event.listens_for(sync_engine, "connect")
+    def _aplicar_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        try:
+            for nombre, valor in pragmas.items():
+                cursor.execute(f"PRAGMA {nombre}={valor}")
+        finally:
+            cursor.close()
+
+
+def crear_engine(url: str = DATABASE_URL, pragmas: Optional[dict] = None, **kwargs):
+    """
+    Engine configurado. Para SQLite aplica `pragmas` (por defecto
+    SQLITE_PRAGMAS) en cada conexión nueva; `pragmas={}` deja los valores
+    por defecto de SQLite.
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True, **kwargs)
+
+    # Engine para SQLite (ojo con connect_args)
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        **kwargs,
+    )
+    _registrar_pragmas(engine, SQLITE_PRAGMAS if pragmas is None else pragmas)
+    return engine
+
+
+def crear_engine_async(
+    url: str = ASYNC_DATABASE_URL, pragmas: Optional[dict] = None, **kwargs
+):
+    """AsyncEngine con pool configurable y los mismos pragmas de SQLite."""
+    opciones = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        **kwargs,
+    }
+    if not url.startswith("sqlite"):
+        return create_async_engine(url, pool_pre_ping=True, **opciones)
+
+    engine = create_async_engine(url, **opciones)
+    _registrar_pragmas(
+        engine.sync_engine, SQLITE_PRAGMAS if pragmas is None else pragmas
+    )
+    return engine
+
+
+# Engine síncrono: migraciones al arrancar y scripts/benchmarks
+engine = crear_engine()
 
 # Sesión de SQLAlchemy
 SessionLocal = sessionmaker(
@@ -20,5 +110,62 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# Engine y sesiones async: todos los endpoints
+async_engine = crear_engine_async()
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 # Base para los modelos
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+# === ESCRITOR ÚNICO ===
+# Todas las escrituras de la app pasan por aquí: se ejecutan de una en una
+# (un lock por proceso), así que nunca compiten por el lock de SQLite.
+_lock_escritura: Optional[asyncio.Lock] = None
+
+
+def _lock() -> asyncio.Lock:
+    global _lock_escritura
+    if _lock_escritura is None:
+        _lock_escritura = asyncio.Lock()
+    return _lock_escritura
+
+
+async def escribir(fn, *args, **kwargs):
+    """
+    Ejecuta `await fn(db, *args, **kwargs)` en una transacción propia
+    (AsyncSession) serializada con el resto de escrituras, y hace commit.
+    """
+    async with _lock():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                return await fn(db, *args, **kwargs)
+
+
+def migrar_esquema(bind) -> None:
+    """
+    Migración mínima al arrancar: create_all no altera tablas existentes,
+    así que añadimos las columnas e índices nuevos de los modelos que falten.
+    Sólo sirve para columnas nullable o con server_default.
+    """
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existentes = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existentes:
+                    continue
+                tipo = col.type.compile(dialect=bind.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {tipo}"
+                if col.server_default is not None:
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import os
+from typing import Callable, Optional
+
+from .archivo import descomprimir
+from .titulos import vista_previa
+
+# === CONFIG ESTADÍSTICAS DE CONVERSACIÓN ===
+# Conversations.message_count, image_count y last_message_preview son copias
+# de lo que hay en messages (y en conversation_archives): la barra lateral
+# los lee sin tocar messages. Las mantiene guardar_mensajes_db; esto las
+# recalcula en bloque si alguna vez divergen (o tras añadir las columnas).
+ESTADISTICAS_LOTE: int = int(os.getenv("ESTADISTICAS_LOTE") or "2000")
+
+# Conversaciones en messages: un solo UPDATE por lote, atómico frente a los
+# turnos que escriba el servidor a la vez. Sólo toca las filas que cambian.
+_SQL_REPARAR = (
+    "UPDATE conversations SET message_count = n.total, image_count = n.imagenes, "
+    "last_message_preview = n.vista FROM ("
+    "SELECT c.id, count(m.id) AS total, coalesce(sum(m.has_image), 0) AS imagenes, "
+    "vista_previa((SELECT u.content FROM messages u WHERE u.conversation_id = c.id "
+    "ORDER BY u.created_at DESC, u.id DESC LIMIT 1)) AS vista "
+    "FROM conversations c LEFT JOIN messages m ON m.conversation_id = c.id "
+    "WHERE c.id > ? AND c.id <= ? AND c.archived_at IS NULL {filtro} GROUP BY c.id"
+    ") AS n WHERE conversations.id = n.id AND ("
+    "conversations.message_count IS NOT n.total OR conversations.image_count IS NOT n.imagenes "
+    "OR conversations.last_message_preview IS NOT n.vista)"
+)
+_SQL_LOTE = (
+    "SELECT c.id FROM conversations c WHERE c.id > ? AND c.archived_at IS {archivadas} "
+    "{filtro} ORDER BY c.id LIMIT ?"
+)
+_SQL_ARCHIVADAS = (
+    "SELECT c.id, c.message_count, c.image_count, c.last_message_preview, a.data "
+    "FROM conversations c JOIN conversation_archives a ON a.conversation_id = c.id "
+    "WHERE c.id > ? AND c.id <= ? AND c.archived_at IS NOT NULL {filtro}"
+)
+# Si se rehidrató entretanto, sus contadores ya son los del servidor
+_SQL_ACTUALIZAR_ARCHIVADA = (
+    "UPDATE conversations SET message_count = ?, image_count = ?, last_message_preview = ? "
+    "WHERE id = ? AND archived_at IS NOT NULL"
+)
+# Conversaciones anteriores a las columnas (o sin ningún turno guardado aún)
+_FILTRO_PENDIENTES = "AND c.message_count = 0"
+
+
+def reparar_estadisticas(
+    bind,
+    solo_pendientes: bool = False,
+    progreso: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Recalcula los contadores y el extracto desde messages y desde el
+    archivo, en lotes de ESTADISTICAS_LOTE conversaciones por transacción.
+    Con `solo_pendientes` sólo mira las que tienen message_count = 0 (lo
+    que se hace al arrancar). Devuelve cuántas revisó y cuántas corrigió.
+    """
+    if bind.dialect.name != "sqlite":
+        raise RuntimeError("La reparación de estadísticas necesita SQLite")
+    stats = {"conversaciones": 0, "reparadas": 0, "archivadas": 0, "archivadas_reparadas": 0}
+    filtro = _FILTRO_PENDIENTES if solo_pendientes else ""
+
+    desde = ""
+    while True:
+        with bind.begin() as conn:
+            ids = conn.exec_driver_sql(
+                _SQL_LOTE.format(archivadas="NULL", filtro=filtro), (desde, ESTADISTICAS_LOTE)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.connection.driver_connection.create_function(
+                "vista_previa", 1, vista_previa, deterministic=True
+            )
+            stats["reparadas"] += conn.exec_driver_sql(
+                _SQL_REPARAR.format(filtro=filtro), (desde, ids[-1])
+            ).rowcount
+        stats["conversaciones"] += len(ids)
+        desde = ids[-1]
+        if progreso:
+            progreso(stats)
+
+    desde = ""
+    while True:
+        with bind.begin() as conn:
+            ids = conn.exec_driver_sql(
+                _SQL_LOTE.format(archivadas="NOT NULL", filtro=filtro),
+                (desde, ESTADISTICAS_LOTE),
+            ).scalars().all()
+            if not ids:
+                break
+            cambios = []
+            for conv_id, total, imagenes, vista, datos in conn.exec_driver_sql(
+                _SQL_ARCHIVADAS.format(filtro=filtro), (desde, ids[-1])
+            ):
+                mensajes = descomprimir(datos)
+                nuevos = (
+                    len(mensajes),
+                    sum(1 for _, _, _, _, *resto in mensajes if resto and resto[0]),
+                    vista_previa(mensajes[-1][2]) if mensajes else None,
+                )
+                if nuevos != (total, imagenes, vista):
+                    cambios.append((*nuevos, conv_id))
+            if cambios:
+                conn.exec_driver_sql(_SQL_ACTUALIZAR_ARCHIVADA, cambios)
+        stats["archivadas"] += len(ids)
+        stats["archivadas_reparadas"] += len(cambios)
+        desde = ids[-1]
+        if progreso:
+            progreso(stats)
+    return stats
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from .transporte import Evento
+
+# === CONFIG GENERACIONES COMPARTIDAS (single-flight) ===
+GENERACIONES_COMPARTIDAS: bool = (os.getenv("GENERACIONES_COMPARTIDAS") or "1") == "1"
+# Tras terminar, un reintento con la misma Idempotency-Key recibe la misma
+# respuesta durante este tiempo en vez de generar (y guardar) otra. Sin clave
+# sólo se comparte mientras se genera: repetir "otra" a propósito es otro turno
+GENERACIONES_RETENCION_S: float = float(os.getenv("GENERACIONES_RETENCION_S") or "5")
+
+
+class GeneracionCompartida:
+    """
+    Una generación en curso y todos sus eventos hasta ahora: quien se une
+    tarde recibe primero lo ya emitido y luego sigue en directo.
+    """
+
+    def __init__(self):
+        self.eventos: List[Evento] = []
+        self.terminada = False
+        self.cancelada = False
+        self.suscriptores = 0
+        # Si sigue disponible tras terminar (sólo con clave de idempotencia)
+        self.retener = False
+        self.tarea: Optional[asyncio.Task] = None
+        self._aviso = asyncio.Event()
+
+    def publicar(self, evento: Evento) -> None:
+        self.eventos.append(evento)
+        self._aviso.set()
+        self._aviso = asyncio.Event()
+
+    def terminar(self) -> None:
+        self.terminada = True
+        self._aviso.set()
+
+    async def suscribir(self) -> AsyncIterator[Evento]:
+        self.suscriptores += 1
+        i = 0
+        try:
+            while True:
+                aviso = self._aviso
+                while i < len(self.eventos):
+                    yield self.eventos[i]
+                    i += 1
+                if self.terminada:
+                    return
+                await aviso.wait()
+        finally:
+            self.suscriptores -= 1
+            # Sin nadie escuchando se corta el modelo, como con un solo cliente
+            if not self.suscriptores and not self.terminada and self.tarea:
+                self.tarea.cancel()
+
+
+class RegistroGeneraciones:
+    """
+    Single-flight por clave (usuario, conversación, mensaje, imagen): si
+    llega la misma petición mientras otra se está generando (doble clic,
+    otra pestaña), se suscribe a esa en vez de abrir otro stream con el
+    modelo. El turno se genera y se guarda una sola vez. Con una clave de
+    idempotencia del cliente la generación terminada se retiene
+    `retencion_s` para los reintentos.
+    """
+
+    def __init__(
+        self,
+        evento_error: Evento,
+        retencion_s: float = GENERACIONES_RETENCION_S,
+    ):
+        self.evento_error = evento_error
+        self.retencion_s = retencion_s
+        self._generaciones: Dict[Hashable, GeneracionCompartida] = {}
+        self.stats = {
+            "generaciones": 0,
+            "unidos_en_curso": 0,
+            "unidos_terminada": 0,
+            "canceladas": 0,
+        }
+
+    def unirse(
+        self,
+        clave: Hashable,
+        fabrica: Callable[[], Awaitable[AsyncIterator[Evento]]],
+        retener: bool = False,
+    ) -> AsyncIterator[Evento]:
+        """
+        Eventos de la generación de `clave`. Si no hay ninguna, la arranca
+        en una tarea propia con `fabrica()`, que no depende de la conexión
+        de quien llegó primero. Con `retener` sigue disponible un rato al
+        terminar; si no, se olvida en cuanto termina.
+        """
+        generacion = self._generaciones.get(clave)
+        if generacion is None:
+            generacion = GeneracionCompartida()
+            generacion.retener = retener
+            self._generaciones[clave] = generacion
+            generacion.tarea = asyncio.create_task(
+                self._producir(clave, generacion, fabrica)
+            )
+            self.stats["generaciones"] += 1
+        elif generacion.terminada:
+            self.stats["unidos_terminada"] += 1
+        else:
+            self.stats["unidos_en_curso"] += 1
+        return generacion.suscribir()
+
+    def en_curso(self) -> int:
+        return sum(1 for g in self._generaciones.values() if not g.terminada)
+
+    async def _producir(self, clave, generacion: GeneracionCompartida, fabrica) -> None:
+        try:
+            eventos = await fabrica()
+            async for evento in eventos:
+                generacion.publicar(evento)
+        except asyncio.CancelledError:
+            generacion.cancelada = True
+            self.stats["canceladas"] += 1
+        except Exception as e:
+            print("Error en generación compartida:", repr(e))
+            generacion.publicar(self.evento_error)
+        finally:
+            generacion.terminar()
+            if generacion.cancelada or not generacion.retener or not self.retencion_s:
+                self._olvidar(clave, generacion)
+            else:
+                asyncio.get_running_loop().call_later(
+                    self.retencion_s, self._olvidar, clave, generacion
+                )
+
+    def _olvidar(self, clave, generacion: GeneracionCompartida) -> None:
+        if self._generaciones.get(clave) is generacion:
+            del self._generaciones[clave]
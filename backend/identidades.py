@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from cachetools import LRUCache, TTLCache
+
+# === CONFIG CACHÉ DE AUTENTICACIÓN ===
+# Entradas máximas de cada caché (LRU al llenarse); 0 desactiva ambas
+AUTH_CACHE_MAX: int = int(os.getenv("AUTH_CACHE_MAX") or "10000")
+# Segundos que se confía en una identidad sin volver a la tabla users;
+# 0 desactiva la caché de identidades
+AUTH_CACHE_TTL_S: float = float(os.getenv("AUTH_CACHE_TTL_S") or "300")
+
+
+@dataclass(frozen=True)
+class Identidad:
+    """Lo único que los endpoints necesitan del usuario autenticado."""
+
+    id: int
+    username: str
+
+
+class CacheIdentidades:
+    """
+    Dos cachés en memoria del worker:
+
+    - token → (username, exp): evita decodificar y verificar el JWT en cada
+      petición. Se respeta el `exp` del token en cada acierto.
+    - username → Identidad (con TTL): evita la consulta a users.
+
+    Juntas resuelven token → Identidad sin tocar la DB. `invalidar` borra la
+    identidad de un usuario (p. ej. si cambia o se elimina).
+    """
+
+    def __init__(self, max_entradas: int = AUTH_CACHE_MAX, ttl_s: float = AUTH_CACHE_TTL_S):
+        self.ttl_s = ttl_s
+        self._tokens: Optional[LRUCache] = (
+            LRUCache(maxsize=max_entradas) if max_entradas > 0 else None
+        )
+        self._usuarios: Optional[TTLCache] = (
+            TTLCache(maxsize=max_entradas, ttl=ttl_s)
+            if max_entradas > 0 and ttl_s > 0
+            else None
+        )
+        self.stats = {
+            "tokens_aciertos": 0,
+            "tokens_fallos": 0,
+            "usuarios_aciertos": 0,
+            "usuarios_fallos": 0,
+            "invalidaciones": 0,
+        }
+
+    # --- token → username ---
+    def username_de_token(self, token: str) -> Optional[str]:
+        entrada = self._tokens.get(token) if self._tokens is not None else None
+        if entrada is None:
+            self.stats["tokens_fallos"] += 1
+            return None
+        username, exp = entrada
+        if exp is not None and exp <= time.time():
+            # Token caducado: que lo rechace la verificación normal
+            self._tokens.pop(token, None)
+            self.stats["tokens_fallos"] += 1
+            return None
+        self.stats["tokens_aciertos"] += 1
+        return username
+
+    def guardar_token(self, token: str, username: str, exp: Optional[float]) -> None:
+        if self._tokens is not None:
+            self._tokens[token] = (username, exp)
+
+    # --- username → Identidad ---
+    def identidad(self, username: str) -> Optional[Identidad]:
+        ident = self._usuarios.get(username) if self._usuarios is not None else None
+        if ident is None:
+            self.stats["usuarios_fallos"] += 1
+        else:
+            self.stats["usuarios_aciertos"] += 1
+        return ident
+
+    def guardar_identidad(self, ident: Identidad) -> None:
+        if self._usuarios is not None:
+            self._usuarios[ident.username] = ident
+
+    def invalidar(self, username: str) -> None:
+        if self._usuarios is not None:
+            self._usuarios.pop(username, None)
+        self.stats["invalidaciones"] += 1
+
+    def limpiar(self) -> None:
+        for cache in (self._tokens, self._usuarios):
+            if cache is not None:
+                cache.clear()
+
+    def resumen(self) -> dict:
+        """Contadores más la tasa de acierto de cada caché."""
+
+        def tasa(aciertos: int, fallos: int) -> float:
+            total = aciertos + fallos
+            return round(aciertos / total, 4) if total else 0.0
+
+        s = self.stats
+        return {
+            **s,
+            "tokens_tasa_acierto": tasa(s["tokens_aciertos"], s["tokens_fallos"]),
+            "usuarios_tasa_acierto": tasa(s["usuarios_aciertos"], s["usuarios_fallos"]),
+            "tokens_en_cache": len(self._tokens) if self._tokens is not None else 0,
+            "usuarios_en_cache": len(self._usuarios) if self._usuarios is not None else 0,
+        }
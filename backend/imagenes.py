@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Tuple
+
+from cachetools import LRUCache
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# === CONFIG IMÁGENES ===
+# Tamaño máximo de la imagen subida (se corta la subida al pasarlo)
+IMAGEN_MAX_MB: float = float(os.getenv("IMAGEN_MAX_MB") or "15")
+# Lado mayor con el que se envía al modelo; más resolución no mejora el
+# reconocimiento de ingredientes y cuesta tokens y subida
+IMAGEN_LADO_MAX: int = int(os.getenv("IMAGEN_LADO_MAX") or "1024")
+IMAGEN_CALIDAD_JPEG: int = int(os.getenv("IMAGEN_CALIDAD_JPEG") or "85")
+# Decodificaciones simultáneas (cada una ocupa memoria y CPU)
+IMAGEN_PROCESOS_CONCURRENTES: int = int(os.getenv("IMAGEN_PROCESOS_CONCURRENTES") or "2")
+# Imágenes ya procesadas, por hash del archivo original (reintentos)
+IMAGEN_CACHE_MB: float = float(os.getenv("IMAGEN_CACHE_MB") or "32")
+
+_MB = 1024 * 1024
+# Margen para el resto de campos del formulario
+_MARGEN_FORMULARIO = 64 * 1024
+_TROZO_LECTURA = 256 * 1024
+
+
+class ImagenRechazada(Exception):
+    """La imagen no se puede enviar al modelo (`status_code` para la respuesta)."""
+
+    def __init__(self, status_code: int, detalle: str):
+        super().__init__(detalle)
+        self.status_code = status_code
+        self.detalle = detalle
+
+
+@dataclass(frozen=True)
+class ImagenProcesada:
+    datos: bytes
+    mime_type: str
+    sha256: str
+    ancho: int
+    alto: int
+    bytes_original: int
+
+
+def _hash_limitado(archivo: BinaryIO, max_bytes: int) -> Tuple[str, int]:
+    """sha256 del archivo leído por trozos; falla si pasa de `max_bytes`."""
+    archivo.seek(0)
+    h = hashlib.sha256()
+    total = 0
+    while True:
+        trozo = archivo.read(_TROZO_LECTURA)
+        if not trozo:
+            break
+        total += len(trozo)
+        if total > max_bytes:
+            raise ImagenRechazada(413, "La imagen es demasiado grande")
+        h.update(trozo)
+    return h.hexdigest(), total
+
+
+def _reducir(archivo: BinaryIO, lado: int, calidad: int) -> Tuple[bytes, int, int]:
+    """
+    Decodifica, endereza según EXIF, reduce a `lado` px y re-codifica en JPEG.
+    Con JPEG, `draft` decodifica ya a 1/2, 1/4 u 1/8 de escala: una foto de
+    12 MP nunca llega a ocupar su tamaño completo en memoria.
+    """
+    archivo.seek(0)
+    try:
+        with Image.open(archivo) as img:
+            img.draft("RGB", (lado, lado))
+            # in_place: sin orientación EXIF no copia la imagen decodificada
+            ImageOps.exif_transpose(img, in_place=True)
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                fondo = Image.new("RGB", img.size, (255, 255, 255))
+                fondo.paste(img, mask=img.getchannel("A"))
+                img = fondo
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+            salida = io.BytesIO()
+            img.save(salida, format="JPEG", quality=calidad)
+            return salida.getvalue(), img.width, img.height
+    except Image.DecompressionBombError:
+        raise ImagenRechazada(413, "La imagen tiene demasiados píxeles")
+    except (UnidentifiedImageError, OSError, ValueError):
+        raise ImagenRechazada(415, "Formato de imagen no soportado")
+
+
+class ProcesadorImagenes:
+    """
+    Prepara las imágenes subidas para el modelo: tamaño limitado, reducidas
+    y re-codificadas fuera del event loop, y cacheadas por el hash del
+    archivo original para que un reintento no repita el trabajo.
+    """
+
+    def __init__(
+        self,
+        max_mb: float = IMAGEN_MAX_MB,
+        lado: int = IMAGEN_LADO_MAX,
+        calidad: int = IMAGEN_CALIDAD_JPEG,
+        concurrentes: int = IMAGEN_PROCESOS_CONCURRENTES,
+        cache_mb: float = IMAGEN_CACHE_MB,
+    ):
+        self.max_bytes = int(max_mb * _MB)
+        self.lado = lado
+        self.calidad = calidad
+        self._sem = asyncio.Semaphore(max(1, concurrentes))
+        self._cache: LRUCache = LRUCache(
+            maxsize=max(1, int(cache_mb * _MB)), getsizeof=lambda e: len(e.datos)
+        )
+        self.stats = {
+            "procesadas": 0,
+            "aciertos_cache": 0,
+            "rechazadas": 0,
+            "bytes_entrada": 0,
+            "bytes_salida": 0,
+            "ms_max": 0.0,
+        }
+
+    async def procesar(self, archivo: BinaryIO) -> ImagenProcesada:
+        """
+        `archivo` es el fichero temporal del UploadFile (Starlette lo vuelca
+        a disco a partir de 1 MB), así que nunca se lee entero en memoria.
+        """
+        try:
+            sha, tam = await asyncio.to_thread(_hash_limitado, archivo, self.max_bytes)
+            cacheada = self._cache.get(sha)
+            if cacheada is not None:
+                self.stats["aciertos_cache"] += 1
+                return cacheada
+
+            async with self._sem:
+                t0 = time.perf_counter()
+                datos, ancho, alto = await asyncio.to_thread(
+                    _reducir, archivo, self.lado, self.calidad
+                )
+                ms = (time.perf_counter() - t0) * 1000
+        except ImagenRechazada:
+            self.stats["rechazadas"] += 1
+            raise
+
+        imagen = ImagenProcesada(datos, "image/jpeg", sha, ancho, alto, tam)
+        if len(datos) <= self._cache.maxsize:
+            self._cache[sha] = imagen
+        self.stats["procesadas"] += 1
+        self.stats["bytes_entrada"] += tam
+        self.stats["bytes_salida"] += len(datos)
+        self.stats["ms_max"] = max(self.stats["ms_max"], round(ms, 1))
+        return imagen
+
+    def resumen(self) -> dict:
+        return {
+            **self.stats,
+            "cache_entradas": len(self._cache),
+            "cache_mb": round(self._cache.currsize / _MB, 3),
+        }
+
+
+class LimiteCuerpo:
+    """
+    Middleware ASGI que corta las subidas demasiado grandes mientras llegan,
+    antes de que el parser de formularios las vuelque enteras a disco: por
+    Content-Length si viene, y si no contando los bytes recibidos.
+    """
+
+    def __init__(self, app, rutas: Iterable[str], max_bytes: int):
+        self.app = app
+        self.rutas = set(rutas)
+        self.max_bytes = max_bytes + _MARGEN_FORMULARIO
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.rutas:
+            await self.app(scope, receive, send)
+            return
+
+        for nombre, valor in scope.get("headers", []):
+            if nombre == b"content-length" and valor.isdigit():
+                if int(valor) > self.max_bytes:
+                    await self._responder_413(send)
+                    return
+
+        recibidos = 0
+        excedido = False
+        respondido = False
+
+        async def receive_limitado():
+            nonlocal recibidos, excedido
+            mensaje = await receive()
+            if mensaje["type"] == "http.request":
+                recibidos += len(mensaje.get("body", b""))
+                if recibidos > self.max_bytes:
+                    excedido = True
+                    raise ImagenRechazada(413, "La imagen es demasiado grande")
+            return mensaje
+
+        async def send_limitado(mensaje):
+            nonlocal respondido
+            if excedido:
+                # La app responde con su propio error al fallar el parseo:
+                # se sustituye por el 413
+                if not respondido:
+                    respondido = True
+                    await self._responder_413(send)
+                return
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive_limitado, send_limitado)
+        except ImagenRechazada:
+            if not respondido:
+                respondido = True
+                await self._responder_413(send)
+
+    @staticmethod
+    async def _responder_413(send) -> None:
+        cuerpo = json.dumps({"detail": "La imagen es demasiado grande"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(cuerpo)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": cuerpo})
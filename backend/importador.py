@@ -0,0 +1,338 @@
+"""
+Importación de los historiales anteriores a la base de datos
+(data/conversaciones.json y backend/data/conversaciones.json):
+
+    {"<id conversación>": {"username": "...", "history": [{"user": "...", "bot": "..."}]}}
+
+El archivo se lee por trozos (también .json.gz) y se escribe en lotes de
+IMPORTAR_LOTE_MENSAJES mensajes por transacción, así que la memoria no
+depende del tamaño del archivo. Es idempotente: las conversaciones que
+ya existen se saltan enteras, y repetir la importación no duplica nada.
+
+    python -m backend.cli importar [rutas…] [--crear-usuarios]
+"""
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+import re
+import secrets
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+
+from . import models
+from .busqueda import IndiceBusqueda
+from .claves import contexto_claves
+from .titulos import normalizar_titulo, titulo_heuristico, vista_previa
+
+# === CONFIG IMPORTACIÓN ===
+# Mensajes por transacción: lotes grandes amortizan el commit y el
+# volcado del índice de búsqueda; la memoria crece con el lote
+IMPORTAR_LOTE_MENSAJES: int = int(os.getenv("IMPORTAR_LOTE_MENSAJES") or "20000")
+# Tope de conversaciones por lote (parámetros del IN de la consulta)
+IMPORTAR_MAX_CONVERSACIONES_LOTE = 5000
+
+# Rutas de los historiales anteriores a la base de datos
+RUTAS_LEGADAS = ("data/conversaciones.json", "backend/data/conversaciones.json")
+
+_TROZO_LECTURA = 1024 * 1024
+_DECODIFICADOR = json.JSONDecoder()
+_ESPACIOS = re.compile(r"[ \t\n\r]*")
+# Mismo formato que models.FechaHora (texto comparable con CURRENT_TIMESTAMP)
+_FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+_SQL_CONVERSACIONES = (
+    "INSERT INTO conversations (id, user_id, title, display_title, created_at, updated_at, "
+    "message_count, last_message_preview) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_MENSAJES = (
+    "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)"
+)
+# Longitud de Conversation.id
+_MAX_ID = 64
+# Las cuentas creadas al importar no tienen contraseña conocida: las
+# rondas no protegen nada y con las de producción crear miles tarda minutos
+_RONDAS_CUENTA_IMPORTADA = 1000
+
+
+# === LECTURA POR TROZOS ===
+class _LectorJSON:
+    """
+    Lee valores JSON consecutivos de un texto sin cargarlo entero: cada
+    valor se decodifica con raw_decode sobre un búfer que sólo guarda lo
+    pendiente. Si un valor no cabe, el búfer crece al doble y se reintenta.
+    """
+
+    def __init__(self, texto: io.TextIOBase, trozo: int = _TROZO_LECTURA):
+        self._texto = texto
+        self._trozo = trozo
+        self._buf = ""
+        self._pos = 0
+        self._fin = False
+
+    def _leer_mas(self) -> None:
+        pendiente = self._buf[self._pos:]
+        leido = self._texto.read(max(self._trozo, len(pendiente)))
+        if not leido:
+            self._fin = True
+        self._buf = pendiente + leido
+        self._pos = 0
+
+    def _saltar_espacios(self) -> bool:
+        """Avanza hasta el siguiente carácter útil; False al final del texto."""
+        while True:
+            self._pos = _ESPACIOS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return True
+            if self._fin:
+                return False
+            self._leer_mas()
+
+    def signo(self, consumir: bool = True) -> str:
+        """Siguiente carácter que no es espacio ("" al final del texto)."""
+        if not self._saltar_espacios():
+            return ""
+        c = self._buf[self._pos]
+        if consumir:
+            self._pos += 1
+        return c
+
+    def valor(self) -> Any:
+        if not self._saltar_espacios():
+            raise ValueError("JSON cortado: falta un valor al final del archivo")
+        while True:
+            try:
+                valor, fin = _DECODIFICADOR.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fin:
+                    raise
+                self._leer_mas()
+                continue
+            # Un número al final del búfer puede seguir en el siguiente trozo
+            if fin == len(self._buf) and not self._fin:
+                self._leer_mas()
+                continue
+            self._pos = fin
+            return valor
+
+
+def leer_conversaciones(texto: io.TextIOBase) -> Iterator[Tuple[str, Any]]:
+    """Pares (id, conversación) del objeto raíz, de uno en uno."""
+    lector = _LectorJSON(texto)
+    if lector.signo() != "{":
+        raise ValueError("Se esperaba un objeto {id: conversación} en la raíz")
+    if lector.signo(consumir=False) == "}":
+        return
+    while True:
+        clave = lector.valor()
+        if not isinstance(clave, str) or lector.signo() != ":":
+            raise ValueError("JSON no válido: se esperaba una clave de conversación")
+        yield clave, lector.valor()
+        separador = lector.signo()
+        if separador == "}":
+            return
+        if separador != ",":
+            raise ValueError(f"JSON no válido: se esperaba ',' o '}}' y hay {separador!r}")
+
+
+@contextmanager
+def _abrir(ruta: str):
+    """(texto, archivo en disco): el segundo da los bytes leídos (progreso)."""
+    with open(ruta, "rb") as crudo:
+        flujo = gzip.GzipFile(fileobj=crudo) if ruta.endswith(".gz") else crudo
+        with io.TextIOWrapper(flujo, encoding="utf-8-sig") as texto:
+            yield texto, crudo
+
+
+def _turnos(historial: Any) -> List[Tuple[str, str]]:
+    """(pregunta, respuesta) de cada turno con algo de texto."""
+    if not isinstance(historial, list):
+        return []
+    turnos = []
+    for turno in historial:
+        if not isinstance(turno, dict):
+            continue
+        pregunta = turno.get("user") or ""
+        respuesta = turno.get("bot") or ""
+        if not isinstance(pregunta, str) or not isinstance(respuesta, str):
+            continue
+        if pregunta or respuesta:
+            turnos.append((pregunta, respuesta))
+    return turnos
+
+
+# === IMPORTADOR ===
+class ImportadorLegado:
+    """
+    Vuelca historiales legados en users/conversations/messages.
+
+    Cada lote es una transacción: resuelve los usuarios por nombre, salta
+    las conversaciones que ya existen (las de otro usuario se cuentan como
+    `ajenas`) e inserta las nuevas con sus mensajes en INSERT masivos. El
+    índice de búsqueda se actualiza en la misma transacción. Los usuarios
+    que no existen se omiten salvo con `crear_usuarios`.
+    """
+
+    def __init__(
+        self,
+        bind,
+        busqueda: Optional[IndiceBusqueda] = None,
+        crear_usuarios: bool = False,
+        lote: int = IMPORTAR_LOTE_MENSAJES,
+        progreso: Optional[Callable[[dict, int, int], None]] = None,
+    ):
+        self.bind = bind
+        self.busqueda = busqueda or IndiceBusqueda(activa=False)
+        self.crear_usuarios = crear_usuarios
+        self.lote = max(1, lote)
+        # progreso(stats, bytes leídos, bytes del archivo) tras cada lote
+        self.progreso = progreso
+        # username -> id (None: no existe y no se crea)
+        self._usuarios: Dict[str, Optional[int]] = {}
+        self._contexto_claves = contexto_claves(_RONDAS_CUENTA_IMPORTADA)
+        self.stats = {
+            "conversaciones": 0,
+            "mensajes": 0,
+            # Ya importadas (mismo id y usuario)
+            "existentes": 0,
+            # El id ya lo usa una conversación de otro usuario
+            "ajenas": 0,
+            "sin_usuario": 0,
+            # Sin username, sin turnos o con un formato desconocido
+            "descartadas": 0,
+            "usuarios_creados": 0,
+            "lotes": 0,
+        }
+
+    def importar(self, ruta: str) -> dict:
+        """Importa un archivo; devuelve las stats acumuladas."""
+        # Las conversaciones legadas no guardan fechas: la del archivo
+        fecha = datetime.utcfromtimestamp(os.path.getmtime(ruta)).strftime(_FORMATO_FECHA)
+        total = os.path.getsize(ruta)
+        with _abrir(ruta) as (texto, crudo):
+            pendientes: List[tuple] = []
+            mensajes = 0
+            for conv_id, datos in leer_conversaciones(texto):
+                conv = self._conversacion(conv_id, datos)
+                if conv is None:
+                    self.stats["descartadas"] += 1
+                    continue
+                pendientes.append(conv)
+                mensajes += 2 * len(conv[2])
+                if mensajes >= self.lote or len(pendientes) >= IMPORTAR_MAX_CONVERSACIONES_LOTE:
+                    self._escribir(pendientes, fecha)
+                    pendientes, mensajes = [], 0
+                    if self.progreso:
+                        self.progreso(self.stats, crudo.tell(), total)
+            if pendientes:
+                self._escribir(pendientes, fecha)
+            if self.progreso:
+                self.progreso(self.stats, total, total)
+        return self.stats
+
+    @staticmethod
+    def _conversacion(conv_id: str, datos: Any) -> Optional[tuple]:
+        """(id, username, turnos) o None si no se puede importar."""
+        if not isinstance(datos, dict) or not conv_id or len(conv_id) > _MAX_ID:
+            return None
+        username = datos.get("username")
+        turnos = _turnos(datos.get("history"))
+        if not isinstance(username, str) or not username.strip() or not turnos:
+            return None
+        return conv_id, username.strip(), turnos
+
+    def _escribir(self, lote: List[tuple], fecha: str) -> None:
+        with self.bind.begin() as conn:
+            usuarios = self._resolver_usuarios(conn, {username for _, username, _ in lote})
+            duenos = dict(
+                conn.execute(
+                    select(models.Conversation.id, models.Conversation.user_id).where(
+                        models.Conversation.id.in_([conv_id for conv_id, _, _ in lote])
+                    )
+                ).all()
+            )
+            desde_mensaje = conn.scalar(select(func.coalesce(func.max(models.Message.id), 0)))
+            desde_conversacion = (
+                conn.exec_driver_sql("SELECT coalesce(max(rowid), 0) FROM conversations").scalar()
+                if self.busqueda.activa
+                else 0
+            )
+
+            conversaciones = []
+            mensajes = []
+            for conv_id, username, turnos in lote:
+                user_id = usuarios.get(username)
+                if user_id is None:
+                    self.stats["sin_usuario"] += 1
+                    continue
+                dueno = duenos.get(conv_id)
+                if dueno is not None:
+                    self.stats["existentes" if dueno == user_id else "ajenas"] += 1
+                    continue
+                duenos[conv_id] = user_id
+                titulo, _ = titulo_heuristico(*turnos[0])
+                conversaciones.append(
+                    (
+                        conv_id,
+                        user_id,
+                        titulo,
+                        normalizar_titulo(titulo),
+                        fecha,
+                        fecha,
+                        2 * len(turnos),
+                        vista_previa(turnos[-1][1]),
+                    )
+                )
+                for pregunta, respuesta in turnos:
+                    mensajes.append((conv_id, "user", pregunta, fecha))
+                    mensajes.append((conv_id, "assistant", respuesta, fecha))
+
+            if conversaciones:
+                # executemany del driver: los INSERT de SQLAlchemy procesan
+                # cada fila y costaban tanto como el índice de búsqueda
+                conn.exec_driver_sql(_SQL_CONVERSACIONES, conversaciones)
+                conn.exec_driver_sql(_SQL_MENSAJES, mensajes)
+                self.busqueda.indexar_importados(conn, desde_mensaje, desde_conversacion)
+        self.stats["conversaciones"] += len(conversaciones)
+        self.stats["mensajes"] += len(mensajes)
+        self.stats["lotes"] += 1
+
+    def _resolver_usuarios(self, conn, nombres: Iterable[str]) -> Dict[str, Optional[int]]:
+        faltan = [n for n in nombres if n not in self._usuarios]
+        if faltan:
+            self._usuarios.update(self._buscar_usuarios(conn, faltan))
+            nuevos = [n for n in faltan if n not in self._usuarios]
+            if nuevos and self.crear_usuarios:
+                conn.execute(
+                    insert(models.User),
+                    [
+                        {
+                            "username": n,
+                            "password_hash": self._contexto_claves.hash(
+                                secrets.token_urlsafe(24)
+                            ),
+                        }
+                        for n in nuevos
+                    ],
+                )
+                self.stats["usuarios_creados"] += len(nuevos)
+                self._usuarios.update(self._buscar_usuarios(conn, nuevos))
+            for n in nuevos:
+                self._usuarios.setdefault(n, None)
+        return self._usuarios
+
+    @staticmethod
+    def _buscar_usuarios(conn, nombres: List[str]) -> Dict[str, int]:
+        return {
+            username: user_id
+            for user_id, username in conn.execute(
+                select(models.User.id, models.User.username).where(
+                    models.User.username.in_(nombres)
+                )
+            )
+        }
+
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from fastapi import (
     FastAPI,
+    Query,
     UploadFile,
     Form,
     File,
@@ -9,34 +10,133 @@ from fastapi import (
     HTTPException,
     status,
     Request,
+    Header,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from google.genai import Client, types, errors as genai_errors
+from google.genai import types, errors as genai_errors
 from dotenv import load_dotenv
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+import anyio
 import asyncio
+import hashlib
 import os
-
-from .database import Base, engine, SessionLocal
-from . import models, schemas
+import secrets
+import time
+
+from .database import (
+    AsyncSessionLocal,
+    Base,
+    engine,
+    SessionLocal,
+    escribir,
+    migrar_esquema,
+)
+from . import contexto, models, schemas
+from .archivo import ARCHIVO_DIAS, ARCHIVO_INTERVALO_MIN, ArchivoConversaciones
+from .busqueda import IndiceBusqueda
+from .cache_respuestas import RESPUESTAS_CACHE_ACTIVA, CacheRespuestas
+from .claves import HashSaturado, ServicioClaves
+from .clasificador import (
+    CLASIFICADOR_ACTIVO,
+    CLASIFICADOR_MAX_MUESTRAS,
+    MENSAJE_FUERA_DE_TEMA,
+    ClasificadorTema,
+    muestras_de_mensajes,
+)
+from .estadisticas import reparar_estadisticas
+from .identidades import CacheIdentidades, Identidad
+from .metricas import (
+    BUCKETS_BYTES,
+    BUCKETS_CANTIDAD,
+    METRICAS_TOKEN,
+    MedirPeticiones,
+    marcar,
+    medir,
+    metricas,
+    span,
+    traza_guardada,
+)
+from .generaciones import GENERACIONES_COMPARTIDAS, RegistroGeneraciones
+from .imagenes import (
+    ImagenProcesada,
+    ImagenRechazada,
+    LimiteCuerpo,
+    ProcesadorImagenes,
+)
+from .pasarela import LimiteUsuario, ModeloSaturado, PasarelaModelo
+from .persistencia import ColaTurnos, TurnoPendiente
+from .proveedores import crear_proveedor
+from .transporte import (
+    DELTA,
+    DONE,
+    ERROR,
+    USAGE,
+    Evento,
+    agrupar_con_latido,
+    como_sse,
+    como_texto,
+)
+from .titulos import (
+    TITULO_CONFIANZA_MIN,
+    TITULO_POR_DEFECTO,
+    limpiar_titulo_ia,
+    normalizar_titulo,
+    titulo_heuristico,
+    vista_previa,
+)
 
 # === CONFIGURACIÓN BASE / ENV ===
 load_dotenv()
 Base.metadata.create_all(bind=engine)
+migrar_esquema(engine)
+
+
+def rellenar_display_titles() -> None:
+    """Calcula display_title de conversaciones creadas antes de la columna."""
+    db = SessionLocal()
+    try:
+        pendientes = (
+            db.query(models.Conversation.id, models.Conversation.title)
+            .filter(models.Conversation.display_title.is_(None))
+            .all()
+        )
+        if pendientes:
+            db.execute(
+                update(models.Conversation),
+                [
+                    {"id": conv_id, "display_title": normalizar_titulo(title)}
+                    for conv_id, title in pendientes
+                ],
+            )
+            db.commit()
+    finally:
+        db.close()
 
-# --- API KEY GEMINI ---
-_api_key = os.getenv("GEMINI_API_KEY")
-if not _api_key:
-    raise RuntimeError("❌ Error: GEMINI_API_KEY no está definida en el archivo .env")
-API_KEY: str = _api_key
+
+rellenar_display_titles()
+
+# Contadores y extracto de la barra lateral de conversaciones anteriores a
+# las columnas (el resto los mantiene guardar_mensajes_db)
+if engine.dialect.name == "sqlite":
+    reparar_estadisticas(engine, solo_pendientes=True)
+
+# Índice de búsqueda FTS5 (ver busqueda.py); lo mantienen los helpers de escritura
+busqueda = IndiceBusqueda()
+busqueda.preparar(engine)
+
+# Conversaciones inactivas comprimidas fuera de messages (ver archivo.py)
+archivo = ArchivoConversaciones(busqueda)
 
 # --- CONFIG JWT / AUTH ---
 SECRET_KEY: str = os.getenv("SECRET_KEY") or "super_secret"
@@ -45,9 +145,37 @@ ACCESS_TOKEN_EXPIRE_MINUTES: int = int(
     os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "1440"
 )
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
-app = FastAPI()
+# Hash de contraseñas en procesos aparte (ver claves.py)
+servicio_claves = ServicioClaves()
+
+# Cachés token → username → Identidad (ver identidades.py)
+identidades = CacheIdentidades()
+
+# --- STREAMS ---
+# Guardar la respuesta parcial cuando el navegador corta el stream
+GUARDAR_RESPUESTAS_TRUNCADAS: bool = (
+    os.getenv("GUARDAR_RESPUESTAS_TRUNCADAS") or "1"
+) == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cola_turnos.iniciar()
+    servicio_claves.iniciar()
+    # En segundo plano: el servidor atiende ya con el modelo semilla
+    tarea_clasificador = asyncio.create_task(entrenar_clasificador())
+    tarea_archivo = None
+    if ARCHIVO_DIAS > 0 and ARCHIVO_INTERVALO_MIN > 0:
+        tarea_archivo = asyncio.create_task(archivo.periodico())
+    yield
+    tarea_clasificador.cancel()
+    if tarea_archivo:
+        tarea_archivo.cancel()
+    # Guardar los turnos pendientes antes de salir
+    await cola_turnos.detener()
+    servicio_claves.detener()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # === FRONTEND / ESTÁTICOS ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -66,6 +194,15 @@ async def serve_login():
     login_path = os.path.join(FRONTEND_DIR, "login.html")
     return FileResponse(login_path)
 
+# === LÍMITE DE SUBIDA ===
+# Corta las imágenes demasiado grandes antes de parsear el formulario
+imagenes = ProcesadorImagenes()
+app.add_middleware(
+    LimiteCuerpo,
+    rutas=["/stream_chat/", "/stream_chat/sse/"],
+    max_bytes=imagenes.max_bytes,
+)
+
 # === CORS ===
 app.add_middleware(
     CORSMiddleware,
@@ -75,22 +212,115 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# === GEMINI CLIENT ===
-client = Client(api_key=API_KEY)
+# === MÉTRICAS ===
+# El último añadido es el más externo: mide también CORS y el límite de subida
+app.add_middleware(MedirPeticiones)
+
+# === MODELO ===
+# Gemini o el modelo local falso según MODELO_PROVEEDOR (ver proveedores.py)
+proveedor = crear_proveedor()
+
+# Toda llamada al modelo pasa por aquí: cubeta por usuario, tope global,
+# cola justa y reintentos ante 503 (ver pasarela.py)
+pasarela = PasarelaModelo(lambda: proveedor)
+
+MENSAJE_MODELO_SOBRECARGADO = (
+    "❌ El modelo de IA está sobrecargado o no disponible en este momento. "
+    "Inténtalo de nuevo en unos segundos."
+)
+MENSAJE_LIMITE_USUARIO = (
+    "⏳ Estás enviando mensajes muy rápido. "
+    "Espera unos segundos y vuelve a intentarlo."
+)
+MENSAJE_ERROR_INTERNO = (
+    "❌ Ocurrió un error al generar la respuesta. "
+    "Por favor, inténtalo de nuevo más tarde."
+)
+MARCA_RESPUESTA_TRUNCADA = "\n\n_(respuesta interrumpida)_"
+
+# Contadores de streams del worker (completados vs. cortados por el cliente)
+stream_stats = {
+    "completados": 0,
+    "abortados": 0,
+    "tokens_completados": 0,
+    "tokens_ahorrados_estimados": 0,
+}
+
+# Histogramas del chat para /metrics (ver metricas.py)
+db_consulta_segundos = metricas.histograma(
+    "db_consulta_segundos", "Tiempo de las consultas del chat", etiquetas=("operacion",)
+)
+stream_primer_trozo_segundos = metricas.histograma(
+    "stream_primer_trozo_segundos",
+    "Desde que se pide el stream al modelo hasta el primer trozo (incluye la cola)",
+)
+stream_trozos = metricas.histograma(
+    "stream_trozos", "Trozos recibidos del modelo por stream", BUCKETS_CANTIDAD, ("resultado",)
+)
+stream_bytes = metricas.histograma(
+    "stream_bytes", "Bytes de texto recibidos del modelo por stream", BUCKETS_BYTES, ("resultado",)
+)
+contexto_turnos = metricas.histograma(
+    "contexto_turnos", "Turnos de historial enviados literalmente al modelo", BUCKETS_CANTIDAD
+)
+contexto_bytes = metricas.histograma(
+    "contexto_bytes",
+    "Bytes enviados al modelo por turno (system prompt, historial, mensaje e imagen)",
+    BUCKETS_BYTES,
+)
+
+
+def contar_tokens_chunk(chunk, tokens_previos: int) -> int:
+    """
+    Tokens de salida acumulados tras recibir `chunk`.
+    Usa usage_metadata si el modelo lo envía; si no, estima ~4 caracteres/token.
+    """
+    usage = getattr(chunk, "usage_metadata", None)
+    total = getattr(usage, "candidates_token_count", None) if usage else None
+    if total:
+        return total
+    return tokens_previos + len(chunk.text or "") // 4
+
+
+def registrar_stream_completado(tokens: int) -> None:
+    stream_stats["completados"] += 1
+    stream_stats["tokens_completados"] += tokens
+
+
+def registrar_stream_abortado(tokens_generados: int) -> None:
+    """
+    El ahorro se estima como la longitud media de una respuesta completa
+    menos lo que ya se había generado al cortar.
+    """
+    stream_stats["abortados"] += 1
+    if stream_stats["completados"]:
+        media = stream_stats["tokens_completados"] // stream_stats["completados"]
+        stream_stats["tokens_ahorrados_estimados"] += max(0, media - tokens_generados)
 
 # === DEPENDENCIAS DB Y AUTH ===
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def raise_servidor_ocupado():
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Demasiados inicios de sesión a la vez, inténtalo en unos segundos",
+        headers={"Retry-After": "2"},
+    )
+
+async def hash_password(password: str) -> str:
+    try:
+        return await servicio_claves.hash(password)
+    except HashSaturado:
+        raise_servidor_ocupado()
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> tuple:
+    """(válida, hash nuevo o None); ver ServicioClaves.verificar."""
+    try:
+        return await servicio_claves.verificar(plain, hashed)
+    except HashSaturado:
+        raise_servidor_ocupado()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -100,9 +330,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(
-    request: Request, db: Session = Depends(get_db)
-) -> models.User:
+async def get_current_user(request: Request) -> Identidad:
+    """
+    Identidad (id, username) del token. Con las cachés calientes no decodifica
+    el JWT ni consulta la tabla users.
+    """
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.lower().startswith("bearer "):
         raise HTTPException(
@@ -110,25 +342,61 @@ async def get_current_user(
         )
 
     token = auth_header.split(" ", 1)[1]
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: Optional[str] = payload.get("sub")
-        if username is None:
+    username = identidades.username_de_token(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido"
+                )
+        except JWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido"
             )
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido"
-        )
+        identidades.guardar_token(token, username, payload.get("exp"))
+
+    ident = identidades.identidad(username)
+    if ident is None:
+        # Sesión propia y corta: no retiene una conexión del pool mientras
+        # el endpoint espera al escritor
+        async with AsyncSessionLocal() as db:
+            row = (
+                await db.execute(
+                    select(models.User.id, models.User.username).where(
+                        models.User.username == username
+                    )
+                )
+            ).first()
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado"
+            )
+        ident = Identidad(id=row.id, username=row.username)
+        identidades.guardar_identidad(ident)
 
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado"
-        )
+    return ident
+
+# === PAGINACIÓN (keyset) ===
+# Cursor opaco "<fecha ISO>|<id>" del último elemento de la página anterior
+def crear_cursor(fecha: datetime, ident) -> str:
+    return f"{fecha.isoformat()}|{ident}"
+
+
+def leer_cursor(cursor: str) -> tuple:
+    try:
+        fecha, ident = cursor.split("|", 1)
+        return datetime.fromisoformat(fecha), ident
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def antes_de_cursor(col_fecha, col_id, fecha: datetime, ident):
+    # (fecha, id) < cursor, escrito sin tuple_ para que la fecha se envíe
+    # con el tipo de la columna
+    return or_(col_fecha < fecha, and_(col_fecha == fecha, col_id < ident))
 
-    return user
 
 # === Pydantic para títulos ===
 class TitleRequest(BaseModel):
@@ -140,231 +408,707 @@ class TitleResponse(BaseModel):
 
 # === AUTH ===
 @app.post("/auth/register", response_model=schemas.Token)
-def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = (
-        db.query(models.User)
-        .filter(models.User.username == user_in.username)
-        .first()
+async def register(user_in: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(
+        select(models.User.id).where(models.User.username == user_in.username)
     )
+    # Devolver la conexión al pool antes de esperar turno para el hash
+    await db.close()
     if existing:
         raise HTTPException(status_code=400, detail="El usuario ya existe")
 
-    user = models.User(
-        username=user_in.username,
-        email=user_in.email,
-        password_hash=hash_password(user_in.password),
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    password_hash = await hash_password(user_in.password)
+    try:
+        user = await escribir(
+            crear_usuario_db,
+            user_in.username,
+            user_in.email,
+            password_hash,
+        )
+    except IntegrityError:
+        # Otro registro con el mismo usuario/email ganó la carrera
+        raise HTTPException(status_code=400, detail="El usuario ya existe")
 
+    # Por si quedaba una identidad vieja con ese username (usuario recreado)
+    identidades.invalidar(user.username)
     access_token = create_access_token({"sub": user.username})
     return schemas.Token(access_token=access_token, user=user)
 
 @app.post("/auth/login", response_model=schemas.Token)
-def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = (
-        db.query(models.User)
-        .filter(models.User.username == user_in.username)
-        .first()
+async def login(user_in: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(
+        select(models.User).where(models.User.username == user_in.username)
     )
-    if not user or not verify_password(user_in.password, user.password_hash):
+    await db.close()
+    if not user:
+        raise HTTPException(status_code=400, detail="Credenciales inválidas")
+    valida, nuevo_hash = await verify_password(user_in.password, user.password_hash)
+    if not valida:
         raise HTTPException(status_code=400, detail="Credenciales inválidas")
+    if nuevo_hash:
+        # Hash con parámetros viejos (p. ej. menos rondas): actualizarlo
+        await escribir(actualizar_hash_db, user.id, nuevo_hash)
 
     access_token = create_access_token({"sub": user.username})
     return schemas.Token(access_token=access_token, user=user)
 
+# === HELPERS DE ESCRITURA ===
+# Se ejecutan dentro de database.escribir (serializadas, en una
+# transacción que hace commit al terminar).
+
+
+async def crear_usuario_db(
+    db: AsyncSession, username: str, email: Optional[str], password_hash: str
+) -> models.User:
+    user = models.User(
+        username=username,
+        email=email,
+        password_hash=password_hash,
+    )
+    db.add(user)
+    await db.flush()
+    await db.refresh(user)
+    return user
+
+
+async def actualizar_hash_db(db: AsyncSession, user_id: int, password_hash: str):
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(password_hash=password_hash)
+    )
+
+
+async def renombrar_conversacion_db(
+    db: AsyncSession, conv_id: str, user_id: int, new_title: str
+) -> bool:
+    result = await db.execute(
+        update(models.Conversation)
+        .where(
+            models.Conversation.id == conv_id,
+            models.Conversation.user_id == user_id,
+        )
+        .values(title=new_title, display_title=normalizar_titulo(new_title))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+    await busqueda.indexar_titulo(db, conv_id, new_title)
+    return True
+
+
+async def titular_conversacion_db(
+    db: AsyncSession, conv_id: str, titulo: str, *esperados: str
+) -> bool:
+    """
+    Pone el título automático sólo si la conversación conserva uno de los
+    títulos `esperados` (así nunca pisa un renombrado del usuario).
+    """
+    result = await db.execute(
+        update(models.Conversation)
+        .where(
+            models.Conversation.id == conv_id,
+            models.Conversation.title.in_(esperados),
+        )
+        .values(title=titulo, display_title=normalizar_titulo(titulo))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+    await busqueda.indexar_titulo(db, conv_id, titulo)
+    return True
+
+
+async def borrar_conversacion_db(
+    db: AsyncSession, conv_id: str, user_id: int
+) -> bool:
+    conv = await db.scalar(
+        select(models.Conversation).where(
+            models.Conversation.id == conv_id,
+            models.Conversation.user_id == user_id,
+        )
+    )
+    if not conv:
+        return False
+
+    # El índice de búsqueda localiza los mensajes por su id: antes de borrarlos
+    await busqueda.borrar_conversacion(db, conv.id)
+
+    # Borrar mensajes primero (por si no tienes cascade)
+    await db.execute(
+        delete(models.Message)
+        .where(models.Message.conversation_id == conv.id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(models.ConversationArchive).where(
+            models.ConversationArchive.conversation_id == conv.id
+        )
+    )
+
+    await db.delete(conv)
+    return True
+
+
 # === HELPERS PARA CONVERSACIONES ===
 
 
-def get_or_create_conversation(
-    db: Session, conv_id: str, user: models.User
+async def get_or_create_conversation(
+    db: AsyncSession, conv_id: str, user: Identidad, titulo: str = TITULO_POR_DEFECTO
 ) -> models.Conversation:
-    conv = (
-        db.query(models.Conversation)
-        .filter_by(id=conv_id, user_id=user.id)
-        .first()
+    conv = await db.scalar(
+        select(models.Conversation).filter_by(id=conv_id, user_id=user.id)
     )
     if not conv:
         conv = models.Conversation(
             id=conv_id,
             user_id=user.id,
-            title="Nueva Receta",
+            title=titulo,
+            display_title=normalizar_titulo(titulo),
         )
         db.add(conv)
-        db.commit()
-        db.refresh(conv)
+        await db.flush()
+        await db.refresh(conv)
+        await busqueda.indexar_titulo(db, conv_id, titulo)
+    elif conv.archived_at is not None:
+        # Vuelve a messages antes de cargar el historial del turno
+        await archivo.rehidratar(db, conv_id)
+        await db.refresh(conv)
     return conv
 
 
-def guardar_mensajes_db(
-    db: Session,
-    conv: models.Conversation,
-    user_message: str,
-    bot_response: str,
-):
-    msg_user = models.Message(
-        conversation_id=conv.id,
-        role=models.RoleEnum.user,
-        content=user_message,
-    )
-    msg_bot = models.Message(
-        conversation_id=conv.id,
-        role=models.RoleEnum.assistant,
-        content=bot_response,
-    )
-    db.add_all([msg_user, msg_bot])
-    db.commit()
+async def guardar_mensajes_db(db: AsyncSession, turnos: List[TurnoPendiente]):
+    """
+    Guarda un lote de turnos (lo llama la cola write-behind a través de
+    database.escribir): un INSERT masivo de mensajes y, por conversación, el toque
+    de updated_at con los contadores y el extracto de la barra lateral, y el
+    resumen de contexto si el turno lo trae.
+    Los turnos de conversaciones borradas mientras esperaban se descartan.
+    """
+    with medir(db_consulta_segundos, "guardar_mensajes"):
+        conv_ids = {t.conv_id for t in turnos}
+        filas_conv = (
+            await db.execute(
+                select(models.Conversation.id, models.Conversation.archived_at).where(
+                    models.Conversation.id.in_(conv_ids)
+                )
+            )
+        ).all()
+        existentes = {conv_id for conv_id, _ in filas_conv}
+        # Archivada mientras el turno esperaba: los mensajes viejos primero,
+        # con ids nuevos a los que hay que traducir el hasta_id del resumen
+        remapeos = {}
+        for conv_id, archivada in filas_conv:
+            if archivada is not None:
+                remapeos[conv_id] = await archivo.rehidratar(db, conv_id)
+
+        filas = []
+        resumenes = {}
+        titulos = {}
+        # conv_id -> [mensajes, imágenes, último mensaje] de este lote
+        estadisticas = {}
+        for t in turnos:
+            if t.conv_id not in existentes:
+                continue
+            filas.append(
+                {
+                    "conversation_id": t.conv_id,
+                    "role": models.RoleEnum.user,
+                    "content": t.user_message,
+                    "has_image": t.con_imagen,
+                }
+            )
+            filas.append(
+                {
+                    "conversation_id": t.conv_id,
+                    "role": models.RoleEnum.assistant,
+                    "content": t.bot_response,
+                    "has_image": False,
+                    "local_reply": t.respuesta_local,
+                }
+            )
+            e = estadisticas.setdefault(t.conv_id, [0, 0, None])
+            e[0] += 2
+            e[1] += int(t.con_imagen)
+            e[2] = t.bot_response
+            if t.resumen is not None:
+                resumenes[t.conv_id] = t.resumen
+            if t.titulo is not None:
+                titulos[t.conv_id] = t.titulo
+        if not filas:
+            return
+
+        # Escritor único: los ids por encima de éste son los de este lote
+        ultimo_id = await db.scalar(select(func.max(models.Message.id)))
+        await db.execute(insert(models.Message), filas)
+        await busqueda.indexar_mensajes_desde(db, ultimo_id or 0)
+        # Un UPDATE por conversación en un solo executemany; los contadores
+        # se suman en SQL (los archivados también cuentan)
+        C = models.Conversation.__table__
+        await db.execute(
+            update(C)
+            .where(C.c.id == bindparam("b_id"))
+            .values(
+                updated_at=func.now(),
+                message_count=C.c.message_count + bindparam("b_mensajes"),
+                image_count=C.c.image_count + bindparam("b_imagenes"),
+                last_message_preview=bindparam("b_vista"),
+            ),
+            [
+                {
+                    "b_id": conv_id,
+                    "b_mensajes": mensajes,
+                    "b_imagenes": imagenes,
+                    "b_vista": vista_previa(ultimo),
+                }
+                for conv_id, (mensajes, imagenes, ultimo) in estadisticas.items()
+            ],
+        )
+        for conv_id, (texto, hasta_id) in resumenes.items():
+            if conv_id in remapeos:
+                hasta_id = remapeos[conv_id](hasta_id)
+            await db.execute(
+                update(models.Conversation)
+                .where(models.Conversation.id == conv_id)
+                .values(summary=texto, summary_upto_id=hasta_id)
+            )
+        for conv_id, (titulo, esperado) in titulos.items():
+            await titular_conversacion_db(db, conv_id, titulo, esperado)
 
 
-def cargar_historial_db(db: Session, conv_id: str, user: models.User):
-    conv = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conv_id,
-            models.Conversation.user_id == user.id,
-        )
-        .first()
-    )
-    if not conv:
-        return []
+async def _guardar_lote(turnos: List[TurnoPendiente]) -> None:
+    await escribir(guardar_mensajes_db, turnos)
 
-    msgs = (
-        db.query(models.Message)
-        .filter(models.Message.conversation_id == conv.id)
-        .order_by(models.Message.created_at.asc())
-        .all()
-    )
-    history = []
-    for m in msgs:
-        if m.role == models.RoleEnum.user:
-            history.append({"user": m.content, "bot": None})
-        else:
-            if history and history[-1]["bot"] is None:
-                history[-1]["bot"] = m.content
+
+cola_turnos = ColaTurnos(_guardar_lote)
+
+
+async def cargar_historial_db(
+    db: AsyncSession, conv_id: str, user: Identidad, desde_id: int = 0
+):
+    """
+    Turnos de la conversación con id de mensaje > desde_id (los que aún
+    no están en el resumen). Cada turno lleva `ultimo_id`.
+    Una sola consulta: el join con conversations hace el chequeo de dueño.
+    """
+    with medir(db_consulta_segundos, "cargar_historial", nombre_span="historial_db"):
+        msgs = await db.execute(
+            select(models.Message.id, models.Message.role, models.Message.content)
+            .join(
+                models.Conversation,
+                models.Conversation.id == models.Message.conversation_id,
+            )
+            .where(
+                models.Message.conversation_id == conv_id,
+                models.Conversation.user_id == user.id,
+                models.Message.id > desde_id,
+            )
+            .order_by(models.Message.created_at.asc(), models.Message.id.asc())
+        )
+        history = []
+        for m in msgs:
+            if m.role == models.RoleEnum.user:
+                history.append({"user": m.content, "bot": None, "ultimo_id": m.id})
             else:
-                history.append({"user": "", "bot": m.content})
-    return [h for h in history if h["user"] or h["bot"]]
+                if history and history[-1]["bot"] is None:
+                    history[-1]["bot"] = m.content
+                    history[-1]["ultimo_id"] = m.id
+                else:
+                    history.append({"user": "", "bot": m.content, "ultimo_id": m.id})
+        return [h for h in history if h["user"] or h["bot"]]
+
+
+def bytes_al_modelo(
+    system_prompt: str, contents: List[types.Content], imagen: Optional[ImagenProcesada]
+) -> int:
+    """Bytes de texto (UTF-8) e imagen de una petición al modelo."""
+    total = len(system_prompt.encode("utf-8"))
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                total += len(part.text.encode("utf-8"))
+    if imagen is not None:
+        total += len(imagen.datos)
+    return total
 
 
 # === ENDPOINT PRINCIPAL CON STREAMING Y HEARTBEAT ===
+SYSTEM_PROMPT = (
+    "Eres un asistente de cocina con un estilo futurista y amigable. "
+    "Tu usuario se llama {username}. "
+    "Tu única especialidad y área de conocimiento es la cocina, recetas, "
+    "ingredientes, técnicas culinarias, nutrición relacionada con la comida "
+    "y utensilios de cocina. "
+    "Responde siempre con entusiasmo, emojis y lenguaje claro. "
+    "**Formatea siempre tus recetas con títulos en negrita y listas de Markdown.** "
+    "Si el usuario te da una imagen de ingredientes, analízala y úsala para sugerir recetas. "
+    "**Si la consulta del usuario NO está directamente relacionada con la cocina, recetas, "
+    "ingredientes o temas culinarios, debes responder con la frase exacta: "
+    f"'{MENSAJE_FUERA_DE_TEMA}'.** "
+    "No intentes responder a consultas sobre matemáticas, historia, programación "
+    "o cualquier tema fuera de la cocina."
+)
+# Cambia con el prompt: las respuestas cacheadas con otro prompt no se usan
+PROMPT_VERSION = hashlib.sha1(SYSTEM_PROMPT.encode()).hexdigest()[:12]
 
+# Respuestas a preguntas de primer turno sin imagen (ver cache_respuestas.py)
+cache_respuestas = CacheRespuestas()
 
-@app.post("/stream_chat/")
-async def stream_chat(
-    user_message: str = Form(...),
-    conversation_id: str = Form(...),
-    image: Optional[UploadFile] = File(None),
-    username: str = Form("invitado"),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-):
-    historial = cargar_historial_db(db, conversation_id, current_user)
-    contents = []
-
-    # 1. Historial previo
-    for item in historial:
-        if item["user"]:
-            contents.append(
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text=item["user"])],
+# Consultas claramente fuera de tema se contestan sin llamar al modelo
+clasificador = ClasificadorTema()
+
+
+async def entrenar_clasificador() -> None:
+    """
+    Reentrena el clasificador con los mensajes más recientes guardados
+    (en un hilo; el modelo anterior sigue sirviendo mientras tanto).
+    """
+    global clasificador
+    async with AsyncSessionLocal() as db:
+        ultimos = (
+            select(models.Message.id)
+            .order_by(models.Message.id.desc())
+            .limit(CLASIFICADOR_MAX_MUESTRAS * 2)
+            .subquery()
+        )
+        filas = (
+            await db.execute(
+                select(
+                    models.Message.conversation_id,
+                    models.Message.role,
+                    models.Message.content,
+                    models.Message.local_reply,
                 )
-            )
-        if item["bot"]:
-            contents.append(
-                types.Content(
-                    role="model",
-                    parts=[types.Part(text=item["bot"])],
+                .where(models.Message.id.in_(select(ultimos.c.id)))
+                .order_by(
+                    models.Message.conversation_id,
+                    models.Message.created_at,
+                    models.Message.id,
                 )
             )
+        ).all()
+
+    nuevo = ClasificadorTema(clasificador.umbral, clasificador.min_senales)
+    await asyncio.to_thread(nuevo.entrenar, muestras_de_mensajes(filas))
+    nuevo.stats = clasificador.stats
+    clasificador = nuevo
+
+
+async def procesar_imagen_subida(image: Optional[UploadFile]) -> Optional[ImagenProcesada]:
+    """Reduce y re-codifica la imagen fuera del event loop (ver imagenes.py)."""
+    if image is None or not image.filename or image.size == 0:
+        return None
+    try:
+        return await imagenes.procesar(image.file)
+    except ImagenRechazada as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detalle)
+
+
+async def preparar_turno(
+    user_message: str,
+    conversation_id: str,
+    imagen: Optional[ImagenProcesada],
+    username: str,
+    current_user: Identidad,
+):
+    """
+    Prepara el turno (conversación, historial, prompt) y devuelve el
+    generador de eventos tipados de la respuesta. Cada endpoint decide
+    cómo escribirlos (texto plano o SSE).
+    """
+    # Título provisional con el mensaje (se afina con la respuesta al final)
+    titulo_inicial, _ = titulo_heuristico(user_message)
+    # El turno anterior puede seguir en la cola write-behind (el DONE sale
+    # antes del volcado): sin él no habría historial ni resumen y esto se
+    # trataría como primer turno (título pisado, respuesta cacheable)
+    with span("esperar_turnos"):
+        await cola_turnos.esperar(conversation_id)
+    with span("conversacion_db"):
+        conv = await escribir(
+            get_or_create_conversation, conversation_id, current_user, titulo_inicial
+        )
+    # Sesión propia y corta: el stream puede durar decenas de segundos y
+    # puede seguir aunque se vaya quien lo pidió (ver generaciones.py)
+    async with AsyncSessionLocal() as db:
+        historial = await cargar_historial_db(
+            db, conversation_id, current_user, conv.summary_upto_id or 0
+        )
+    # Primer turno: el título automático sale de este intercambio
+    es_primer_turno = not historial and not conv.summary
+
+    # 1. Historial previo: últimos turnos literales + resumen de los viejos
+    with span("contexto"):
+        contents, resumen_previo = contexto.construir_contexto(historial, conv.summary)
+        nuevo_resumen = contexto.plegar_turnos(conv.summary, historial)
+    turnos_enviados = sum(1 for c in contents if c.role == "user")
 
     # 2. Mensaje actual con imagen
     user_parts = []
+    con_imagen = imagen is not None
 
-    if image is not None and image.filename:
-        image_bytes = await image.read()
-        if image_bytes:
-            mime_type = image.content_type or "application/octet-stream"
-            user_parts.append(
-                types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type=mime_type,
-                )
+    if imagen is not None:
+        user_parts.append(
+            types.Part.from_bytes(
+                data=imagen.datos,
+                mime_type=imagen.mime_type,
             )
+        )
 
     user_parts.append(types.Part(text=f"Usuario {username} dice: {user_message}"))
     contents.append(types.Content(role="user", parts=user_parts))
 
     # 3. System prompt
-    system_prompt = (
-        f"Eres un asistente de cocina con un estilo futurista y amigable. "
-        f"Tu usuario se llama {username}. "
-        "Tu única especialidad y área de conocimiento es la cocina, recetas, "
-        "ingredientes, técnicas culinarias, nutrición relacionada con la comida "
-        "y utensilios de cocina. "
-        "Responde siempre con entusiasmo, emojis y lenguaje claro. "
-        "**Formatea siempre tus recetas con títulos en negrita y listas de Markdown.** "
-        "Si el usuario te da una imagen de ingredientes, analízala y úsala para sugerir recetas. "
-        "**Si la consulta del usuario NO está directamente relacionada con la cocina, recetas, "
-        "ingredientes o temas culinarios, debes responder con la frase exacta: "
-        "'Este es un tema que no manejo, mi especialidad es la cocina'.** "
-        "No intentes responder a consultas sobre matemáticas, historia, programación "
-        "o cualquier tema fuera de la cocina."
-    )
+    system_prompt = SYSTEM_PROMPT.format(username=username)
+
+    if resumen_previo:
+        system_prompt += (
+            " Resumen de la conversación anterior con el usuario "
+            "(úsalo como contexto, no lo repitas):\n" + resumen_previo
+        )
+
+    # Sólo preguntas sueltas: sin historial ni imagen la respuesta no
+    # depende de nada más que del mensaje
+    cacheable = RESPUESTAS_CACHE_ACTIVA and es_primer_turno and not con_imagen
+    # Con imagen el texto puede ser "¿qué hago con esto?": siempre al modelo
+    with span("clasificador"):
+        fuera_de_tema = (
+            CLASIFICADOR_ACTIVO
+            and not con_imagen
+            and clasificador.es_fuera_de_tema(user_message)
+        )
 
-    conv = get_or_create_conversation(db, conversation_id, current_user)
+    def medir_contexto() -> None:
+        """Tamaño de lo que se envía al modelo (sólo si va al modelo)."""
+        if metricas.activa:
+            contexto_turnos.observar(turnos_enviados)
+            contexto_bytes.observar(bytes_al_modelo(system_prompt, contents, imagen))
+
+    async def finalizar_turno(
+        texto: str, titulo_con_ia: bool = True, respuesta_local: bool = False
+    ) -> Evento:
+        """
+        Guarda en DB (write-behind: no espera al disco, sólo a que haya
+        hueco en la cola) con el título automático si es el primer turno.
+        Devuelve la trama DONE (con el título si ya es el definitivo).
+        """
+        titulo = None
+        definitivo = None
+        if es_primer_turno:
+            titulo, confianza = titulo_heuristico(user_message, texto)
+            if confianza >= TITULO_CONFIANZA_MIN or not titulo_con_ia:
+                titulos_stats["heuristicos"] += 1
+                definitivo = titulo
+            else:
+                programar_titulo_ia(
+                    current_user.id, conv.id, user_message, texto, titulo, conv.title
+                )
+            titulo = (titulo, conv.title)
+        with span("guardar_turno"):
+            await cola_turnos.encolar(
+                TurnoPendiente(
+                    conv.id,
+                    user_message,
+                    texto,
+                    nuevo_resumen,
+                    titulo,
+                    con_imagen,
+                    respuesta_local,
+                    user_id=current_user.id,
+                )
+            )
+        return Evento(DONE, {"conversation_id": conv.id, "title": definitivo})
 
     async def generate_and_stream():
         full_response_text = ""
-        loop = asyncio.get_event_loop()
-        last_yield_time = loop.time()
+        tokens_generados = 0
+        desconectado = False
+        # Para las métricas del stream: None = no se llegó a abrir
+        resultado_stream = None
+        trozos = 0
+        bytes_stream = 0
+
+        if fuera_de_tema:
+            yield Evento(DELTA, MENSAJE_FUERA_DE_TEMA)
+            yield Evento(USAGE, {"tokens": 0, "source": "local"})
+            yield await finalizar_turno(
+                MENSAJE_FUERA_DE_TEMA, titulo_con_ia=False, respuesta_local=True
+            )
+            return
+
+        if cacheable:
+            cacheada = cache_respuestas.buscar(PROMPT_VERSION, user_message, username)
+            if cacheada is not None:
+                # Misma forma de stream que el modelo, sin gastar cupo
+                async for trozo in cache_respuestas.reproducir(cacheada):
+                    yield Evento(DELTA, trozo)
+                yield Evento(USAGE, {"tokens": 0, "source": "cache"})
+                yield await finalizar_turno(cacheada)
+                return
 
         try:
-            response_stream = client.models.generate_content_stream(
+            medir_contexto()
+            t_modelo = time.perf_counter()
+            # Espera turno en la pasarela sin bloquear el event loop
+            response_stream = await pasarela.abrir_stream(
+                current_user.id,
                 model="gemini-2.5-flash-lite",
                 config=types.GenerateContentConfig(system_instruction=system_prompt),
                 contents=contents,
             )
-
-            for chunk in response_stream:
-                if chunk.text:
-                    yield chunk.text
-                    full_response_text += chunk.text
-                    last_yield_time = loop.time()
-
-                # heartbeat (por si hiciera falta)
-                current_time = loop.time()
-                if (current_time - last_yield_time) > 5.0:
-                    yield " "
-
-            # Guardar en DB sólo si hubo respuesta
+            # La pasarela devuelve el stream con el primer trozo ya recibido
+            stream_primer_trozo_segundos.observar(time.perf_counter() - t_modelo)
+            marcar("modelo_primer_trozo")
+            resultado_stream = "error"
+
+            try:
+                # Si el cliente se va, llega la cancelación (ver abajo)
+                with span("stream"):
+                    async for chunk in response_stream:
+                        tokens_generados = contar_tokens_chunk(chunk, tokens_generados)
+                        if chunk.text:
+                            trozos += 1
+                            bytes_stream += len(chunk.text.encode("utf-8"))
+                            full_response_text += chunk.text
+                            yield Evento(DELTA, chunk.text)
+            finally:
+                # Cerrar el iterador aborta la petición al modelo y libera el cupo
+                await response_stream.aclose()
+            resultado_stream = "completado"
+
+            # Guardar sólo si hubo respuesta completa
             if full_response_text:
-                await loop.run_in_executor(
-                    None,
-                    guardar_mensajes_db,
-                    db,
-                    conv,
-                    user_message,
-                    full_response_text,
-                )
-
+                registrar_stream_completado(tokens_generados)
+                if cacheable:
+                    cache_respuestas.guardar(
+                        PROMPT_VERSION, user_message, username, full_response_text
+                    )
+                yield Evento(USAGE, {"tokens": tokens_generados, "source": "model"})
+                yield await finalizar_turno(full_response_text)
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # Starlette cancela la tarea cuando el navegador se desconecta
+            desconectado = True
+            raise
+        except ModeloSaturado:
+            yield Evento(ERROR, {"code": "overloaded", "message": MENSAJE_MODELO_SOBRECARGADO})
+        except LimiteUsuario as e:
+            yield Evento(
+                ERROR,
+                {
+                    "code": "rate_limited",
+                    "message": MENSAJE_LIMITE_USUARIO,
+                    "retry_after": round(e.reintentar_en, 1),
+                },
+            )
         except genai_errors.ServerError as e:
             # Errores tipo 503 del modelo
             print("Error del modelo Gemini:", repr(e))
-            yield (
-                "❌ El modelo de IA está sobrecargado o no disponible en este momento. "
-                "Inténtalo de nuevo en unos segundos."
-            )
+            yield Evento(ERROR, {"code": "overloaded", "message": MENSAJE_MODELO_SOBRECARGADO})
         except Exception as e:
             # Cualquier otro error inesperado
             print("Error inesperado en generate_and_stream:", repr(e))
-            yield (
-                "❌ Ocurrió un error al generar la respuesta. "
-                "Por favor, inténtalo de nuevo más tarde."
-            )
+            yield Evento(ERROR, {"code": "internal", "message": MENSAJE_ERROR_INTERNO})
+        finally:
+            if resultado_stream is not None:
+                if desconectado:
+                    resultado_stream = "abortado"
+                stream_trozos.observar(trozos, resultado_stream)
+                stream_bytes.observar(bytes_stream, resultado_stream)
+            if desconectado:
+                registrar_stream_abortado(tokens_generados)
+                if full_response_text and GUARDAR_RESPUESTAS_TRUNCADAS:
+                    # Protegido de la cancelación para no perder el parcial
+                    with anyio.CancelScope(shield=True):
+                        await cola_turnos.encolar(
+                            TurnoPendiente(
+                                conv.id,
+                                user_message,
+                                full_response_text + MARCA_RESPUESTA_TRUNCADA,
+                                nuevo_resumen,
+                                con_imagen=con_imagen,
+                                user_id=current_user.id,
+                            )
+                        )
+
+    return generate_and_stream()
+
+
+# Peticiones repetidas en vuelo comparten una sola generación
+generaciones = RegistroGeneraciones(
+    Evento(ERROR, {"code": "internal", "message": MENSAJE_ERROR_INTERNO})
+)
+
+
+async def eventos_chat(
+    user_message: str,
+    conversation_id: str,
+    image: Optional[UploadFile],
+    username: str,
+    current_user: Identidad,
+    idempotency_key: Optional[str] = None,
+):
+    # La imagen va primero: si se rechaza no se crea la conversación
+    with span("imagen"):
+        imagen = await procesar_imagen_subida(image)
+
+    def fabrica():
+        return preparar_turno(user_message, conversation_id, imagen, username, current_user)
+
+    if not GENERACIONES_COMPARTIDAS:
+        return await fabrica()
+    if idempotency_key:
+        # Reintento del cliente: misma respuesta aunque ya haya terminado
+        clave = (current_user.id, conversation_id, "idempotency", idempotency_key)
+        return generaciones.unirse(clave, fabrica, retener=True)
+    # Por contenido sólo se une a lo que aún se genera (doble clic)
+    clave = (
+        current_user.id,
+        conversation_id,
+        user_message.strip(),
+        imagen.sha256 if imagen else None,
+    )
+    return generaciones.unirse(clave, fabrica)
+
+
+@app.post("/stream_chat/")
+async def stream_chat(
+    user_message: str = Form(...),
+    conversation_id: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    username: str = Form("invitado"),
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    current_user: Identidad = Depends(get_current_user),
+):
+    """Formato antiguo: texto plano con errores y latidos dentro del cuerpo."""
+    eventos = await eventos_chat(
+        user_message, conversation_id, image, username, current_user, idempotency_key
+    )
+    return StreamingResponse(
+        como_texto(agrupar_con_latido(eventos)), media_type="text/plain"
+    )
 
-    return StreamingResponse(generate_and_stream(), media_type="text/plain")
+
+@app.post("/stream_chat/sse/")
+async def stream_chat_sse(
+    user_message: str = Form(...),
+    conversation_id: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    username: str = Form("invitado"),
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+    current_user: Identidad = Depends(get_current_user),
+):
+    """
+    Server-Sent Events con tramas tipadas: delta, heartbeat, usage, done y
+    error (ver transporte.py).
+    """
+    eventos = await eventos_chat(
+        user_message, conversation_id, image, username, current_user, idempotency_key
+    )
+    return StreamingResponse(
+        como_sse(agrupar_con_latido(eventos)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # === ENDPOINT PARA RENOMBRAR CONVERSACIONES ===
@@ -374,22 +1118,14 @@ async def stream_chat(
 async def rename_conversation(
     conversation_id: str = Form(...),
     new_title: str = Form(...),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: Identidad = Depends(get_current_user),
 ):
-    conv = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conversation_id,
-            models.Conversation.user_id == current_user.id,
-        )
-        .first()
+    ok = await escribir(
+        renombrar_conversacion_db, conversation_id, current_user.id, new_title
     )
-    if not conv:
+    if not ok:
         return {"status": "error", "message": "Conversación no encontrada"}
 
-    conv.title = new_title
-    db.commit()
     return {"status": "success", "message": "Título actualizado"}
 
 from fastapi import HTTPException
@@ -397,47 +1133,50 @@ from fastapi import HTTPException
 # ...
 
 @app.delete("/conversations/{conversation_id}")
-def delete_conversation(
+async def delete_conversation(
     conversation_id: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: Identidad = Depends(get_current_user),
 ):
-    conv = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conversation_id,
-            models.Conversation.user_id == current_user.id,
-        )
-        .first()
-    )
-    if not conv:
+    ok = await escribir(borrar_conversacion_db, conversation_id, current_user.id)
+    if not ok:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
 
-    # Borrar mensajes primero (por si no tienes cascade)
-    db.query(models.Message).filter(
-        models.Message.conversation_id == conv.id
-    ).delete(synchronize_session=False)
-
-    db.delete(conv)
-    db.commit()
     return {"status": "success"}
 
 
 
-# === NUEVO ENDPOINT: SUGERIR TÍTULO CON IA ===
+# === TÍTULOS AUTOMÁTICOS ===
+# El título sale del titulador heurístico (titulos.py); Gemini sólo se
+# consulta, en segundo plano y con caché, cuando la heurística duda.
+TITULOS_IA_CONCURRENTES: int = int(os.getenv("TITULOS_IA_CONCURRENTES") or "4")
+titulos_ia_slots = asyncio.Semaphore(TITULOS_IA_CONCURRENTES)
+# Mismo primer mensaje -> mismo título, sin volver a llamar al modelo
+titulos_ia_cache: TTLCache = TTLCache(maxsize=2000, ttl=24 * 3600)
+# Referencias a las tareas en segundo plano (si no, el GC puede cortarlas)
+_tareas_titulo: set = set()
 
+titulos_stats = {
+    "heuristicos": 0,
+    "ia": 0,
+    "ia_cache": 0,
+    "ia_errores": 0,
+}
 
-@app.post("/conversations/suggest_title/", response_model=TitleResponse)
-async def suggest_title(
-    payload: TitleRequest,
-    current_user: models.User = Depends(get_current_user),
-):
+
+async def titulo_ia(
+    user_message: str, assistant_message: str, usuario: int, coste: float = 0
+) -> Optional[str]:
     """
-    Devuelve un título breve y creativo para un chat de recetas
-    en español (máx ~8 palabras), usando Gemini.
+    Título breve y creativo (máx ~8 palabras) generado por Gemini a través
+    de la pasarela. None si el modelo falla o no devuelve nada. Los
+    títulos en segundo plano no gastan la cubeta del usuario (coste 0).
     """
-    user_msg = (payload.user_message or "").strip()
-    assistant_msg = (payload.assistant_message or "").strip()
+    user_msg = (user_message or "").strip()
+    assistant_msg = (assistant_message or "").strip()[:800]
+    clave = " ".join(user_msg.lower().split())[:200]
+    if clave in titulos_ia_cache:
+        titulos_stats["ia_cache"] += 1
+        return titulos_ia_cache[clave]
 
     prompt = f"""
 Eres un asistente que pone nombres creativos a conversaciones de cocina.
@@ -459,128 +1198,359 @@ Respuesta del asistente:
 \"\"\"{assistant_msg}\"\"\"
 """
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=[
-            types.Content(
-                role="user",
-                parts=[types.Part(text=prompt)],
+    try:
+        # Sub-límite propio para no ocupar todos los cupos de la pasarela
+        async with titulos_ia_slots:
+            response = await pasarela.generar(
+                usuario,
+                coste,
+                model="gemini-2.5-flash-lite",
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[types.Part(text=prompt)],
+                    )
+                ],
             )
-        ],
-    )
+    except Exception as e:
+        print("Error generando título con IA:", repr(e))
+        titulos_stats["ia_errores"] += 1
+        return None
 
-    raw = (response.text or "").strip()
-    if not raw:
-        return TitleResponse(title="Nueva Receta")
+    titulos_stats["ia"] += 1
+    titulo = limpiar_titulo_ia(response.text)
+    if titulo:
+        titulos_ia_cache[clave] = titulo
+    return titulo
+
+
+async def _titular_con_ia(
+    usuario: int,
+    conv_id: str,
+    user_message: str,
+    assistant_message: str,
+    *provisionales: str,
+) -> None:
+    titulo = await titulo_ia(user_message, assistant_message, usuario)
+    if titulo and titulo not in provisionales:
+        # El turno con el título heurístico puede seguir en la cola: se
+        # acepta cualquiera de los automáticos, nunca uno del usuario
+        await escribir(titular_conversacion_db, conv_id, titulo, *provisionales)
+
+
+def programar_titulo_ia(
+    usuario: int,
+    conv_id: str,
+    user_message: str,
+    assistant_message: str,
+    *provisionales: str,
+) -> None:
+    tarea = asyncio.get_running_loop().create_task(
+        _titular_con_ia(
+            usuario, conv_id, user_message, assistant_message, *provisionales
+        )
+    )
+    _tareas_titulo.add(tarea)
+    tarea.add_done_callback(_tareas_titulo.discard)
 
-    # Limpiar prefijos como "Título: ..." y comillas
-    clean = raw.replace("\n", " ").strip()
-    if clean.lower().startswith("título:") or clean.lower().startswith("titulo:"):
-        clean = clean.split(":", 1)[1].strip()
-    clean = clean.strip(' "“”')
 
-    if not clean:
-        clean = "Nueva Receta"
+@app.post("/conversations/suggest_title/", response_model=TitleResponse)
+async def suggest_title(
+    payload: TitleRequest,
+    current_user: Identidad = Depends(get_current_user),
+):
+    """
+    Título breve para un chat de recetas. Ya no hace falta llamarlo tras
+    cada conversación (el título se pone al guardar el primer turno); se
+    mantiene para clientes antiguos.
+    """
+    titulo, confianza = titulo_heuristico(
+        payload.user_message, payload.assistant_message or ""
+    )
+    if confianza >= TITULO_CONFIANZA_MIN:
+        titulos_stats["heuristicos"] += 1
+        return TitleResponse(title=titulo)
 
-    return TitleResponse(title=clean)
+    # Petición directa del usuario: sí gasta de su cubeta
+    titulo_modelo = await titulo_ia(
+        payload.user_message, payload.assistant_message or "", current_user.id, coste=1
+    )
+    return TitleResponse(title=titulo_modelo or titulo)
 
 
 # === ENDPOINTS DE LECTURA ===
 
 
 @app.get("/conversations/")
-def get_conversations(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+async def get_conversations(
+    before: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_db),
+    current_user: Identidad = Depends(get_current_user),
 ):
-    convs = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.user_id == current_user.id)
-        .order_by(models.Conversation.updated_at.desc())
-        .all()
-    )
-
-    conversations_list = []
-    for conv in convs:
-        title = conv.title or "Nueva Receta"
-        title_clean = (
-            title.split("\n")[0]
-            .strip()
-            .replace("**", "")
-            .split("!")[0]
-            .replace("🍳", "")
-            .replace("👋", "")
-            .strip()
+    # Contadores y extracto los actualiza el volcado de la cola: tras un
+    # stream, esperar a los turnos del usuario que aún estén en ella
+    await cola_turnos.esperar(user_id=current_user.id)
+    # Sólo columnas (tuplas, no entidades ORM); el título y el extracto ya
+    # vienen limpios y los contadores están en la fila: nada de subconsultas
+    # sobre messages por conversación
+    query = select(
+        models.Conversation.id,
+        models.Conversation.display_title,
+        models.Conversation.updated_at,
+        models.Conversation.message_count,
+        models.Conversation.image_count,
+        models.Conversation.last_message_preview,
+    ).where(models.Conversation.user_id == current_user.id)
+    if before:
+        fecha, conv_id = leer_cursor(before)
+        query = query.where(
+            antes_de_cursor(
+                models.Conversation.updated_at,
+                models.Conversation.id,
+                fecha,
+                conv_id,
+            )
         )
-        if len(title_clean) > 50:
-            title_clean = title_clean[:50] + "..."
-
-        conversations_list.append(
-            {
-                "id": conv.id,
-                "title": title_clean or "Nueva Receta",
-                "username": current_user.username,
-            }
+    rows = (
+        await db.execute(
+            query.order_by(
+                models.Conversation.updated_at.desc(), models.Conversation.id.desc()
+            ).limit(limit + 1)
         )
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = crear_cursor(rows[-1].updated_at, rows[-1].id)
+
+    username = current_user.username
+    conversations_list = [
+        {
+            "id": r.id,
+            "title": r.display_title or TITULO_POR_DEFECTO,
+            "username": username,
+            "updated_at": r.updated_at.isoformat(),
+            "message_count": r.message_count,
+            "has_image": r.image_count > 0,
+            "preview": r.last_message_preview,
+        }
+        for r in rows
+    ]
 
-    return {"conversations": conversations_list}
+    # Ya son tipos JSON: JSONResponse se salta jsonable_encoder, que recorría
+    # cada clave de cada conversación y era la mitad del coste del endpoint
+    return JSONResponse({"conversations": conversations_list, "next_cursor": next_cursor})
 
 
 @app.get("/history/{conversation_id}")
-def get_history(
+async def get_history(
     conversation_id: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    before: Optional[str] = None,
+    limit: int = Query(40, ge=2, le=200),
+    db: AsyncSession = Depends(get_db),
+    current_user: Identidad = Depends(get_current_user),
 ):
-    conv = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conversation_id,
+    """
+    Página de mensajes más recientes que `before` (la primera página es la
+    más nueva). `limit` cuenta mensajes; se devuelven en orden cronológico.
+    """
+    await cola_turnos.esperar(conversation_id)
+    # Una sola consulta con sólo las columnas necesarias; si la conversación
+    # no existe o no es del usuario, simplemente no hay filas.
+    query = (
+        select(
+            models.Message.id,
+            models.Message.role,
+            models.Message.content,
+            models.Message.created_at,
+        )
+        .join(
+            models.Conversation,
+            models.Conversation.id == models.Message.conversation_id,
+        )
+        .where(
+            models.Message.conversation_id == conversation_id,
             models.Conversation.user_id == current_user.id,
         )
-        .first()
-    )
-    if not conv:
-        return {
-            "conversation_id": conversation_id,
-            "history": [],
-            "username": current_user.username,
-        }
-
-    msgs = (
-        db.query(models.Message)
-        .filter(models.Message.conversation_id == conv.id)
-        .order_by(models.Message.created_at.asc())
-        .all()
     )
-
-    history = []
-    for m in msgs:
-        history.append(
-            {
-                "role": m.role.value,
-                "content": m.content,
-                "created_at": m.created_at.isoformat(),
-            }
+    if before:
+        fecha, msg_id = leer_cursor(before)
+        if not msg_id.isdigit():
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = query.where(
+            antes_de_cursor(
+                models.Message.created_at, models.Message.id, fecha, int(msg_id)
+            )
+        )
+    query = query.order_by(
+        models.Message.created_at.desc(), models.Message.id.desc()
+    ).limit(limit + 2)
+    rows = (await db.execute(query)).all()
+    if not rows and not before:
+        # Sin mensajes: puede estar archivada (ver archivo.py)
+        archivada = await db.scalar(
+            select(models.Conversation.archived_at).where(
+                models.Conversation.id == conversation_id,
+                models.Conversation.user_id == current_user.id,
+            )
         )
+        if archivada is not None:
+            await db.close()
+            await escribir(archivo.rehidratar, conversation_id)
+            rows = (await db.execute(query)).all()
+
+    page = rows[:limit]
+    # No partir un turno: si la página empieza por la respuesta del bot,
+    # incluir también la pregunta que la originó.
+    if (
+        page
+        and len(rows) > limit
+        and page[-1].role == models.RoleEnum.assistant
+        and rows[limit].role == models.RoleEnum.user
+    ):
+        page = rows[: limit + 1]
+    next_cursor = None
+    if len(rows) > len(page):
+        next_cursor = crear_cursor(page[-1].created_at, page[-1].id)
+    msgs = reversed(page)
 
     # Adaptar al formato que ya usas en el frontend (user/bot)
     paired = []
     user_buffer: Optional[str] = None
-    for m in history:
-        if m["role"] == "user":
-            user_buffer = m["content"]
+    for m in msgs:
+        if m.role == models.RoleEnum.user:
+            user_buffer = m.content
         else:
-            paired.append({"user": user_buffer or "", "bot": m["content"]})
+            paired.append({"user": user_buffer or "", "bot": m.content})
             user_buffer = None
 
+    # Tipos JSON: sin la pasada de jsonable_encoder (ver get_conversations)
+    return JSONResponse(
+        {
+            "conversation_id": conversation_id,
+            "history": paired,
+            "username": current_user.username,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+# === BÚSQUEDA ===
+
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=200),
+    db: AsyncSession = Depends(get_db),
+    current_user: Identidad = Depends(get_current_user),
+):
+    """
+    Busca en los títulos y mensajes del usuario (índice FTS5, ver
+    busqueda.py). Resultados de más a menos relevante, con un fragmento
+    donde lo encontrado va entre <mark>.
+    """
+    if not busqueda.activa:
+        raise HTTPException(status_code=503, detail="Búsqueda no disponible")
+    # Los mensajes se indexan al volcarlos
+    await cola_turnos.esperar(user_id=current_user.id)
+    resultados = await busqueda.buscar(db, current_user.id, q, limit, offset)
     return {
-        "conversation_id": conversation_id,
-        "history": paired,
+        "query": q,
+        "results": resultados,
         "username": current_user.username,
     }
 
 
+# === EXPORTACIÓN ===
+
+
+@app.get("/export")
+async def export_account(
+    gzip: bool = Query(False),
+    current_user: Identidad = Depends(get_current_user),
+):
+    """
+    Todas las conversaciones y mensajes del usuario en NDJSON (una línea
+    JSON por conversación y por mensaje), en streaming; con `gzip=true`
+    el archivo va comprimido.
+    """
+    # Con los turnos recién enviados (antes de reservar: esto puede esperar)
+    await cola_turnos.esperar(user_id=current_user.id)
+    reserva = archivo.reservar_exportacion()
+    if reserva is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hay otras exportaciones en curso, inténtalo en un rato",
+            headers={"Retry-After": "30"},
+        )
+    nombre = "chefito-" + "".join(
+        c if c.isalnum() or c in "-_" else "_" for c in current_user.username
+    )
+    nombre += ".ndjson.gz" if gzip else ".ndjson"
+    return StreamingResponse(
+        archivo.exportar(current_user.id, current_user.username, gzip, reserva),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+
+# === MÉTRICAS Y TRAZAS ===
+# Estadísticas que ya llevaba cada componente, exportadas como gauges.
+# Con lambdas: algunos objetos se sustituyen en caliente (clasificador)
+metricas.recolector("stream", lambda: stream_stats)
+metricas.recolector(
+    "cola_turnos", lambda: {**cola_turnos.stats, "pendientes": cola_turnos.pendientes}
+)
+metricas.recolector("identidades", lambda: identidades.resumen())
+metricas.recolector("claves", lambda: servicio_claves.stats)
+metricas.recolector("titulos", lambda: titulos_stats)
+metricas.recolector("cache_respuestas", lambda: cache_respuestas.resumen())
+metricas.recolector("clasificador", lambda: clasificador.stats)
+metricas.recolector("imagenes", lambda: imagenes.resumen())
+metricas.recolector(
+    "generaciones", lambda: {**generaciones.stats, "en_curso": generaciones.en_curso()}
+)
+metricas.recolector("pasarela", lambda: pasarela.resumen())
+metricas.recolector("busqueda", lambda: busqueda.stats)
+metricas.recolector(
+    "archivo", lambda: {**archivo.stats, "exportaciones_en_curso": archivo.exportando}
+)
+
+
+def comprobar_token_metricas(request: Request) -> None:
+    # Cerradas por defecto: exponen colas, cachés y tiempos por petición
+    if not METRICAS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    recibido = request.headers.get("Authorization", "")
+    if not secrets.compare_digest(recibido, f"Bearer {METRICAS_TOKEN}"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido"
+        )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(_: None = Depends(comprobar_token_metricas)):
+    """Formato de texto de Prometheus."""
+    return Response(
+        metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/metrics/trazas/{traza_id}", include_in_schema=False)
+async def get_traza(traza_id: str, _: None = Depends(comprobar_token_metricas)):
+    """
+    Spans de una petición hecha con la cabecera X-Chefito-Traza: 1 (su id
+    llega en X-Chefito-Traza-Id). Los streams se ven enteros al terminar.
+    """
+    traza = traza_guardada(traza_id)
+    if traza is None:
+        raise HTTPException(status_code=404, detail="Traza no encontrada")
+    return traza
+
+
 @app.get("/")
 def root():
     return {"message": "🚀 Asistente de cocina futurista activo con usuarios."}
\ No newline at end of file
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import secrets
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from cachetools import LRUCache
+
+# === CONFIG MÉTRICAS Y TRAZAS ===
+METRICAS_ACTIVAS: bool = (os.getenv("METRICAS_ACTIVAS") or "1") == "1"
+# /metrics y las trazas piden "Authorization: Bearer <token>"; sin token
+# definido no se sirven (404)
+METRICAS_TOKEN: str = os.getenv("METRICAS_TOKEN") or ""
+# Cabecera con la que una petición pide su traza de spans
+TRAZA_CABECERA: str = (os.getenv("TRAZA_CABECERA") or "X-Chefito-Traza").lower()
+# Trazas terminadas que se guardan para consultarlas después
+TRAZAS_GUARDADAS: int = int(os.getenv("TRAZAS_GUARDADAS") or "200")
+
+# Segundos: de 5 ms a 30 s (latencias HTTP, modelo, DB)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BUCKETS_CANTIDAD = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str]) -> str:
+    if not nombres:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)) + "}"
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    def __init__(
+        self,
+        registro: "RegistroMetricas",
+        nombre: str,
+        ayuda: str,
+        etiquetas: Sequence[str] = (),
+    ):
+        self.registro = registro
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def sumar(self, *valores_etiquetas: str, cantidad: float = 1) -> None:
+        if not self.registro.activa:
+            return
+        self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0) + cantidad
+
+    def exportar(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for clave, valor in sorted(self._valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Histograma:
+    """
+    Histograma acumulativo al estilo Prometheus. Observar es una búsqueda
+    binaria y dos sumas: se puede dejar activo en el camino caliente.
+    """
+
+    def __init__(
+        self,
+        registro: "RegistroMetricas",
+        nombre: str,
+        ayuda: str,
+        buckets: Sequence[float] = BUCKETS_SEGUNDOS,
+        etiquetas: Sequence[str] = (),
+    ):
+        self.registro = registro
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(sorted(buckets))
+        self.etiquetas = tuple(etiquetas)
+        # etiquetas -> [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, *valores_etiquetas: str) -> None:
+        if not self.registro.activa:
+            return
+        serie = self._series.get(valores_etiquetas)
+        if serie is None:
+            serie = self._series[valores_etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def exportar(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        nombres_le = self.etiquetas + ("le",)
+        for clave, (conteos, suma, total) in sorted(self._series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                lineas.append(
+                    f"{self.nombre}_bucket{_etiquetas(nombres_le, clave + (_numero(limite),))} {acumulado}"
+                )
+            sufijo = _etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{sufijo} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{sufijo} {total}")
+        return lineas
+
+
+class RegistroMetricas:
+    """
+    Métricas del worker en formato de texto de Prometheus (sin
+    dependencias). Además de contadores e histogramas propios, exporta como
+    gauges los `stats` que ya llevan los demás componentes: cada recolector
+    es una función que devuelve un dict de números.
+    """
+
+    def __init__(self, activa: bool = METRICAS_ACTIVAS, prefijo: str = "chefito"):
+        self.activa = activa
+        self.prefijo = prefijo
+        self._metricas: Dict[str, object] = {}
+        self._recolectores: Dict[str, Callable[[], dict]] = {}
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()) -> Contador:
+        return self._registrar(Contador(self, f"{self.prefijo}_{nombre}", ayuda, etiquetas))
+
+    def histograma(
+        self,
+        nombre: str,
+        ayuda: str,
+        buckets: Sequence[float] = BUCKETS_SEGUNDOS,
+        etiquetas: Sequence[str] = (),
+    ) -> Histograma:
+        return self._registrar(
+            Histograma(self, f"{self.prefijo}_{nombre}", ayuda, buckets, etiquetas)
+        )
+
+    def recolector(self, grupo: str, fn: Callable[[], dict]) -> None:
+        self._recolectores[grupo] = fn
+
+    def exportar(self) -> str:
+        lineas: List[str] = []
+        for metrica in self._metricas.values():
+            lineas.extend(metrica.exportar())
+        for grupo, fn in self._recolectores.items():
+            try:
+                valores = fn()
+            except Exception as e:
+                print(f"Error recolectando métricas de {grupo}:", repr(e))
+                continue
+            for clave, valor in valores.items():
+                if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                    continue
+                nombre = f"{self.prefijo}_{grupo}_{clave}"
+                lineas.append(f"# TYPE {nombre} gauge")
+                lineas.append(f"{nombre} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+    def _registrar(self, metrica):
+        if metrica.nombre in self._metricas:
+            raise ValueError(f"Métrica duplicada: {metrica.nombre}")
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+
+# Registro del worker: los módulos declaran aquí sus métricas
+metricas = RegistroMetricas()
+
+
+# === TRAZAS POR PETICIÓN ===
+class Traza:
+    """Spans (nombre, inicio y duración en ms desde el inicio de la petición)."""
+
+    __slots__ = ("id", "ruta", "inicio", "spans")
+
+    def __init__(self, ruta: str):
+        self.id = secrets.token_hex(8)
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.spans: List[tuple] = []
+
+    def como_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "ruta": self.ruta,
+            "spans": [
+                {"nombre": n, "inicio_ms": round(i, 2), "duracion_ms": round(d, 2), **extra}
+                for n, i, d, extra in sorted(self.spans, key=lambda s: s[1])
+            ],
+        }
+
+
+_traza_actual: contextvars.ContextVar[Optional[Traza]] = contextvars.ContextVar(
+    "traza_actual", default=None
+)
+_trazas: LRUCache = LRUCache(maxsize=max(1, TRAZAS_GUARDADAS))
+
+
+class _SinTraza:
+    """Span vacío compartido: sin traza no se crea ningún objeto."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_SIN_TRAZA = _SinTraza()
+
+
+class _Span:
+    __slots__ = ("traza", "nombre", "extra", "t0", "histograma", "etiquetas")
+
+    def __init__(self, traza, nombre, extra, histograma=None, etiquetas=()):
+        self.traza = traza
+        self.nombre = nombre
+        self.extra = extra
+        self.histograma = histograma
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return None
+
+    def __exit__(self, *exc):
+        fin = time.perf_counter()
+        if self.histograma is not None:
+            self.histograma.observar(fin - self.t0, *self.etiquetas)
+        traza = self.traza
+        if traza is not None:
+            traza.spans.append(
+                (self.nombre, (self.t0 - traza.inicio) * 1000, (fin - self.t0) * 1000, self.extra)
+            )
+        return False
+
+
+def span(nombre: str, **extra):
+    """
+    Tramo de la traza de la petición actual. Sin traza (lo normal) sólo
+    cuesta leer una ContextVar. Las tareas creadas durante la petición
+    (p. ej. la generación compartida) heredan la traza.
+    """
+    traza = _traza_actual.get()
+    if traza is None:
+        return _SIN_TRAZA
+    return _Span(traza, nombre, extra)
+
+
+def medir(histograma: Histograma, *etiquetas: str, nombre_span: Optional[str] = None):
+    """Observa la duración del bloque en `histograma` y la añade como span."""
+    return _Span(
+        _traza_actual.get(), nombre_span or etiquetas[0], {}, histograma, etiquetas
+    )
+
+
+def marcar(nombre: str, **extra) -> None:
+    """Evento puntual (duración 0) en la traza actual, si la hay."""
+    traza = _traza_actual.get()
+    if traza is not None:
+        traza.spans.append((nombre, (time.perf_counter() - traza.inicio) * 1000, 0.0, extra))
+
+
+def traza_guardada(traza_id: str) -> Optional[dict]:
+    traza = _trazas.get(traza_id)
+    return traza.como_dict() if traza is not None else None
+
+
+# === MIDDLEWARE HTTP ===
+_http_duracion = metricas.histograma(
+    "http_duracion_segundos",
+    "Duración de la petición HTTP hasta el último byte, por ruta",
+    etiquetas=("metodo", "ruta", "codigo"),
+)
+_http_primer_byte = metricas.histograma(
+    "http_primer_byte_segundos",
+    "Tiempo hasta el primer byte del cuerpo, por ruta",
+    etiquetas=("metodo", "ruta"),
+)
+
+
+class MedirPeticiones:
+    """
+    Middleware ASGI: latencia y primer byte por plantilla de ruta (no por
+    URL, para no disparar la cardinalidad) y, si la petición trae la
+    cabecera de traza, guarda sus spans y responde con X-Chefito-Traza-Id.
+    """
+
+    def __init__(self, app, registro: RegistroMetricas = metricas):
+        self.app = app
+        self.registro = registro
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registro.activa:
+            await self.app(scope, receive, send)
+            return
+
+        traza = None
+        for nombre, _ in scope.get("headers", ()):
+            if nombre == TRAZA_CABECERA.encode():
+                traza = Traza(scope["path"])
+                break
+        token_traza = _traza_actual.set(traza) if traza is not None else None
+
+        t0 = time.perf_counter()
+        primer_byte = None
+        codigo = 500
+
+        async def send_medido(mensaje):
+            nonlocal primer_byte, codigo
+            tipo = mensaje["type"]
+            if tipo == "http.response.start":
+                codigo = mensaje["status"]
+                if traza is not None:
+                    mensaje.setdefault("headers", [])
+                    mensaje["headers"] = list(mensaje["headers"]) + [
+                        (b"x-chefito-traza-id", traza.id.encode())
+                    ]
+            elif tipo == "http.response.body" and primer_byte is None and mensaje.get("body"):
+                primer_byte = time.perf_counter() - t0
+                if traza is not None:
+                    marcar("primer_byte")
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            duracion = time.perf_counter() - t0
+            ruta = scope.get("route")
+            plantilla = getattr(ruta, "path", None) or "sin_ruta"
+            metodo = scope.get("method", "")
+            _http_duracion.observar(duracion, metodo, plantilla, str(codigo))
+            if primer_byte is not None:
+                _http_primer_byte.observar(primer_byte, metodo, plantilla)
+            if traza is not None:
+                traza.ruta = plantilla
+                traza.spans.append(("peticion", 0.0, duracion * 1000, {"codigo": codigo}))
+                _trazas[traza.id] = traza
+                _traza_actual.reset(token_traza)
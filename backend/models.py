@@ -4,12 +4,36 @@ from typing import List, Optional
 import enum
 from datetime import datetime
 
-from sqlalchemy import DateTime, Enum, ForeignKey, String, Text
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+)
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 
 from .database import Base
 
+# SQLite guarda CURRENT_TIMESTAMP sin microsegundos. Las fechas enviadas
+# desde Python usan el mismo formato para que las comparaciones de texto
+# (cursores de paginación) sean coherentes.
+FechaHora = DateTime().with_variant(
+    sqlite.DATETIME(
+        storage_format=(
+            "%(year)04d-%(month)02d-%(day)02d "
+            "%(hour)02d:%(minute)02d:%(second)02d"
+        )
+    ),
+    "sqlite",
+)
+
 
 class RoleEnum(str, enum.Enum):
     user = "user"
@@ -28,7 +52,7 @@ class User(Base):
     )
     password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, server_default=func.now()
+        FechaHora, server_default=func.now()
     )
 
     conversations: Mapped[List["Conversation"]] = relationship(
@@ -40,15 +64,41 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    # Sidebar paginado: rango por usuario en orden de actividad
+    __table_args__ = (
+        Index("ix_conversations_user_updated_id", "user_id", "updated_at", "id"),
+    )
 
     id: Mapped[str] = mapped_column(String(64), primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     title: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Título ya limpio para la barra lateral (titulos.normalizar_titulo)
+    display_title: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # Resumen acumulado de los turnos que ya no se envían literalmente
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Último mensaje incorporado al resumen (0 = ninguno)
+    summary_upto_id: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, server_default=func.now()
+        FechaHora, server_default=func.now()
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime, server_default=func.now(), onupdate=func.now()
+        FechaHora, server_default=func.now(), onupdate=func.now()
+    )
+    # Mensajes movidos a conversation_archives (None = en messages)
+    archived_at: Mapped[Optional[datetime]] = mapped_column(FechaHora, nullable=True)
+    # Contadores y extracto de la barra lateral: los mantiene
+    # guardar_mensajes_db en la misma transacción que los mensajes
+    # (se recalculan con `python -m backend.cli reparar-estadisticas`)
+    message_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    image_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    last_message_preview: Mapped[Optional[str]] = mapped_column(
+        String(160), nullable=True
     )
 
     user: Mapped["User"] = relationship("User", back_populates="conversations")
@@ -61,6 +111,15 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Historial de una conversación en orden: rango sobre el índice, sin sort
+    __table_args__ = (
+        Index(
+            "ix_messages_conversation_created_id",
+            "conversation_id",
+            "created_at",
+            "id",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(
         primary_key=True, index=True, autoincrement=True
@@ -70,10 +129,35 @@ class Message(Base):
     )
     role: Mapped[RoleEnum] = mapped_column(Enum(RoleEnum), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
+    # Mensaje del usuario enviado con imagen (la imagen no se guarda)
+    has_image: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default="0"
+    )
+    # Respuesta del clasificador fuera de tema, no del modelo: no sirve de
+    # ejemplo para reentrenarlo (ver clasificador.py)
+    local_reply: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default="0"
+    )
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, server_default=func.now()
+        FechaHora, server_default=func.now()
     )
 
     conversation: Mapped["Conversation"] = relationship(
         "Conversation", back_populates="messages"
-    )
\ No newline at end of file
+    )
+
+class ConversationArchive(Base):
+    """Mensajes de una conversación inactiva, comprimidos (ver archivo.py)."""
+
+    __tablename__ = "conversation_archives"
+
+    conversation_id: Mapped[str] = mapped_column(
+        ForeignKey("conversations.id"), primary_key=True
+    )
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # JSON de [id, role, content, created_at, has_image] comprimido con zlib
+    # (los archivados antes de has_image no llevan el quinto campo)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        FechaHora, server_default=func.now()
+    )
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Hashable, Optional
+
+from cachetools import TTLCache
+from google.genai import errors as genai_errors
+
+from .metricas import metricas, span
+
+# === CONFIG PASARELA DEL MODELO ===
+# Llamadas simultáneas al modelo por worker (streams y títulos). Se aceptan
+# los nombres antiguos de cuando sólo se limitaban los streams
+MODELO_MAX_CONCURRENTES: int = int(
+    os.getenv("MODELO_MAX_CONCURRENTES") or os.getenv("MAX_STREAMS_POR_WORKER") or "32"
+)
+# Espera máxima en la cola antes de responder "sobrecargado"
+MODELO_ESPERA_MAX_S: float = float(
+    os.getenv("MODELO_ESPERA_MAX_S") or os.getenv("STREAM_SLOT_TIMEOUT") or "30"
+)
+# Peticiones en cola a partir de las cuales se rechaza sin esperar
+MODELO_COLA_MAX: int = int(os.getenv("MODELO_COLA_MAX") or "256")
+# Cubeta por usuario: ritmo sostenido (peticiones/s) y ráfaga
+MODELO_TASA_USUARIO: float = float(os.getenv("MODELO_TASA_USUARIO") or "0.5")
+MODELO_RAFAGA_USUARIO: float = float(os.getenv("MODELO_RAFAGA_USUARIO") or "10")
+# Reintentos ante 503 / 429 del modelo (antes del primer trozo), con
+# espera exponencial y jitter completo
+MODELO_REINTENTOS: int = int(os.getenv("MODELO_REINTENTOS") or "2")
+MODELO_BACKOFF_BASE_S: float = float(os.getenv("MODELO_BACKOFF_BASE_S") or "0.5")
+MODELO_BACKOFF_MAX_S: float = float(os.getenv("MODELO_BACKOFF_MAX_S") or "4")
+
+# Ventana de esperas recientes para los percentiles
+_ESPERAS_VENTANA = 1000
+_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# Cada intento contra el modelo (en streams, hasta el primer trozo)
+_llamada_modelo = metricas.histograma(
+    "modelo_llamada_segundos",
+    "Duración de cada intento de llamada al modelo (stream: hasta el primer trozo)",
+    etiquetas=("tipo",),
+)
+_errores_modelo = metricas.contador(
+    "modelo_errores_total",
+    "Errores del modelo por código HTTP, reintentados o no",
+    etiquetas=("tipo", "codigo"),
+)
+_espera_cupo = metricas.histograma(
+    "modelo_espera_cupo_segundos", "Espera en la cola de la pasarela hasta tener cupo"
+)
+
+
+class ModeloSaturado(Exception):
+    """No hubo cupo para llamar al modelo a tiempo (cola llena o espera agotada)."""
+
+
+class LimiteUsuario(Exception):
+    """El usuario agotó su cubeta; `reintentar_en` segundos hasta el próximo token."""
+
+    def __init__(self, reintentar_en: float):
+        super().__init__(f"reintentar en {reintentar_en:.1f}s")
+        self.reintentar_en = reintentar_en
+
+
+class _Cubeta:
+    __slots__ = ("tokens", "actualizada")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.actualizada = time.monotonic()
+
+
+def _reintentable(error: Exception) -> bool:
+    return isinstance(error, genai_errors.APIError) and error.code in _REINTENTABLES
+
+
+class _StreamConCupo:
+    """
+    Iterador del stream del modelo que devuelve el cupo al cerrarse
+    (aclose) o al terminar, aunque no se llegue a iterar.
+    """
+
+    def __init__(self, primero, resto, liberar: Callable[[], None]):
+        self._primero = primero
+        self._resto = resto
+        self._liberar: Optional[Callable[[], None]] = liberar
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._primero is not None:
+            primero, self._primero = self._primero, None
+            return primero
+        try:
+            return await self._resto.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        if self._liberar is None:
+            return
+        liberar, self._liberar = self._liberar, None
+        try:
+            await self._resto.aclose()
+        finally:
+            liberar()
+
+
+class PasarelaModelo:
+    """
+    Único camino hacia Gemini desde el worker:
+      - cubeta de tokens por usuario (ráfaga + ritmo sostenido),
+      - tope global de llamadas simultáneas,
+      - cola justa: los cupos libres se reparten por turnos entre usuarios
+        (uno con 50 peticiones no deja esperando a los demás), con espera
+        máxima,
+      - reintentos con backoff exponencial y jitter ante 503 / 429.
+    `proveedor` es una función que devuelve el ProveedorModelo en cada
+    llamada (se puede sustituir en caliente, p. ej. en benchmarks).
+    """
+
+    def __init__(
+        self,
+        proveedor: Callable[[], Any],
+        max_concurrentes: int = MODELO_MAX_CONCURRENTES,
+        espera_max_s: float = MODELO_ESPERA_MAX_S,
+        cola_max: int = MODELO_COLA_MAX,
+        tasa_usuario: float = MODELO_TASA_USUARIO,
+        rafaga_usuario: float = MODELO_RAFAGA_USUARIO,
+        reintentos: int = MODELO_REINTENTOS,
+        backoff_base_s: float = MODELO_BACKOFF_BASE_S,
+        backoff_max_s: float = MODELO_BACKOFF_MAX_S,
+    ):
+        self._proveedor = proveedor
+        self.max_concurrentes = max_concurrentes
+        self.espera_max_s = espera_max_s
+        self.cola_max = cola_max
+        self.tasa_usuario = tasa_usuario
+        self.rafaga_usuario = rafaga_usuario
+        self.reintentos = reintentos
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+        self._en_uso = 0
+        # usuario -> futuros esperando; el orden del dict es el turno
+        self._colas: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._esperando = 0
+        # Cubetas de usuarios inactivos se olvidan (vuelven llenas)
+        ttl = max(60.0, rafaga_usuario / tasa_usuario) if tasa_usuario > 0 else 3600.0
+        self._cubetas: TTLCache = TTLCache(maxsize=50_000, ttl=ttl)
+        self._esperas: Deque[float] = deque(maxlen=_ESPERAS_VENTANA)
+        self.stats = {
+            "llamadas": 0,
+            "encoladas": 0,
+            "rechazadas_cola": 0,
+            "rechazadas_espera": 0,
+            "rechazadas_usuario": 0,
+            "reintentos": 0,
+            "errores_modelo": 0,
+            "espera_max_ms": 0.0,
+        }
+
+    # --- API ---
+    async def generar(self, usuario: Hashable, coste: float = 1, **kwargs):
+        """Respuesta completa del modelo con cupo y reintentos."""
+        async with self.cupo(usuario, coste):
+            return await self._con_reintentos(
+                lambda: self._proveedor().generar(**kwargs), "generar"
+            )
+
+    async def abrir_stream(self, usuario: Hashable, coste: float = 1, **kwargs):
+        """
+        Stream del modelo con cupo y reintentos.
+        Sólo se reintenta hasta recibir el primer trozo (después ya se ha
+        enviado texto al cliente). El cupo se devuelve con `aclose()`.
+        """
+        await self.adquirir(usuario, coste)
+        try:
+
+            async def abrir():
+                stream = await self._proveedor().abrir_stream(**kwargs)
+                try:
+                    # La petición HTTP sale al pedir el primer trozo
+                    return stream, await stream.__anext__()
+                except BaseException:
+                    await stream.aclose()
+                    raise
+
+            stream, primero = await self._con_reintentos(abrir, "stream")
+        except StopAsyncIteration:
+            self.liberar()
+            return _StreamConCupo(None, _vacio(), lambda: None)
+        except BaseException:
+            self.liberar()
+            raise
+        return _StreamConCupo(primero, stream, self.liberar)
+
+    @asynccontextmanager
+    async def cupo(self, usuario: Hashable, coste: float = 1) -> AsyncIterator[None]:
+        await self.adquirir(usuario, coste)
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    async def adquirir(self, usuario: Hashable, coste: float = 1) -> None:
+        """
+        Cobra `coste` de la cubeta del usuario (LimiteUsuario si no llega) y
+        espera turno en la cola (ModeloSaturado si no llega a tiempo).
+        """
+        if coste:
+            self._cobrar(usuario, coste)
+
+        with span("modelo_cupo"):
+            await self._esperar_turno(usuario)
+
+    async def _esperar_turno(self, usuario: Hashable) -> None:
+        t0 = time.perf_counter()
+        if self._en_uso < self.max_concurrentes and not self._esperando:
+            self._en_uso += 1
+            self._registrar_espera(0.0)
+            return
+
+        if self._esperando >= self.cola_max:
+            self.stats["rechazadas_cola"] += 1
+            raise ModeloSaturado("cola llena")
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._colas.setdefault(usuario, deque()).append(futuro)
+        self._esperando += 1
+        self.stats["encoladas"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(futuro), timeout=self.espera_max_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if futuro.done() and not futuro.cancelled():
+                # Se concedió justo a la vez: devolverlo a la cola
+                self.liberar()
+            else:
+                futuro.cancel()
+                self._quitar(usuario, futuro)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["rechazadas_espera"] += 1
+                raise ModeloSaturado("espera agotada")
+            raise
+        self._registrar_espera(time.perf_counter() - t0)
+
+    def liberar(self) -> None:
+        """Devuelve un cupo: pasa directamente al siguiente usuario en turno."""
+        while self._colas:
+            usuario, cola = next(iter(self._colas.items()))
+            futuro = cola.popleft()
+            self._esperando -= 1
+            if cola:
+                self._colas.move_to_end(usuario)
+            else:
+                del self._colas[usuario]
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self._en_uso -= 1
+
+    def resumen(self) -> dict:
+        esperas = sorted(self._esperas)
+
+        def pct(p: float) -> float:
+            if not esperas:
+                return 0.0
+            return round(esperas[min(len(esperas) - 1, int(p * len(esperas)))] * 1000, 1)
+
+        return {
+            **self.stats,
+            "en_uso": self._en_uso,
+            "en_cola": self._esperando,
+            "usuarios_en_cola": len(self._colas),
+            "espera_p50_ms": pct(0.5),
+            "espera_p95_ms": pct(0.95),
+        }
+
+    # --- interno ---
+    def _cobrar(self, usuario: Hashable, coste: float) -> None:
+        ahora = time.monotonic()
+        cubeta = self._cubetas.get(usuario)
+        if cubeta is None:
+            cubeta = _Cubeta(self.rafaga_usuario)
+        else:
+            cubeta.tokens = min(
+                self.rafaga_usuario,
+                cubeta.tokens + (ahora - cubeta.actualizada) * self.tasa_usuario,
+            )
+            cubeta.actualizada = ahora
+        # Reinsertar renueva el TTL de la cubeta
+        self._cubetas[usuario] = cubeta
+        if cubeta.tokens < coste:
+            self.stats["rechazadas_usuario"] += 1
+            falta = coste - cubeta.tokens
+            raise LimiteUsuario(falta / self.tasa_usuario if self.tasa_usuario > 0 else 60.0)
+        cubeta.tokens -= coste
+
+    def _quitar(self, usuario: Hashable, futuro: asyncio.Future) -> None:
+        cola = self._colas.get(usuario)
+        if cola is None or futuro not in cola:
+            return
+        cola.remove(futuro)
+        self._esperando -= 1
+        if not cola:
+            del self._colas[usuario]
+
+    def _registrar_espera(self, segundos: float) -> None:
+        _espera_cupo.observar(segundos)
+        self.stats["llamadas"] += 1
+        self._esperas.append(segundos)
+        ms = round(segundos * 1000, 1)
+        if ms > self.stats["espera_max_ms"]:
+            self.stats["espera_max_ms"] = ms
+
+    async def _con_reintentos(self, llamada, tipo: str):
+        intento = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                with span(f"modelo_{tipo}", intento=intento):
+                    resultado = await llamada()
+            except genai_errors.APIError as e:
+                _llamada_modelo.observar(time.perf_counter() - t0, tipo)
+                _errores_modelo.sumar(tipo, str(e.code))
+                if not _reintentable(e) or intento >= self.reintentos:
+                    self.stats["errores_modelo"] += 1
+                    raise
+                tope = min(self.backoff_max_s, self.backoff_base_s * 2**intento)
+                intento += 1
+                self.stats["reintentos"] += 1
+                await asyncio.sleep(random.uniform(0, tope))
+                continue
+            _llamada_modelo.observar(time.perf_counter() - t0, tipo)
+            return resultado
+
+
+async def _vacio():
+    return
+    yield
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+# === CONFIG WRITE-BEHIND ===
+TURNOS_LOTE_MAX: int = int(os.getenv("TURNOS_LOTE_MAX") or "64")
+TURNOS_FLUSH_MS: int = int(os.getenv("TURNOS_FLUSH_MS") or "50")
+# Turnos pendientes máximos; al llenarse, encolar() espera (backpressure)
+TURNOS_COLA_MAX: int = int(os.getenv("TURNOS_COLA_MAX") or "2000")
+TURNOS_REINTENTOS: int = 3
+# Lo más que una lectura (historial, barra lateral…) espera a que se guarden
+# los turnos ya encolados; pasado ese tiempo lee lo que haya
+TURNOS_ESPERA_LECTURA_S: float = float(os.getenv("TURNOS_ESPERA_LECTURA_S") or "5")
+
+
+@dataclass
+class TurnoPendiente:
+    conv_id: str
+    user_message: str
+    bot_response: str
+    # (texto, hasta_id) si el turno actualiza el resumen de contexto
+    resumen: Optional[tuple] = None
+    # (título nuevo, título esperado): sólo se aplica si la conversación
+    # conserva el título esperado (no pisa un renombrado del usuario)
+    titulo: Optional[tuple] = None
+    # El mensaje del usuario llevaba imagen (Message.has_image)
+    con_imagen: bool = False
+    # La respuesta la dio el clasificador (Message.local_reply)
+    respuesta_local: bool = False
+    # Dueño de la conversación: las lecturas por usuario esperan sus turnos
+    user_id: Optional[int] = None
+
+
+@dataclass
+class _EnVuelo:
+    """Turnos de una conversación (o usuario) encolados y ya volcados."""
+
+    encolados: int = 0
+    hechos: int = 0
+    aviso: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class ColaTurnos:
+    """
+    Cola en memoria de turnos de chat pendientes de guardar.
+
+    Un único task los agrupa y los vuelca en lotes: cuando hay `max_lote`
+    turnos o han pasado `flush_ms` desde el primero del lote. `guardar`
+    recibe la lista de turnos y debe persistirla en una transacción.
+
+    El DONE sale antes de que el turno esté en disco: quien lee justo
+    después (el siguiente mensaje, la barra lateral) llama antes a
+    `esperar` con la conversación o el usuario.
+    """
+
+    def __init__(
+        self,
+        guardar: Callable[[List[TurnoPendiente]], Awaitable[None]],
+        max_lote: int = TURNOS_LOTE_MAX,
+        flush_ms: int = TURNOS_FLUSH_MS,
+        max_pendientes: int = TURNOS_COLA_MAX,
+    ):
+        self._guardar = guardar
+        self.max_lote = max_lote
+        self.flush_s = flush_ms / 1000
+        self.max_pendientes = max_pendientes
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+        # ("conv", id) / ("user", id) -> turnos en vuelo
+        self._en_vuelo: Dict[Hashable, _EnVuelo] = {}
+        self.stats = {
+            "encolados": 0,
+            "guardados": 0,
+            "lotes": 0,
+            "reintentos": 0,
+            # Turnos que tampoco se pudieron guardar solos
+            "perdidos": 0,
+            "max_pendientes_visto": 0,
+            "esperas_cola_llena": 0,
+            "espera_max_ms": 0.0,
+            # Lecturas que tuvieron que esperar a turnos encolados
+            "lecturas_esperando": 0,
+            "lecturas_sin_esperar_del_todo": 0,
+        }
+
+    @property
+    def pendientes(self) -> int:
+        return self._cola.qsize() if self._cola else 0
+
+    def iniciar(self) -> None:
+        """Arranca el task de volcado en el loop actual (idempotente)."""
+        if self._tarea is not None and not self._tarea.done():
+            return
+        self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+        self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+
+    async def encolar(self, turno: TurnoPendiente) -> None:
+        self.iniciar()
+        assert self._cola is not None
+        # Antes de poner en cola: cuenta para `esperar` desde ya
+        self._apuntar(turno)
+        if self._cola.full():
+            # Backpressure: el stream espera a que haya hueco
+            self.stats["esperas_cola_llena"] += 1
+            loop = asyncio.get_running_loop()
+            t0 = loop.time()
+            try:
+                await self._cola.put(turno)
+            except BaseException:
+                self._soltar(turno)
+                raise
+            espera_ms = (loop.time() - t0) * 1000
+            self.stats["espera_max_ms"] = max(self.stats["espera_max_ms"], espera_ms)
+        else:
+            self._cola.put_nowait(turno)
+        self.stats["encolados"] += 1
+        self.stats["max_pendientes_visto"] = max(
+            self.stats["max_pendientes_visto"], self._cola.qsize()
+        )
+
+    async def esperar(
+        self,
+        conv_id: Optional[str] = None,
+        user_id: Optional[int] = None,
+        timeout: float = TURNOS_ESPERA_LECTURA_S,
+    ) -> None:
+        """
+        Espera a que estén guardados (o perdidos) los turnos ya encolados
+        de `conv_id` y/o de `user_id`. Sin turnos pendientes no espera nada.
+        """
+        objetivos = []
+        for clave in (("conv", conv_id), ("user", user_id)):
+            vuelo = self._en_vuelo.get(clave) if clave[1] is not None else None
+            if vuelo is not None:
+                objetivos.append((vuelo, vuelo.encolados))
+        if not objetivos:
+            return
+        self.stats["lecturas_esperando"] += 1
+
+        async def hasta_volcados():
+            for vuelo, objetivo in objetivos:
+                while vuelo.hechos < objetivo:
+                    await vuelo.aviso.wait()
+
+        try:
+            await asyncio.wait_for(hasta_volcados(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["lecturas_sin_esperar_del_todo"] += 1
+
+    async def detener(self, timeout: float = 30.0) -> None:
+        """Vacía la cola (guarda todo lo pendiente) y para el task."""
+        if self._tarea is None or self._cola is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Cola de turnos: {self._cola.qsize()} turnos sin guardar al cerrar")
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        self._tarea = None
+
+    async def _bucle(self) -> None:
+        assert self._cola is not None
+        cola = self._cola
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await cola.get()]
+            limite = loop.time() + self.flush_s
+            while len(lote) < self.max_lote:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._volcar(lote)
+            finally:
+                for turno in lote:
+                    cola.task_done()
+                    self._soltar(turno)
+
+    async def _volcar(self, lote: List[TurnoPendiente]) -> None:
+        for intento in range(TURNOS_REINTENTOS):
+            try:
+                await self._guardar(lote)
+                self.stats["guardados"] += len(lote)
+                self.stats["lotes"] += 1
+                return
+            except Exception as e:
+                print("Error guardando lote de turnos:", repr(e))
+                self.stats["reintentos"] += 1
+                await asyncio.sleep(0.2 * (intento + 1))
+        if len(lote) == 1:
+            self._perdido(lote[0], None)
+            return
+        # Un turno malo (fila enorme, restricción…) no se lleva por delante
+        # los de los demás: uno a uno, sólo se pierde el que sigue fallando
+        for turno in lote:
+            try:
+                await self._guardar([turno])
+                self.stats["guardados"] += 1
+                self.stats["lotes"] += 1
+            except Exception as e:
+                self._perdido(turno, e)
+
+    @staticmethod
+    def _claves(turno: TurnoPendiente):
+        yield ("conv", turno.conv_id)
+        if turno.user_id is not None:
+            yield ("user", turno.user_id)
+
+    def _apuntar(self, turno: TurnoPendiente) -> None:
+        for clave in self._claves(turno):
+            vuelo = self._en_vuelo.get(clave)
+            if vuelo is None:
+                vuelo = self._en_vuelo[clave] = _EnVuelo()
+            vuelo.encolados += 1
+
+    def _soltar(self, turno: TurnoPendiente) -> None:
+        for clave in self._claves(turno):
+            vuelo = self._en_vuelo.get(clave)
+            if vuelo is None:
+                continue
+            vuelo.hechos += 1
+            # Despierta a quien espera y deja un aviso nuevo para el siguiente
+            vuelo.aviso.set()
+            vuelo.aviso = asyncio.Event()
+            if vuelo.hechos >= vuelo.encolados:
+                del self._en_vuelo[clave]
+
+    def _perdido(self, turno: TurnoPendiente, error: Optional[Exception]) -> None:
+        self.stats["perdidos"] += 1
+        print(
+            f"⚠️ Turno perdido de la conversación {turno.conv_id}"
+            + (f": {error!r}" if error is not None else "")
+        )
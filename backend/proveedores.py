@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import random
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Optional
+
+from google.genai import Client, errors as genai_errors, types
+
+# === CONFIG PROVEEDOR DEL MODELO ===
+# MODELO_PROVEEDOR: "gemini" (por defecto) o "falso", modelo local sin red
+# para pruebas de carga y CI. Con "falso" no hace falta GEMINI_API_KEY.
+# Se lee al crear el proveedor (después de cargar .env)
+
+# Modelo falso: tiempo hasta el primer token, ritmo de salida, tokens por
+# trozo del stream, longitud de la respuesta y fracción de llamadas que
+# fallan con 503 (como Gemini en un pico). Con la misma semilla y el mismo
+# orden de llamadas el resultado es siempre el mismo
+MODELO_FALSO_TTFT_MS: float = float(os.getenv("MODELO_FALSO_TTFT_MS") or "400")
+MODELO_FALSO_TOKENS_POR_S: float = float(os.getenv("MODELO_FALSO_TOKENS_POR_S") or "100")
+MODELO_FALSO_TOKENS_POR_TROZO: int = int(os.getenv("MODELO_FALSO_TOKENS_POR_TROZO") or "8")
+MODELO_FALSO_TOKENS_RESPUESTA: int = int(os.getenv("MODELO_FALSO_TOKENS_RESPUESTA") or "200")
+MODELO_FALSO_TASA_ERROR: float = float(os.getenv("MODELO_FALSO_TASA_ERROR") or "0")
+MODELO_FALSO_SEMILLA: int = int(os.getenv("MODELO_FALSO_SEMILLA") or "1")
+
+_VOCABULARIO_FALSO = (
+    "sofríe la cebolla con aceite de oliva y añade el ajo picado , después "
+    "incorpora el tomate rallado , una pizca de sal y pimienta , deja "
+    "reducir a fuego lento durante diez minutos y sirve con arroz , pasta "
+    "o pan tostado ; para la salsa mezcla yogur , limón , perejil y comino ."
+).split()
+_ERROR_503 = {
+    "error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}
+}
+
+
+class ProveedorModelo(ABC):
+    """
+    Lo que el resto del backend necesita de un modelo. Los argumentos son
+    los de google-genai (model, contents, config) y las respuestas tienen
+    `.text` y `.usage_metadata`, así que el chat y los títulos no saben
+    qué proveedor hay detrás. Los errores son los de google-genai
+    (la pasarela reintenta los 503 / 429 de cualquier proveedor).
+
+    Abstracta: un proveedor al que le falte un método falla al crearlo,
+    no en el primer chat.
+    """
+
+    nombre = "base"
+
+    @abstractmethod
+    async def generar(self, **kwargs) -> Any:
+        """Respuesta completa (generate_content)."""
+
+    @abstractmethod
+    async def abrir_stream(self, **kwargs) -> AsyncIterator[Any]:
+        """
+        Iterador asíncrono de trozos (generate_content_stream). Como en
+        google-genai, la petición sale al pedir el primer trozo y
+        `aclose()` la aborta.
+        """
+
+
+class ProveedorGemini(ProveedorModelo):
+    nombre = "gemini"
+
+    def __init__(self, cliente: Client):
+        self.cliente = cliente
+
+    async def generar(self, **kwargs):
+        return await self.cliente.aio.models.generate_content(**kwargs)
+
+    async def abrir_stream(self, **kwargs):
+        return await self.cliente.aio.models.generate_content_stream(**kwargs)
+
+
+class ProveedorFalso(ProveedorModelo):
+    """
+    Modelo local determinista: el texto sale del hash del último mensaje
+    (misma pregunta, misma respuesta) y los tiempos siguen TTFT y tokens/s
+    configurados, con plazos absolutos para que la espera no se acumule
+    aunque el event loop vaya cargado. Un token es una palabra.
+    """
+
+    nombre = "falso"
+
+    def __init__(
+        self,
+        ttft_ms: float = MODELO_FALSO_TTFT_MS,
+        tokens_por_s: float = MODELO_FALSO_TOKENS_POR_S,
+        tokens_por_trozo: int = MODELO_FALSO_TOKENS_POR_TROZO,
+        tokens_respuesta: int = MODELO_FALSO_TOKENS_RESPUESTA,
+        tasa_error: float = MODELO_FALSO_TASA_ERROR,
+        semilla: int = MODELO_FALSO_SEMILLA,
+    ):
+        self.ttft_s = ttft_ms / 1000
+        self.tokens_por_s = tokens_por_s
+        self.tokens_por_trozo = max(1, tokens_por_trozo)
+        self.tokens_respuesta = max(1, tokens_respuesta)
+        self.tasa_error = tasa_error
+        self.semilla = semilla
+        self._azar = random.Random(semilla)
+        self.stats = {"llamadas": 0, "errores": 0, "tokens": 0}
+
+    async def generar(self, **kwargs):
+        palabras = self._palabras(kwargs)
+        await self._esperar_o_fallar(
+            self.ttft_s + self._segundos_para(len(palabras))
+        )
+        self.stats["tokens"] += len(palabras)
+        return _respuesta(" ".join(palabras), len(palabras))
+
+    async def abrir_stream(self, **kwargs):
+        palabras = self._palabras(kwargs)
+        # El fallo se decide ya (orden de llamada), pero se lanza al pedir el
+        # primer trozo, como hace el SDK con la petición HTTP
+        falla = self._sortear_error()
+
+        async def trozos():
+            loop = asyncio.get_running_loop()
+            inicio = loop.time()
+            if falla:
+                await asyncio.sleep(self.ttft_s)
+                raise genai_errors.ServerError(503, _ERROR_503)
+            enviados = 0
+            while enviados < len(palabras):
+                bloque = palabras[enviados : enviados + self.tokens_por_trozo]
+                plazo = inicio + self.ttft_s + self._segundos_para(enviados)
+                await asyncio.sleep(max(0.0, plazo - loop.time()))
+                enviados += len(bloque)
+                self.stats["tokens"] += len(bloque)
+                # El recuento de tokens llega con el último trozo
+                total = enviados if enviados == len(palabras) else None
+                yield _respuesta(" ".join(bloque) + " ", total)
+
+        return trozos()
+
+    # --- interno ---
+    def _sortear_error(self) -> bool:
+        self.stats["llamadas"] += 1
+        if self.tasa_error and self._azar.random() < self.tasa_error:
+            self.stats["errores"] += 1
+            return True
+        return False
+
+    async def _esperar_o_fallar(self, segundos: float) -> None:
+        if self._sortear_error():
+            await asyncio.sleep(self.ttft_s)
+            raise genai_errors.ServerError(503, _ERROR_503)
+        await asyncio.sleep(segundos)
+
+    def _segundos_para(self, tokens: int) -> float:
+        return tokens / self.tokens_por_s if self.tokens_por_s > 0 else 0.0
+
+    def _palabras(self, kwargs: dict) -> list:
+        n = self.tokens_respuesta
+        config = kwargs.get("config")
+        maximo = getattr(config, "max_output_tokens", None)
+        if maximo:
+            n = min(n, maximo)
+        clave = f"{self.semilla}:{_ultimo_texto(kwargs.get('contents'))}"
+        azar = random.Random(hashlib.sha256(clave.encode("utf-8")).digest())
+        return [azar.choice(_VOCABULARIO_FALSO) for _ in range(n)]
+
+
+def _ultimo_texto(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    for content in reversed(contents or []):
+        if isinstance(content, str):
+            return content
+        for part in reversed(getattr(content, "parts", None) or []):
+            if getattr(part, "text", None):
+                return part.text
+    return ""
+
+
+def _respuesta(texto: str, tokens: Optional[int]) -> types.GenerateContentResponse:
+    """Mismo tipo que devuelve google-genai (incluido `.text`)."""
+    return types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text=texto)])
+            )
+        ],
+        usage_metadata=(
+            types.GenerateContentResponseUsageMetadata(candidates_token_count=tokens)
+            if tokens
+            else None
+        ),
+    )
+
+
+def crear_proveedor(nombre: Optional[str] = None) -> ProveedorModelo:
+    """Proveedor según MODELO_PROVEEDOR. Gemini necesita GEMINI_API_KEY."""
+    nombre = (nombre or os.getenv("MODELO_PROVEEDOR") or "gemini").strip().lower()
+    if nombre == "falso":
+        return ProveedorFalso()
+    if nombre != "gemini":
+        raise RuntimeError(f"❌ Error: MODELO_PROVEEDOR desconocido: {nombre!r}")
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError(
+            "❌ Error: GEMINI_API_KEY no está definida en el archivo .env "
+            "(o usa MODELO_PROVEEDOR=falso para el modelo local)"
+        )
+    return ProveedorGemini(Client(api_key=api_key))
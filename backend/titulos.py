@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Optional, Tuple
+
+TITULO_POR_DEFECTO = "Nueva Receta"
+TITULO_MAX_CHARS = 50
+
+
+def normalizar_titulo(title: Optional[str]) -> str:
+    """
+    Título tal y como se muestra en la barra lateral: primera línea, sin
+    negritas ni emojis de saludo, cortado en la primera exclamación y a
+    50 caracteres. Se calcula al escribir el título, no al listar.
+    """
+    title = title or TITULO_POR_DEFECTO
+    title_clean = (
+        title.split("\n")[0]
+        .strip()
+        .replace("**", "")
+        .split("!")[0]
+        .replace("🍳", "")
+        .replace("👋", "")
+        .strip()
+    )
+    if len(title_clean) > TITULO_MAX_CHARS:
+        title_clean = title_clean[:TITULO_MAX_CHARS] + "..."
+
+    return title_clean or TITULO_POR_DEFECTO
+
+
+# === VISTA PREVIA DEL ÚLTIMO MENSAJE ===
+VISTA_PREVIA_MAX_CHARS: int = int(os.getenv("VISTA_PREVIA_MAX_CHARS") or "120")
+
+_MARKDOWN_RE = re.compile(r"[*_`#>|~]+|^\s*(?:[-+•]|\d+[.)])\s+", re.MULTILINE)
+
+
+def vista_previa(texto: Optional[str]) -> Optional[str]:
+    """
+    Extracto del último mensaje para la barra lateral: sin marcas de
+    markdown, en una línea y cortado en una palabra. Como display_title,
+    se guarda al escribir (Conversation.last_message_preview).
+    """
+    if not texto:
+        return None
+    # Se llama dentro del escritor único con respuestas de varios KB: basta
+    # limpiar el principio, salvo que casi todo sea markdown o espacios
+    ventana = VISTA_PREVIA_MAX_CHARS * 4
+    while True:
+        limpio = " ".join(_MARKDOWN_RE.sub("", texto[:ventana]).split())
+        if ventana >= len(texto) or len(limpio) > VISTA_PREVIA_MAX_CHARS + 1:
+            break
+        ventana *= 4
+    if len(limpio) > VISTA_PREVIA_MAX_CHARS:
+        corte = limpio[:VISTA_PREVIA_MAX_CHARS]
+        # Sin partir la última palabra si queda algo razonable
+        espacio = corte.rfind(" ")
+        if espacio > VISTA_PREVIA_MAX_CHARS // 2:
+            corte = corte[:espacio]
+        limpio = corte.rstrip(" ,.;:") + "…"
+    return limpio or None
+
+
+# === TITULADOR HEURÍSTICO ===
+# Confianza mínima para no pedir el título a Gemini
+TITULO_CONFIANZA_MIN: float = float(os.getenv("TITULO_CONFIANZA_MIN") or "0.6")
+
+_ENCABEZADO_RE = re.compile(r"\*\*(.+?)\*\*|^#+\s*(.+)$", re.MULTILINE)
+_PREFIJO_OPCION_RE = re.compile(
+    r"^(opci[oó]n|receta|idea|propuesta)\s*(n[º°o.]*\s*)?\d*\s*[:.\-–]\s*", re.IGNORECASE
+)
+_PALABRA_RE = re.compile(r"[a-záéíóúüñ]+")
+_RELLENO_RE = re.compile(
+    r"^[¡¿\s]*((hola|buenas|buenos días|buenas tardes|buenas noches|oye|"
+    r"ayuda(me)?|necesito|por favor|podrías|puedes)[\s,!.]+)+",
+    re.IGNORECASE,
+)
+
+# Encabezados de sección que no son el nombre de un plato
+_SECCIONES = {
+    "ingredientes", "preparación", "preparacion", "instrucciones", "pasos",
+    "elaboración", "elaboracion", "consejos", "tips", "nota", "notas",
+    "utensilios", "tiempo", "porciones", "raciones", "opcional", "variaciones",
+    "sugerencias", "presentación", "presentacion", "modo de preparación",
+    "para servir", "acompañamientos", "información nutricional",
+}
+_PLATOS = {
+    "tortilla", "paella", "pasta", "espaguetis", "lasaña", "pizza", "ensalada",
+    "sopa", "crema", "guiso", "estofado", "arepa", "arepas", "empanada",
+    "empanadas", "tacos", "burrito", "hamburguesa", "pastel", "torta",
+    "galletas", "brownie", "flan", "batido", "smoothie", "ceviche", "risotto",
+    "curry", "salsa", "pan", "bizcocho", "tarta", "omelette", "panqueques",
+    "wok", "sándwich", "sandwich", "pure", "puré", "lentejas", "sancocho",
+}
+_INGREDIENTES = {
+    "pollo", "carne", "res", "cerdo", "pescado", "atún", "salmón", "camarones",
+    "huevo", "huevos", "arroz", "papa", "papas", "patata", "patatas", "tomate",
+    "queso", "frijoles", "garbanzos", "aguacate", "plátano", "banano",
+    "chocolate", "manzana", "fresas", "leche", "avena", "champiñones",
+    "espinaca", "espinacas", "brócoli", "zanahoria", "cebolla", "maíz", "yuca",
+    "tofu", "quinoa", "verduras", "frutas", "calabacín", "berenjena", "pimentón",
+}
+_COMIDAS = {
+    "desayuno": "el desayuno", "almuerzo": "el almuerzo", "cena": "la cena",
+    "merienda": "la merienda", "postre": "el postre", "snack": "un snack",
+}
+# Negritas de saludo o relleno ("**¡Claro que sí!**")
+_MULETILLAS = {"hola", "claro", "perfecto", "genial", "excelente", "listo", "vale", "aquí", "aqui"}
+
+
+def _encabezado_plato(bot: str) -> Optional[str]:
+    """Primer título en negrita / encabezado que parece el nombre de un plato."""
+    for m in _ENCABEZADO_RE.finditer(bot or ""):
+        crudo = m.group(1) or m.group(2) or ""
+        if "!" in crudo or "¡" in crudo:
+            continue
+        t = crudo.strip(" :*#🍳👋")
+        t = _PREFIJO_OPCION_RE.sub("", t).strip(" :")
+        bajo = t.lower()
+        if not t or "?" in t or bajo in _SECCIONES:
+            continue
+        if bajo.split()[0].strip(",.") in _MULETILLAS:
+            continue
+        if any(bajo.startswith(s + " ") for s in _SECCIONES):
+            continue
+        if not 1 <= len(t.split()) <= 8 or len(t) < 4:
+            continue
+        return t
+    return None
+
+
+def titulo_heuristico(user_message: str, bot_response: str = "") -> Tuple[str, float]:
+    """
+    Título local (sin modelo) y su confianza entre 0 y 1:
+
+    - 0.9: título de receta en la respuesta (`**Tortilla de patatas**`)
+    - 0.7: plato o comida + ingredientes del mensaje ("Pasta con pollo")
+    - 0.6: sólo plato o sólo ingredientes ("Ideas con arroz y huevo")
+    - 0.4 o menos: nada reconocible; conviene preguntar al modelo
+    """
+    plato = _encabezado_plato(bot_response)
+    if plato:
+        return normalizar_titulo(plato), 0.9
+
+    palabras = _PALABRA_RE.findall((user_message or "").lower())
+    platos = [p for p in palabras if p in _PLATOS]
+    comidas = [p for p in palabras if p in _COMIDAS]
+    ingredientes = list(dict.fromkeys(p for p in palabras if p in _INGREDIENTES))[:2]
+    con = " y ".join(ingredientes)
+
+    base = (platos or comidas or [None])[0]
+    if base and ingredientes:
+        return normalizar_titulo(f"{base.capitalize()} con {con}"), 0.7
+    if platos:
+        return normalizar_titulo(f"Receta de {platos[0]}"), 0.6
+    if ingredientes:
+        return normalizar_titulo(f"Ideas con {con}"), 0.6
+    if comidas:
+        return normalizar_titulo(f"Ideas para {_COMIDAS[comidas[0]]}"), 0.4
+
+    # Primeras palabras del mensaje, como hacía el frontend: sin saludos
+    # ni relleno al inicio y cortado en la primera puntuación
+    texto = _RELLENO_RE.sub("", " ".join((user_message or "").split()))
+    texto = re.split(r"[?.!,]", texto)[0]
+    texto = " ".join(texto.split()[:6]).strip(" ¿¡")
+    if not texto:
+        return TITULO_POR_DEFECTO, 0.0
+    return normalizar_titulo(texto[0].upper() + texto[1:]), 0.2
+
+
+def limpiar_titulo_ia(raw: Optional[str]) -> Optional[str]:
+    """Quita prefijos como "Título: ..." y comillas de la respuesta del modelo."""
+    clean = (raw or "").replace("\n", " ").strip()
+    if clean.lower().startswith("título:") or clean.lower().startswith("titulo:"):
+        clean = clean.split(":", 1)[1].strip()
+    clean = clean.strip(' "“”')
+    return normalizar_titulo(clean) if clean else None
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional
+
+# === CONFIG TRANSPORTE DEL CHAT ===
+# Intervalo mínimo entre escrituras de texto: los deltas que llegan antes
+# se agrupan en una sola trama
+STREAM_FLUSH_MS: float = float(os.getenv("STREAM_FLUSH_MS") or "40")
+# Se vacía antes si el texto acumulado llega a este tamaño
+STREAM_FLUSH_MAX_CHARS: int = int(os.getenv("STREAM_FLUSH_MAX_CHARS") or "2048")
+# Latido si no se ha escrito nada en este tiempo (proxies / navegador)
+STREAM_HEARTBEAT_S: float = float(os.getenv("STREAM_HEARTBEAT_S") or "5")
+
+# Tipos de trama
+DELTA = "delta"
+HEARTBEAT = "heartbeat"
+USAGE = "usage"
+DONE = "done"
+ERROR = "error"
+
+
+@dataclass(frozen=True)
+class Evento:
+    tipo: str
+    datos: Any = None
+
+
+class _Fin:
+    pass
+
+
+async def agrupar_con_latido(
+    eventos: AsyncIterator[Evento],
+    flush_s: Optional[float] = None,
+    latido_s: Optional[float] = None,
+    max_chars: Optional[int] = None,
+) -> AsyncIterator[Evento]:
+    """
+    Consume `eventos` en una tarea aparte y re-emite:
+      - los DELTA agrupados como mucho cada `flush_s` (el primero sale ya),
+      - un HEARTBEAT por temporizador si pasan `latido_s` sin escribir,
+        aunque el modelo esté callado,
+      - el resto de eventos tal cual, tras vaciar el texto pendiente.
+    Si el consumidor se cierra (cliente desconectado), se cancela la tarea
+    y el generador original recibe la cancelación como hasta ahora.
+    """
+    flush_s = STREAM_FLUSH_MS / 1000 if flush_s is None else flush_s
+    latido_s = STREAM_HEARTBEAT_S if latido_s is None else latido_s
+    max_chars = STREAM_FLUSH_MAX_CHARS if max_chars is None else max_chars
+    loop = asyncio.get_running_loop()
+    cola: asyncio.Queue = asyncio.Queue()
+
+    async def bombear():
+        try:
+            async for evento in eventos:
+                cola.put_nowait(evento)
+        except Exception as e:
+            cola.put_nowait(e)
+        finally:
+            cola.put_nowait(_Fin)
+
+    tarea = asyncio.create_task(bombear())
+    pendiente: list = []
+    chars = 0
+    ultimo_flush = float("-inf")
+    ultima_escritura = loop.time()
+
+    try:
+        while True:
+            plazo = ultima_escritura + latido_s
+            if pendiente:
+                plazo = min(plazo, ultimo_flush + flush_s)
+            evento: Optional[object]
+            try:
+                evento = await asyncio.wait_for(cola.get(), max(0.0, plazo - loop.time()))
+            except asyncio.TimeoutError:
+                evento = None
+            ahora = loop.time()
+
+            if isinstance(evento, Evento) and evento.tipo == DELTA:
+                pendiente.append(evento.datos)
+                chars += len(evento.datos)
+                if ahora - ultimo_flush < flush_s and chars < max_chars:
+                    continue
+            elif evento is None and not pendiente:
+                if ahora - ultima_escritura >= latido_s:
+                    ultima_escritura = ahora
+                    yield Evento(HEARTBEAT)
+                continue
+
+            # Toca escribir: primero el texto acumulado, en orden
+            if pendiente:
+                yield Evento(DELTA, "".join(pendiente))
+                pendiente.clear()
+                chars = 0
+                ultimo_flush = ultima_escritura = loop.time()
+
+            if evento is _Fin:
+                return
+            if isinstance(evento, Exception):
+                raise evento
+            if isinstance(evento, Evento) and evento.tipo != DELTA:
+                ultima_escritura = loop.time()
+                yield evento
+    finally:
+        if not tarea.done():
+            tarea.cancel()
+        # Sólo se ignora la cancelación del productor: si cancelan a quien
+        # consume (el cliente se fue) mientras espera, wait la propaga
+        await asyncio.wait({tarea})
+        if not tarea.cancelled():
+            tarea.result()
+
+
+def trama_sse(evento: Evento) -> str:
+    """`event: <tipo>` + `data: <json>` según text/event-stream."""
+    datos = {} if evento.datos is None else evento.datos
+    if evento.tipo == DELTA:
+        datos = {"text": evento.datos}
+    return f"event: {evento.tipo}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def como_sse(eventos: AsyncIterator[Evento]) -> AsyncIterator[str]:
+    async for evento in eventos:
+        yield trama_sse(evento)
+
+
+async def como_texto(eventos: AsyncIterator[Evento]) -> AsyncIterator[str]:
+    """
+    Formato antiguo (text/plain): texto y errores mezclados en el cuerpo y
+    el latido como un espacio. Se mantiene para clientes que no usan SSE.
+    """
+    async for evento in eventos:
+        if evento.tipo == DELTA:
+            yield evento.datos
+        elif evento.tipo == ERROR:
+            yield evento.datos["message"]
+        elif evento.tipo == HEARTBEAT:
+            yield " "
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import List
+
+
+def preparar_entorno() -> str:
+    """
+    Ejecuta el benchmark en un directorio temporal para no tocar
+    chefito.db del proyecto. Devuelve la ruta del directorio.
+    """
+    tmp = tempfile.mkdtemp(prefix="chefito-bench-")
+    os.chdir(tmp)
+    # Sin red: modelo local (los benchmarks lo sustituyen si necesitan otro)
+    os.environ.setdefault("MODELO_PROVEEDOR", "falso")
+    # Los benchmarks simulan muchos clientes con una sola cuenta
+    os.environ.setdefault("MODELO_TASA_USUARIO", "100000")
+    os.environ.setdefault("MODELO_RAFAGA_USUARIO", "100000")
+    return tmp
+
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    idx = min(len(orden) - 1, max(0, int(round(p / 100 * (len(orden) - 1)))))
+    return orden[idx]
+
+
+def resumen_ms(valores: List[float]) -> dict:
+    return {
+        "n": len(valores),
+        "p50_ms": round(percentil(valores, 50) * 1000, 2),
+        "p95_ms": round(percentil(valores, 95) * 1000, 2),
+        "p99_ms": round(percentil(valores, 99) * 1000, 2),
+    }
+
+
+class FakeGeminiClient:
+    """
+    Proveedor del modelo sin red (misma interfaz que proveedores.py) con
+    contadores para los benchmarks. Cada chunk tarda `delay` segundos.
+    Para un modelo con TTFT y tokens/s realistas usar
+    MODELO_PROVEEDOR=falso.
+    """
+
+    def __init__(self, chunks: int = 20, delay: float = 0.05, texto: str = "receta "):
+        self.chunks = chunks
+        self.delay = delay
+        self.texto = texto
+        # Llamadas recibidas (para medir las que se ahorran)
+        self.llamadas = 0
+        # Bytes de imágenes enviados dentro de `contents`
+        self.bytes_imagen = 0
+        # `contents` de la última llamada (el historial que vio el modelo)
+        self.ultimos_contents = None
+
+    def _contar_imagenes(self, contents) -> None:
+        for content in contents or []:
+            for part in getattr(content, "parts", None) or []:
+                inline = getattr(part, "inline_data", None)
+                if inline is not None and inline.data:
+                    self.bytes_imagen += len(inline.data)
+
+    async def abrir_stream(self, **kwargs):
+        self.llamadas += 1
+        self.ultimos_contents = kwargs.get("contents")
+        self._contar_imagenes(self.ultimos_contents)
+
+        async def gen():
+            for _ in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield SimpleNamespace(text=self.texto, usage_metadata=None)
+
+        return gen()
+
+    async def generar(self, **_kwargs):
+        self.llamadas += 1
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(text=self.texto.strip(), usage_metadata=None)
+
+
+def ahora() -> float:
+    return time.perf_counter()
@@ -0,0 +1,237 @@
+"""
+Archivo de conversaciones inactivas y exportación NDJSON (archivo.py)
+sobre la misma siembra que bench_busqueda:
+
+0. Comprueba que sin ARCHIVO_DIAS no se archiva nada, y que una
+   conversación archivada sale de la búsqueda de mensajes y vuelve al
+   rehidratarse (falla con AssertionError si no).
+
+1. Archivar lo inactivo desde hace --dias días (updated_at repartido en
+   el último año): conversaciones/s, cuánto retiene cada lote al escritor
+   único (lo que puede esperar un turno de chat) y tamaño de messages +
+   índices + índice de búsqueda antes y después frente al del archivo.
+2. Rehidratar al abrir una conversación archivada (GET /history).
+3. Exportar la cuenta del usuario con más conversaciones (GET /export,
+   con y sin gzip): MB/s, mensajes/s y memoria máxima de Python durante
+   la exportación (no debe crecer con el tamaño de la cuenta).
+
+    python -m benchmarks.bench_archivo --mensajes 500000 --dias 90
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import tracemalloc
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+from .bench_busqueda import sembrar
+from .suite_e2e import cargar_turnos
+
+
+def tamanos_mb(engine) -> dict:
+    with engine.connect() as conn:
+        filas = conn.exec_driver_sql(
+            "SELECT CASE WHEN name LIKE 'busqueda_mensajes%' THEN 'indice_busqueda_mensajes' "
+            "WHEN name LIKE '%messages%' THEN 'messages_e_indices' "
+            "WHEN name LIKE '%conversation_archives%' THEN 'archivo' "
+            "ELSE 'resto' END, sum(pgsize) FROM dbstat GROUP BY 1"
+        ).all()
+    return {nombre: round(bytes_ / 2**20, 1) for nombre, bytes_ in filas}
+
+
+async def comprobar_por_defecto(main, engine) -> dict:
+    from backend.archivo import ArchivoConversaciones
+    from backend.database import AsyncSessionLocal, escribir
+    from backend.persistencia import TurnoPendiente
+
+    # Instancia aparte: no suma a las estadísticas que mide el resto
+    archivo = ArchivoConversaciones(main.busqueda)
+    assert archivo.dias == 0, "archivar tiene que ser opcional"
+    with engine.begin() as conn:
+        conv_id, user_id = conn.exec_driver_sql(
+            "SELECT id, user_id FROM conversations ORDER BY id LIMIT 1"
+        ).one()
+    await escribir(
+        main.guardar_mensajes_db,
+        [TurnoPendiente(conv_id, "guiso con zanahoriatestigo", "listo", user_id=user_id)],
+    )
+    with engine.begin() as conn:
+        # Más vieja que ninguna otra de la siembra (último año)
+        conn.exec_driver_sql(
+            "UPDATE conversations SET updated_at = datetime('now', '-3650 days') WHERE id = ?",
+            (conv_id,),
+        )
+
+    async def aciertos() -> int:
+        async with AsyncSessionLocal() as db:
+            resultados = await main.busqueda.buscar(db, user_id, "zanahoriatestigo", 10)
+        return sum(1 for r in resultados if r["conversation_id"] == conv_id)
+
+    resultados = {"sin_archivar_por_defecto": await archivo.archivar_antiguas()}
+    assert resultados["sin_archivar_por_defecto"] == 0, resultados
+    assert await aciertos() == 1
+    assert await archivo.archivar_antiguas(dias=3000) == 1
+    resultados["aciertos_archivada"] = await aciertos()
+    assert resultados["aciertos_archivada"] == 0, resultados
+    await escribir(archivo.rehidratar, conv_id)
+    resultados["aciertos_rehidratada"] = await aciertos()
+    assert resultados["aciertos_rehidratada"] == 1, resultados
+    return resultados
+
+
+async def medir_archivar(main, engine, args) -> dict:
+    from datetime import datetime, timedelta
+
+    from backend.database import escribir
+
+    azar = random.Random(args.semilla)
+    with engine.begin() as conn:
+        ids = [r[0] for r in conn.exec_driver_sql("SELECT id FROM conversations")]
+        ahora_ = datetime.utcnow()
+        conn.exec_driver_sql(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?",
+            [
+                ((ahora_ - timedelta(days=azar.uniform(0, 365))).strftime("%Y-%m-%d %H:%M:%S"), i)
+                for i in ids
+            ],
+        )
+        total_mensajes = conn.exec_driver_sql("SELECT count(*) FROM messages").scalar()
+    antes = tamanos_mb(engine)
+
+    antes_de = datetime.utcnow() - timedelta(days=args.dias)
+    lotes = []
+    desde_id = ""
+    t0 = ahora()
+    while True:
+        t_lote = ahora()
+        conv_ids = await escribir(main.archivo.archivar_lote, antes_de, desde_id)
+        lotes.append(ahora() - t_lote)
+        if len(conv_ids) < main.archivo.lote:
+            break
+        desde_id = conv_ids[-1]
+    segundos = ahora() - t0
+    stats = main.archivo.stats
+    with engine.begin() as conn:
+        # Devuelve al sistema las páginas liberadas para medir el tamaño real
+        conn.exec_driver_sql("INSERT INTO busqueda_mensajes (busqueda_mensajes) VALUES ('optimize')")
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    return {
+        "conversaciones": stats["conversaciones_archivadas"],
+        "mensajes": stats["mensajes_archivados"],
+        "fraccion_mensajes": round(stats["mensajes_archivados"] / total_mensajes, 3),
+        "segundos": round(segundos, 1),
+        "conversaciones_por_s": round(stats["conversaciones_archivadas"] / segundos),
+        "lote_escritor": resumen_ms(lotes),
+        "compresion": round(stats["bytes_originales"] / max(1, stats["bytes_comprimidos"]), 2),
+        "tamano_mb_antes": antes,
+        "tamano_mb_despues": tamanos_mb(engine),
+    }
+
+
+async def medir_rehidratar(main, engine, args) -> dict:
+    from .suite_e2e import peticion
+
+    with engine.connect() as conn:
+        filas = conn.exec_driver_sql(
+            "SELECT c.id, u.username, a.message_count FROM conversations c "
+            "JOIN users u ON u.id = c.user_id "
+            "JOIN conversation_archives a ON a.conversation_id = c.id "
+            "ORDER BY random() LIMIT ?",
+            (args.rehidratar,),
+        ).all()
+    tiempos = []
+    mensajes = []
+    for conv_id, username, n in filas:
+        token = main.create_access_token({"sub": username})
+        r = await peticion(main.app, "GET", f"/history/{conv_id}", token)
+        assert r["estado"] == 200, r
+        tiempos.append(r["total"])
+        mensajes.append(n)
+    # Lo mismo ya rehidratada: lo que cuesta una lectura normal
+    normales = []
+    for conv_id, username, _ in filas:
+        token = main.create_access_token({"sub": username})
+        normales.append((await peticion(main.app, "GET", f"/history/{conv_id}", token))["total"])
+    with engine.connect() as conn:
+        pendientes = conn.exec_driver_sql(
+            "SELECT count(*) FROM conversation_archives WHERE conversation_id IN "
+            f"({','.join('?' * len(filas))})",
+            tuple(f[0] for f in filas),
+        ).scalar()
+    assert pendientes == 0, pendientes
+    return {
+        "mensajes_media": round(sum(mensajes) / max(1, len(mensajes)), 1),
+        "history_rehidratando": resumen_ms(tiempos),
+        "history_normal": resumen_ms(normales),
+    }
+
+
+async def medir_exportar(main, engine) -> dict:
+    with engine.connect() as conn:
+        user_id, username, conversaciones = conn.exec_driver_sql(
+            "SELECT c.user_id, u.username, count(*) FROM conversations c "
+            "JOIN users u ON u.id = c.user_id GROUP BY 1 ORDER BY 3 DESC LIMIT 1"
+        ).one()
+    resultados = {"conversaciones_usuario": conversaciones}
+    for gzip in (False, True):
+        antes = main.archivo.stats["mensajes_exportados"]
+        t0 = ahora()
+        total = 0
+        async for trozo in main.archivo.exportar(user_id, username, gzip):
+            total += len(trozo)
+        segundos = ahora() - t0
+        mensajes = main.archivo.stats["mensajes_exportados"] - antes
+        resultados["gzip" if gzip else "ndjson"] = {
+            "mensajes": mensajes,
+            "mb": round(total / 2**20, 1),
+            "segundos": round(segundos, 2),
+            "mensajes_por_s": round(mensajes / segundos),
+        }
+    # Otra vez con tracemalloc (mucho más lento) sólo para el pico de memoria
+    tracemalloc.start()
+    async for _ in main.archivo.exportar(user_id, username, False):
+        pass
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resultados["pico_python_mb"] = round(pico / 2**20, 1)
+    return resultados
+
+
+async def main_async(args) -> dict:
+    from backend import main
+    from backend.database import async_engine, engine
+
+    resultados = {"siembra": sembrar(engine, args, cargar_turnos())}
+    main.busqueda.reconstruir(engine)
+    resultados["por_defecto"] = await comprobar_por_defecto(main, engine)
+    resultados["archivar"] = await medir_archivar(main, engine, args)
+    resultados["rehidratar"] = await medir_rehidratar(main, engine, args)
+    resultados["exportar"] = await medir_exportar(main, engine)
+
+    await main.cola_turnos.detener()
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=500_000)
+    parser.add_argument("--usuarios", type=int, default=500)
+    parser.add_argument("--conversaciones", type=int, default=12_500, help="en total")
+    parser.add_argument("--grande", type=float, default=0.05, help="fracción del usuario 1")
+    parser.add_argument("--dias", type=int, default=90)
+    parser.add_argument("--rehidratar", type=int, default=50, help="conversaciones abiertas")
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Búsqueda de texto completo (/search, índice FTS5 de busqueda.py) con 1M
+de mensajes:
+
+1. Reconstrucción completa del índice (lo que hace
+   `python -m backend.cli reindexar-busqueda`): mensajes/s y tamaño.
+2. Latencia de IndiceBusqueda.buscar por tipo de consulta (palabra
+   común, media, rara, dos palabras y el singular de una palabra que
+   aparece en plural) para un usuario típico y para uno con muchas
+   conversaciones, frente a un LIKE sobre messages.
+3. Coste del mantenimiento incremental: guardar un lote de turnos con y
+   sin el índice.
+
+    python -m benchmarks.bench_busqueda --mensajes 1000000 --usuarios 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+from .suite_e2e import cargar_turnos
+
+LOTE = 50_000
+
+
+def sembrar(engine, args, turnos) -> dict:
+    """
+    Mensajes con el texto de conversaciones.json: la pregunta entera y un
+    trozo de 40-120 palabras de una respuesta, para que no se repitan.
+    El usuario 1 tiene la fracción --grande de las conversaciones.
+    """
+    azar = random.Random(args.semilla)
+    base = datetime(2025, 1, 1)
+    respuestas = [b.split() for _, b in turnos]
+    conv_usuario = [
+        1 if azar.random() < args.grande else azar.randint(2, args.usuarios)
+        for _ in range(args.conversaciones)
+    ]
+    t0 = ahora()
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany(
+            "INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'x')",
+            [(u, f"bench{u}") for u in range(1, args.usuarios + 1)],
+        )
+        cur.executemany(
+            "INSERT INTO conversations (id, user_id, title, display_title) VALUES (?, ?, ?, ?)",
+            [
+                (f"conv-{c}", u, t[:60], t[:50])
+                for c, u in enumerate(conv_usuario)
+                for t in [azar.choice(turnos)[0].split("\n")[0]]
+            ],
+        )
+        filas = []
+        for i in range(0, args.mensajes, 2):
+            conv = f"conv-{azar.randrange(args.conversaciones)}"
+            palabras = azar.choice(respuestas)
+            largo = azar.randint(40, 120)
+            inicio = azar.randrange(max(1, len(palabras) - largo))
+            fecha = base + timedelta(seconds=i)
+            filas.append((conv, "user", azar.choice(turnos)[0], fecha))
+            filas.append((conv, "assistant", " ".join(palabras[inicio : inicio + largo]), fecha))
+            if len(filas) >= LOTE:
+                cur.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    filas,
+                )
+                filas.clear()
+        if filas:
+            cur.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                filas,
+            )
+        raw.commit()
+    finally:
+        raw.close()
+    return {
+        "mensajes": args.mensajes,
+        "conversaciones": args.conversaciones,
+        "conversaciones_usuario_grande": conv_usuario.count(1),
+        "segundos": round(ahora() - t0, 1),
+    }
+
+
+def tamanos_mb(engine) -> dict:
+    with engine.connect() as conn:
+        filas = conn.exec_driver_sql(
+            "SELECT CASE WHEN name LIKE 'busqueda_%' THEN 'indice_busqueda' "
+            "WHEN name LIKE 'messages' OR name LIKE '%messages%' THEN 'messages' "
+            "ELSE 'resto' END, sum(pgsize) FROM dbstat GROUP BY 1"
+        ).all()
+    return {nombre: round(bytes_ / 2**20, 1) for nombre, bytes_ in filas}
+
+
+def elegir_terminos(engine, azar: random.Random) -> dict:
+    """Palabras del índice por frecuencia de documento (fts5vocab)."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS temp.vocab "
+            "USING fts5vocab(main, busqueda_mensajes, 'row')"
+        )
+        filas = conn.exec_driver_sql(
+            "SELECT term, doc FROM temp.vocab WHERE length(term) > 3 ORDER BY doc DESC"
+        ).all()
+    # Fuera los números
+    filas = [(t, d) for t, d in filas if t.isalpha()]
+    total = filas[0][1]
+    comunes = [t for t, d in filas if d > total * 0.3]
+    medias = [t for t, d in filas if total * 0.01 < d <= total * 0.1]
+    raras = [t for t, d in filas if d <= total * 0.001]
+    plurales = [t for t in medias if t.endswith("as")] or medias
+    return {
+        "comun": [[azar.choice(comunes)] for _ in range(20)],
+        "media": [[azar.choice(medias)] for _ in range(20)],
+        "rara": [[azar.choice(raras)] for _ in range(20)],
+        "dos_palabras": [azar.sample(medias, 2) for _ in range(20)],
+        # "lentejas" buscando "lenteja" (variantes de busqueda.py)
+        "singular": [[azar.choice(plurales)[:-1]] for _ in range(20)],
+    }
+
+
+async def medir_consultas(main, args, terminos: dict, azar: random.Random) -> dict:
+    from sqlalchemy import text
+
+    usuarios = {"tipico": lambda: azar.randint(2, args.usuarios), "grande": lambda: 1}
+    resultados = {}
+    async with main.AsyncSessionLocal() as db:
+        # Calentamiento (caché de páginas de SQLite)
+        for palabras in terminos["media"][:5]:
+            await main.busqueda.buscar(db, 1, " ".join(palabras), 20)
+        for nombre_usuario, usuario in usuarios.items():
+            for clase, consultas in terminos.items():
+                tiempos = []
+                aciertos = []
+                for i in range(args.consultas):
+                    q = " ".join(consultas[i % len(consultas)])
+                    t0 = ahora()
+                    filas = await main.busqueda.buscar(db, usuario(), q, 20)
+                    tiempos.append(ahora() - t0)
+                    aciertos.append(len(filas))
+                resultados[f"{nombre_usuario}/{clase}"] = {
+                    **resumen_ms(tiempos),
+                    "aciertos_media": round(statistics.mean(aciertos), 1),
+                }
+
+        # Lo que habría sin índice: LIKE sobre los mensajes del usuario
+        like = text(
+            "SELECT m.id FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE c.user_id = :u AND m.content LIKE :p LIMIT 20"
+        )
+        for nombre_usuario, usuario in usuarios.items():
+            tiempos = []
+            for palabras in terminos["rara"][: args.consultas_like]:
+                t0 = ahora()
+                (await db.execute(like, {"u": usuario(), "p": f"%{palabras[0]}%"})).all()
+                tiempos.append(ahora() - t0)
+            resultados[f"{nombre_usuario}/like_sin_indice"] = resumen_ms(tiempos)
+    return resultados
+
+
+async def medir_escritura(main, args) -> dict:
+    """Guardar un lote de turnos (write-behind) con y sin mantener el índice."""
+    from backend.database import escribir
+    from backend.persistencia import TurnoPendiente
+
+    azar = random.Random(args.semilla)
+    turnos = cargar_turnos()
+    resultados = {}
+    for activa in (False, True, False, True):
+        main.busqueda.activa = activa
+        tiempos = []
+        for _ in range(args.lotes):
+            lote = [
+                TurnoPendiente(
+                    conv_id=f"conv-{azar.randrange(args.conversaciones)}",
+                    user_message=p,
+                    bot_response=b[:1500],
+                )
+                for p, b in (azar.choice(turnos) for _ in range(args.turnos_lote))
+            ]
+            t0 = ahora()
+            await escribir(main.guardar_mensajes_db, lote)
+            tiempos.append(ahora() - t0)
+        resultados.setdefault("con_indice" if activa else "sin_indice", []).extend(tiempos)
+    main.busqueda.activa = True
+    por_lote = {k: resumen_ms(v) for k, v in resultados.items()}
+    return {
+        "turnos_por_lote": args.turnos_lote,
+        **por_lote,
+        "sobrecoste_p50_ms": round(
+            por_lote["con_indice"]["p50_ms"] - por_lote["sin_indice"]["p50_ms"], 2
+        ),
+    }
+
+
+async def main_async(args) -> dict:
+    from backend import main
+    from backend.database import async_engine, engine
+
+    resultados = {"siembra": sembrar(engine, args, cargar_turnos())}
+
+    t0 = ahora()
+    total = main.busqueda.reconstruir(engine)
+    segundos = ahora() - t0
+    resultados["reconstruir"] = {
+        **total,
+        "segundos": round(segundos, 1),
+        "mensajes_por_s": round(total["mensajes"] / segundos),
+        "tamano_mb": tamanos_mb(engine),
+    }
+
+    azar = random.Random(args.semilla)
+    terminos = elegir_terminos(engine, azar)
+    resultados["ejemplos"] = {clase: consultas[:3] for clase, consultas in terminos.items()}
+    resultados["consultas"] = await medir_consultas(main, args, terminos, azar)
+    resultados["escritura"] = await medir_escritura(main, args)
+
+    await main.cola_turnos.detener()
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=1_000_000)
+    parser.add_argument("--usuarios", type=int, default=500)
+    parser.add_argument("--conversaciones", type=int, default=25_000, help="en total")
+    parser.add_argument("--grande", type=float, default=0.05, help="fracción del usuario 1")
+    parser.add_argument("--consultas", type=int, default=100, help="por tipo y usuario")
+    parser.add_argument("--consultas-like", type=int, default=5)
+    parser.add_argument("--lotes", type=int, default=30)
+    parser.add_argument("--turnos-lote", type=int, default=64)
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
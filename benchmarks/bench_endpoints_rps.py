@@ -0,0 +1,100 @@
+"""
+Peticiones/segundo de los endpoints de lectura (sidebar, historial) y
+renombrar con C clientes concurrentes en un solo worker (sin red).
+
+    python -m benchmarks.bench_endpoints_rps --clientes 64 --peticiones 3000
+    python -m benchmarks.bench_endpoints_rps --sin-cache-auth   # línea base
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+    from backend.identidades import CacheIdentidades
+
+    if args.sin_cache_auth:
+        main.identidades = CacheIdentidades(max_entradas=0)
+    main.proveedor = FakeGeminiClient(chunks=3, delay=0, texto="**Arroz** con pollo ")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=60
+    ) as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        # Datos: N conversaciones con unos cuantos turnos cada una
+        for i in range(args.conversaciones):
+            for _ in range(args.turnos):
+                await c.post(
+                    "/stream_chat/",
+                    data={"user_message": "receta de arroz", "conversation_id": f"c-{i}"},
+                    headers=headers,
+                )
+        await asyncio.sleep(0.2)
+
+        latencias = {"sidebar": [], "historial": [], "renombrar": []}
+        restantes = [args.peticiones]
+
+        async def cliente():
+            while restantes[0] > 0:
+                restantes[0] -= 1
+                tipo = random.choices(
+                    ["sidebar", "historial", "renombrar"], weights=[45, 45, 10]
+                )[0]
+                conv = f"c-{random.randrange(args.conversaciones)}"
+                t0 = ahora()
+                if tipo == "sidebar":
+                    r = await c.get("/conversations/", headers=headers)
+                elif tipo == "historial":
+                    r = await c.get(f"/history/{conv}", headers=headers)
+                else:
+                    r = await c.post(
+                        "/conversations/rename/",
+                        data={"conversation_id": conv, "new_title": "Arroz"},
+                        headers=headers,
+                    )
+                r.raise_for_status()
+                latencias[tipo].append(ahora() - t0)
+
+        t0 = ahora()
+        await asyncio.gather(*(cliente() for _ in range(args.clientes)))
+        duracion = ahora() - t0
+
+    total = sum(len(v) for v in latencias.values())
+    print(
+        json.dumps(
+            {
+                "rps": round(total / duracion, 1),
+                **{k: resumen_ms(v) for k, v in latencias.items()},
+                "cache_auth": main.identidades.resumen(),
+            },
+            indent=2,
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clientes", type=int, default=64)
+    parser.add_argument("--peticiones", type=int, default=3000)
+    parser.add_argument("--conversaciones", type=int, default=50)
+    parser.add_argument("--turnos", type=int, default=4)
+    parser.add_argument("--sin-cache-auth", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(11)
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Contadores y extracto de la barra lateral en conversations (estadisticas.py)
+sobre la misma siembra que bench_busqueda, que los deja a 0 como una base de
+datos anterior a las columnas:
+
+1. Rellenarlos (lo que hace el arranque) y repetir la reparación completa
+   sin nada que corregir (`python -m backend.cli reparar-estadisticas`).
+2. GET /conversations/ recorriendo todas las páginas del usuario con más
+   conversaciones, frente a la misma página calculando número de mensajes,
+   imagen y último mensaje con subconsultas sobre messages por fila.
+3. Lote de turnos de la cola write-behind (guardar_mensajes_db) con los
+   contadores actualizados en la misma transacción.
+
+    python -m benchmarks.bench_estadisticas --mensajes 500000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+from .bench_busqueda import sembrar
+from .suite_e2e import cargar_turnos
+
+# La consulta que evitan las columnas: tres subconsultas por conversación
+_SQL_SUBCONSULTAS = (
+    "SELECT c.id, c.display_title, c.updated_at, "
+    "(SELECT count(*) FROM messages m WHERE m.conversation_id = c.id), "
+    "(SELECT count(*) FROM messages m WHERE m.conversation_id = c.id AND m.has_image), "
+    "(SELECT m.content FROM messages m WHERE m.conversation_id = c.id "
+    "ORDER BY m.created_at DESC, m.id DESC LIMIT 1) "
+    "FROM conversations c WHERE c.user_id = ? "
+    "ORDER BY c.updated_at DESC, c.id DESC LIMIT ? OFFSET ?"
+)
+# La misma página con las columnas de conversations
+_SQL_COLUMNAS = (
+    "SELECT c.id, c.display_title, c.updated_at, c.message_count, c.image_count, "
+    "c.last_message_preview FROM conversations c WHERE c.user_id = ? "
+    "ORDER BY c.updated_at DESC, c.id DESC LIMIT ? OFFSET ?"
+)
+
+
+def medir_reparar(engine) -> dict:
+    from backend.estadisticas import reparar_estadisticas
+
+    resultados = {}
+    for nombre, pendientes in (("rellenar_pendientes", True), ("reparar_sin_cambios", False)):
+        t0 = ahora()
+        stats = reparar_estadisticas(engine, solo_pendientes=pendientes)
+        segundos = ahora() - t0
+        resultados[nombre] = {
+            "revisadas": stats["conversaciones"],
+            "corregidas": stats["reparadas"],
+            "segundos": round(segundos, 2),
+            "conversaciones_por_s": round(stats["conversaciones"] / segundos),
+        }
+    return resultados
+
+
+async def medir_barra_lateral(main, engine, args) -> dict:
+    from sqlalchemy import select
+
+    from backend import models
+
+    from .suite_e2e import peticion
+
+    with engine.connect() as conn:
+        user_id, conversaciones = conn.exec_driver_sql(
+            "SELECT user_id, count(*) FROM conversations GROUP BY 1 ORDER BY 2 DESC LIMIT 1"
+        ).one()
+        orden = conn.execute(
+            select(models.Conversation.updated_at, models.Conversation.id)
+            .where(models.Conversation.user_id == user_id)
+            .order_by(models.Conversation.updated_at.desc(), models.Conversation.id.desc())
+        ).all()
+    # El cursor de cada página es la última fila de la anterior
+    rutas = [f"/conversations/?limit={args.pagina}"] + [
+        f"/conversations/?limit={args.pagina}&before={main.crear_cursor(*orden[i - 1])}"
+        for i in range(args.pagina, conversaciones, args.pagina)
+    ]
+    token = main.create_access_token({"sub": f"bench{user_id}"})
+    columnas = []
+    for _ in range(args.repeticiones):
+        for ruta in rutas:
+            r = await peticion(main.app, "GET", ruta, token)
+            assert r["estado"] == 200, r
+            columnas.append(r["total"])
+
+    sql = {"columnas": [], "subconsultas": []}
+    with engine.connect() as conn:
+        for _ in range(args.repeticiones):
+            for desde in range(0, conversaciones, args.pagina):
+                for nombre, consulta in (("columnas", _SQL_COLUMNAS), ("subconsultas", _SQL_SUBCONSULTAS)):
+                    t0 = ahora()
+                    conn.exec_driver_sql(consulta, (user_id, args.pagina, desde)).all()
+                    sql[nombre].append(ahora() - t0)
+    return {
+        "conversaciones_usuario": conversaciones,
+        "paginas": len(rutas),
+        "get_conversations": resumen_ms(columnas),
+        "pagina_sql": {nombre: resumen_ms(t) for nombre, t in sql.items()},
+    }
+
+
+async def medir_guardar(main, engine, args) -> dict:
+    from backend.database import escribir
+    from backend.persistencia import TurnoPendiente
+
+    azar = random.Random(args.semilla)
+    turnos = cargar_turnos()
+    with engine.connect() as conn:
+        conv_ids = [r[0] for r in conn.exec_driver_sql("SELECT id FROM conversations")]
+    tiempos = []
+    for _ in range(args.lotes):
+        lote = [
+            TurnoPendiente(azar.choice(conv_ids), *azar.choice(turnos), con_imagen=azar.random() < 0.1)
+            for _ in range(args.turnos_lote)
+        ]
+        t0 = ahora()
+        await escribir(main.guardar_mensajes_db, lote)
+        tiempos.append(ahora() - t0)
+    return {"turnos_por_lote": args.turnos_lote, "lote": resumen_ms(tiempos)}
+
+
+async def main_async(args) -> dict:
+    from backend import main
+    from backend.database import async_engine, engine
+
+    resultados = {"siembra": sembrar(engine, args, cargar_turnos())}
+    main.busqueda.reconstruir(engine)
+    resultados["reparar"] = medir_reparar(engine)
+    resultados["barra_lateral"] = await medir_barra_lateral(main, engine, args)
+    resultados["guardar_turnos"] = await medir_guardar(main, engine, args)
+    # Lo escrito por guardar_mensajes_db coincide con la reparación
+    resultados["tras_guardar_corregidas"] = medir_reparar(engine)["reparar_sin_cambios"]["corregidas"]
+
+    await main.cola_turnos.detener()
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=500_000)
+    parser.add_argument("--usuarios", type=int, default=500)
+    parser.add_argument("--conversaciones", type=int, default=12_500, help="en total")
+    parser.add_argument("--grande", type=float, default=0.05, help="fracción del usuario 1")
+    parser.add_argument("--pagina", type=int, default=50, help="conversaciones por página")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--lotes", type=int, default=50, help="lotes de turnos guardados")
+    parser.add_argument("--turnos-lote", type=int, default=64)
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
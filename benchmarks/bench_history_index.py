@@ -0,0 +1,125 @@
+"""
+Latencia de carga de historial por turno con 1M de mensajes,
+sin y con el índice (conversation_id, created_at, id).
+
+    python -m benchmarks.bench_history_index --mensajes 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+
+INDICE = "ix_messages_conversation_created_id"
+
+
+def sembrar(engine, n_mensajes: int, n_convs: int) -> None:
+    base = datetime(2025, 1, 1)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(
+            "INSERT INTO users (id, username, password_hash) VALUES (1, 'bench', 'x')"
+        )
+        cur.executemany(
+            "INSERT INTO conversations (id, user_id, title) VALUES (?, 1, 'bench')",
+            [(f"conv-{i}",) for i in range(n_convs)],
+        )
+        lote = []
+        for i in range(n_mensajes):
+            # Conversaciones intercaladas, como varios usuarios escribiendo a la vez
+            conv = f"conv-{random.randrange(n_convs)}"
+            role = "user" if i % 2 == 0 else "assistant"
+            lote.append((conv, role, "texto " * 20, base + timedelta(seconds=i)))
+            if len(lote) == 50_000:
+                cur.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    lote,
+                )
+                lote.clear()
+        if lote:
+            cur.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                lote,
+            )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+async def _medir(main, models, turnos: int, n_convs: int) -> dict:
+    from backend.database import async_engine
+
+    tiempos = []
+    async with main.AsyncSessionLocal() as db:
+        user = await db.get(models.User, 1)
+        for _ in range(turnos):
+            conv_id = f"conv-{random.randrange(n_convs)}"
+            t0 = ahora()
+            await main.cargar_historial_db(db, conv_id, user)
+            tiempos.append(ahora() - t0)
+    # Cada medición corre en su propio loop: no reutilizar conexiones
+    await async_engine.dispose()
+    return resumen_ms(tiempos)
+
+
+def medir(main, models, turnos: int, n_convs: int) -> dict:
+    return asyncio.run(_medir(main, models, turnos, n_convs))
+
+
+def plan(engine) -> str:
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        filas = conn.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT id, role, content FROM messages "
+                "WHERE conversation_id = 'conv-1' ORDER BY created_at, id"
+            )
+        ).all()
+    return " / ".join(str(f[-1]) for f in filas)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=1_000_000)
+    parser.add_argument("--conversaciones", type=int, default=20_000)
+    parser.add_argument("--turnos", type=int, default=200)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    from sqlalchemy import text
+
+    from backend import main as app_main
+    from backend import models
+    from backend.database import engine
+
+    random.seed(7)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDICE}"))
+    t0 = ahora()
+    sembrar(engine, args.mensajes, args.conversaciones)
+    print(f"sembrado: {args.mensajes} mensajes en {ahora() - t0:.1f}s")
+
+    resultados = {"sin_indice": medir(app_main, models, args.turnos, args.conversaciones)}
+    resultados["sin_indice"]["plan"] = plan(engine)
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE INDEX {INDICE} ON messages (conversation_id, created_at, id)"
+            )
+        )
+    resultados["con_indice"] = medir(app_main, models, args.turnos, args.conversaciones)
+    resultados["con_indice"]["plan"] = plan(engine)
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Imágenes: bytes enviados al modelo, latencia y pico de memoria por
+petición con fotos de móvil (~4000x3000 JPEG), antes (leer el archivo
+entero y reenviarlo tal cual) y ahora (ProcesadorImagenes).
+
+    python -m benchmarks.bench_image_pipeline --peticiones 20 --reintentos 0.3
+
+Cada modo se mide en un subproceso propio para que el pico de RSS sea
+comparable. Al final se comprueba de extremo a extremo (con el cliente
+falso de Gemini) que una subida por encima del límite recibe 413.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+def foto_movil(semilla: int, ancho: int = 4032, alto: int = 3024) -> bytes:
+    """JPEG con degradado y ruido (comprime como una foto real, no como un color plano)."""
+    from PIL import Image
+
+    rnd = random.Random(semilla)
+    base = Image.linear_gradient("L").resize((ancho, alto)).convert("RGB")
+    color = Image.new("RGB", (ancho, alto), tuple(rnd.randrange(256) for _ in range(3)))
+    ruido = Image.effect_noise((ancho, alto), 40 + semilla % 20).convert("RGB")
+    img = Image.blend(Image.blend(base, color, 0.4), ruido, 0.35)
+    salida = io.BytesIO()
+    img.save(salida, format="JPEG", quality=92)
+    return salida.getvalue()
+
+
+def _status_mb(campo: str) -> float:
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith(campo + ":"):
+                return int(linea.split()[1]) / 1024
+    return 0.0
+
+
+def reiniciar_pico_rss() -> float:
+    """Pone el pico de RSS (VmHWM) al RSS actual (Linux) y lo devuelve."""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return _status_mb("VmRSS")
+
+
+def secuencia(fotos: int, peticiones: int, reintentos: float):
+    """Índices de foto: con probabilidad `reintentos` se repite la anterior."""
+    rnd = random.Random(3)
+    actual = 0
+    orden = []
+    for i in range(peticiones):
+        if i and rnd.random() < reintentos:
+            orden.append(actual)
+        else:
+            actual = rnd.randrange(fotos)
+            orden.append(actual)
+    return orden
+
+
+async def medir_modo(modo: str, rutas, orden) -> dict:
+    from google.genai import types
+
+    from backend.imagenes import ProcesadorImagenes
+
+    procesador = ProcesadorImagenes()
+    # Calentar imports de PIL / genai fuera de la medida
+    types.Part.from_bytes(data=b"", mime_type="image/jpeg")
+    rss_inicial = reiniciar_pico_rss()
+    latencias, enviados = [], 0
+    for idx in orden:
+        with open(rutas[idx], "rb") as archivo:
+            t0 = ahora()
+            if modo == "antes":
+                datos = archivo.read()
+                mime = "image/jpeg"
+            else:
+                imagen = await procesador.procesar(archivo)
+                datos, mime = imagen.datos, imagen.mime_type
+            parte = types.Part.from_bytes(data=datos, mime_type=mime)
+            latencias.append(ahora() - t0)
+            enviados += len(parte.inline_data.data)
+    return {
+        "bytes_al_modelo_por_peticion": enviados // len(orden),
+        "latencia": resumen_ms(latencias),
+        "rss_pico_extra_mb": round(_status_mb("VmHWM") - rss_inicial, 1),
+        **({"procesador": procesador.resumen()} if modo == "ahora" else {}),
+    }
+
+
+async def comprobar_limite(ruta_foto: str) -> dict:
+    import httpx
+
+    from backend import main
+    from backend.database import async_engine
+
+    main.proveedor = FakeGeminiClient(chunks=2, delay=0)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        grande = b"\xff" * int((main.imagenes.max_bytes + 1024 * 1024))
+        r_grande = await c.post(
+            "/stream_chat/",
+            data={"user_message": "¿qué cocino?", "conversation_id": "grande"},
+            files={"image": ("nevera.jpg", grande, "image/jpeg")},
+            headers=headers,
+        )
+        r_mala = await c.post(
+            "/stream_chat/",
+            data={"user_message": "¿qué cocino?", "conversation_id": "mala"},
+            files={"image": ("nevera.jpg", b"no es una imagen", "image/jpeg")},
+            headers=headers,
+        )
+        with open(ruta_foto, "rb") as f:
+            foto = f.read()
+        r_ok = await c.post(
+            "/stream_chat/",
+            data={"user_message": "¿qué cocino?", "conversation_id": "ok"},
+            files={"image": ("nevera.jpg", foto, "image/jpeg")},
+            headers=headers,
+        )
+    await asyncio.sleep(0.2)  # turno en la cola de escritura
+    resultado = {
+        "subida_excesiva": r_grande.status_code,
+        "no_imagen": r_mala.status_code,
+        "foto_valida": r_ok.status_code,
+        "bytes_imagen_al_modelo": main.proveedor.bytes_imagen,
+    }
+    await async_engine.dispose()
+    return resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fotos", type=int, default=4)
+    parser.add_argument("--peticiones", type=int, default=20)
+    parser.add_argument("--reintentos", type=float, default=0.3)
+    parser.add_argument("--solo", choices=["antes", "ahora"], help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.solo:
+        rutas = sorted(os.path.join(args.dir, n) for n in os.listdir(args.dir))
+        orden = secuencia(len(rutas), args.peticiones, args.reintentos)
+        print(json.dumps(asyncio.run(medir_modo(args.solo, rutas, orden))))
+        return
+
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    preparar_entorno()
+    dir_fotos = tempfile.mkdtemp(prefix="fotos-", dir=os.getcwd())
+    tam = []
+    for i in range(args.fotos):
+        datos = foto_movil(i)
+        tam.append(len(datos))
+        with open(os.path.join(dir_fotos, f"{i}.jpg"), "wb") as f:
+            f.write(datos)
+
+    resultados = {"foto_media_mb": round(sum(tam) / len(tam) / (1024 * 1024), 2)}
+    for modo in ("antes", "ahora"):
+        salida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_image_pipeline", "--solo", modo,
+             "--dir", dir_fotos, "--peticiones", str(args.peticiones),
+             "--reintentos", str(args.reintentos)],
+            cwd=raiz, capture_output=True, text=True, check=True,
+        )
+        resultados[modo] = json.loads(salida.stdout.strip().splitlines()[-1])
+
+    resultados["extremo_a_extremo"] = asyncio.run(
+        comprobar_limite(os.path.join(dir_fotos, "0.jpg"))
+    )
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Importación de historiales legados (importador.py, `python -m
+backend.cli importar`) con un archivo sintético grande en el formato de
+conversaciones.json:
+
+1. Importación completa: mensajes/s, MB/s y memoria máxima del proceso
+   (la memoria no debe crecer con el tamaño del archivo).
+2. Repetición sobre la misma base de datos: no inserta nada (idempotente)
+   y sólo cuesta leer el archivo y comprobar los ids.
+3. Lo mismo desde el archivo comprimido (.json.gz).
+
+    python -m benchmarks.bench_importador --mensajes 1000000 --usuarios 2000
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import random
+import resource
+import shutil
+
+from ._comun import ahora, preparar_entorno
+from .suite_e2e import cargar_turnos
+
+
+def rss_max_mb() -> float:
+    # ru_maxrss en KiB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def generar(ruta: str, args, turnos) -> dict:
+    """
+    Escribe el archivo conversación a conversación (con sangría, como los
+    originales): preguntas reales y trozos de 40-300 palabras de las
+    respuestas.
+    """
+    azar = random.Random(args.semilla)
+    respuestas = [b.split() for _, b in turnos]
+    t0 = ahora()
+    mensajes = 0
+    conversaciones = 0
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("{")
+        while mensajes < args.mensajes:
+            historial = []
+            for _ in range(azar.randint(1, args.turnos_max)):
+                palabras = azar.choice(respuestas)
+                largo = azar.randint(40, 300)
+                inicio = azar.randrange(max(1, len(palabras) - largo))
+                historial.append(
+                    {
+                        "user": azar.choice(turnos)[0],
+                        "bot": " ".join(palabras[inicio : inicio + largo]),
+                    }
+                )
+            conv = {"username": f"legado{azar.randint(1, args.usuarios)}", "history": historial}
+            f.write("," if conversaciones else "")
+            f.write(f"\n    {json.dumps(f'id-legado-{conversaciones}')}: ")
+            f.write(json.dumps(conv, ensure_ascii=False, indent=4).replace("\n", "\n    "))
+            conversaciones += 1
+            mensajes += 2 * len(historial)
+        f.write("\n}\n")
+    return {
+        "conversaciones": conversaciones,
+        "mensajes": mensajes,
+        "mb": round(os.path.getsize(ruta) / 2**20, 1),
+        "segundos": round(ahora() - t0, 1),
+    }
+
+
+def importar(engine, busqueda, ruta: str, args) -> dict:
+    from backend.importador import ImportadorLegado
+
+    muestras = []
+
+    def progreso(stats, leidos, total):
+        muestras.append(rss_max_mb())
+
+    importador = ImportadorLegado(
+        engine, busqueda, crear_usuarios=True, lote=args.lote, progreso=progreso
+    )
+    t0 = ahora()
+    stats = importador.importar(ruta)
+    segundos = ahora() - t0
+    mb = os.path.getsize(ruta) / 2**20
+    return {
+        **{k: v for k, v in stats.items() if v},
+        "segundos": round(segundos, 1),
+        "mensajes_por_s": round(stats["mensajes"] / segundos),
+        "mb_por_s": round(mb / segundos, 1),
+        # Memoria máxima al 10% del archivo y al final: no debe crecer
+        "rss_max_mb_10pct": muestras[len(muestras) // 10] if muestras else None,
+        "rss_max_mb_final": rss_max_mb(),
+    }
+
+
+def medir(args) -> dict:
+    from backend import main
+    from backend.busqueda import IndiceBusqueda
+    from backend.database import Base, crear_engine, engine
+
+    ruta = os.path.abspath("legado.json")
+    resultados = {"archivo": generar(ruta, args, cargar_turnos())}
+    resultados["rss_antes_mb"] = rss_max_mb()
+
+    resultados["importar"] = importar(engine, main.busqueda, ruta, args)
+    resultados["repetir"] = importar(engine, main.busqueda, ruta, args)
+
+    # Comprimido, sobre otra base de datos vacía
+    with open(ruta, "rb") as origen, gzip.open(ruta + ".gz", "wb", compresslevel=6) as destino:
+        shutil.copyfileobj(origen, destino)
+    engine_gz = crear_engine("sqlite:///./gz.db")
+    Base.metadata.create_all(bind=engine_gz)
+    busqueda_gz = IndiceBusqueda()
+    busqueda_gz.preparar(engine_gz, aviso=None)
+    resultados["importar_gz"] = {
+        "mb_comprimido": round(os.path.getsize(ruta + ".gz") / 2**20, 1),
+        **importar(engine_gz, busqueda_gz, ruta + ".gz", args),
+    }
+    with engine_gz.connect() as conn:
+        resultados["filas_gz"] = {
+            "mensajes": conn.exec_driver_sql("SELECT count(*) FROM messages").scalar(),
+            "indexados": conn.exec_driver_sql(
+                "SELECT count(*) FROM busqueda_mensajes_docsize"
+            ).scalar(),
+        }
+    engine_gz.dispose()
+    main.servicio_claves.detener()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mensajes", type=int, default=1_000_000)
+    parser.add_argument("--usuarios", type=int, default=2000)
+    parser.add_argument("--turnos-max", type=int, default=12, help="turnos por conversación")
+    parser.add_argument("--lote", type=int, default=20_000, help="mensajes por transacción")
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    # Sin mmap: las páginas mapeadas de la base de datos contarían en el RSS
+    os.environ.setdefault("SQLITE_MMAP_SIZE", "0")
+    preparar_entorno()
+    print(json.dumps(medir(args), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Tormenta de logins: throughput de /auth/login y efecto sobre los streams
+de chat que corren a la vez en el mismo worker.
+
+    python -m benchmarks.bench_login_storm --logins 400 --concurrencia 64
+
+Compara el hash en hilos del loop (HASH_PROCESOS=0) con el pool de
+procesos, más una línea base de streams sin logins.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def escenario(main, c, args, headers, logins: int, procesos: int) -> dict:
+    from backend.claves import ServicioClaves
+
+    main.servicio_claves.detener()
+    main.servicio_claves = ServicioClaves(
+        procesos=procesos, max_pendientes=args.max_pendientes
+    )
+    main.servicio_claves.iniciar()
+    # Calentar el pool (arranque de procesos fuera de la medición)
+    await asyncio.gather(
+        *(main.servicio_claves.hash("calentar") for _ in range(max(1, procesos)))
+    )
+
+    lat_login, lat_stream = [], []
+    rechazados = 0
+    restantes = [logins]
+
+    async def login_loop(i: int):
+        nonlocal rechazados
+        while restantes[0] > 0:
+            restantes[0] -= 1
+            t0 = ahora()
+            r = await c.post(
+                "/auth/login",
+                json={"username": f"u{i % args.usuarios}", "password": "clave123"},
+            )
+            if r.status_code == 503:
+                rechazados += 1
+                continue
+            r.raise_for_status()
+            lat_login.append(ahora() - t0)
+
+    async def stream_loop(i: int):
+        for j in range(args.streams_por_cliente):
+            t0 = ahora()
+            r = await c.post(
+                "/stream_chat/",
+                data={"user_message": "hola", "conversation_id": f"s-{i}-{j}"},
+                headers=headers,
+            )
+            r.raise_for_status()
+            lat_stream.append(ahora() - t0)
+
+    t0 = ahora()
+    tareas = [stream_loop(i) for i in range(args.streams)]
+    if logins:
+        tareas += [login_loop(i) for i in range(args.concurrencia)]
+    await asyncio.gather(*tareas)
+    duracion = ahora() - t0
+
+    ideal_ms = args.chunks * args.delay * 1000
+    stream = resumen_ms(lat_stream)
+    return {
+        "logins_por_s": round(len(lat_login) / duracion, 1) if logins else 0,
+        "login": resumen_ms(lat_login),
+        "rechazados_503": rechazados,
+        "stream": stream,
+        "stream_extra_p95_ms": round(stream["p95_ms"] - ideal_ms, 2),
+    }
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+
+    main.proveedor = FakeGeminiClient(chunks=args.chunks, delay=args.delay)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=120
+    ) as c:
+        for i in range(args.usuarios):
+            r = await c.post(
+                "/auth/register", json={"username": f"u{i}", "password": "clave123"}
+            )
+            r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        resultados = {
+            "sin_logins": await escenario(main, c, args, headers, 0, 0),
+            "hilos": await escenario(main, c, args, headers, args.logins, 0),
+            f"procesos_{args.procesos}": await escenario(
+                main, c, args, headers, args.logins, args.procesos
+            ),
+        }
+        main.servicio_claves.detener()
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--concurrencia", type=int, default=64)
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--max-pendientes", type=int, default=16)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--streams-por-cliente", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
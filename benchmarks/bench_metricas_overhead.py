@@ -0,0 +1,206 @@
+"""
+Coste de las métricas (/metrics) y de las trazas por petición sobre el
+tráfico mixto de la suite e2e (sidebar, historial, chat SSE, renombrar).
+
+1. De extremo a extremo: rondas alternas con las métricas apagadas,
+   encendidas y encendidas con todas las peticiones trazadas; tiempo de
+   CPU del proceso por petición y peticiones/s (mediana de las
+   diferencias por pareja de rondas consecutivas).
+2. Por partes, mucho menos ruidoso: coste del middleware por petición
+   (rondas alternas de peticiones mínimas), coste unitario de observar
+   un histograma y de un span sin traza, y cuántos de cada uno hace de
+   media una petición de la mezcla. Su suma frente a la CPU por petición
+   es el sobrecoste estimado.
+
+    python -m benchmarks.bench_metricas_overhead --rondas 12 --peticiones 300
+
+El modelo falso responde sin espera para que el worker sea el cuello de
+botella.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import timeit
+
+from ._comun import preparar_entorno
+from .suite_e2e import cargar_turnos, escenario, peticion, planificar, sembrar
+
+MODOS = ["apagadas", "activas", "activas+traza"]
+TIPOS = {"sidebar": 35, "historial": 35, "chat": 20, "renombrar": 10}
+
+
+def con_traza(app):
+    """La app con la cabecera de traza añadida a todas las peticiones."""
+
+    async def envoltura(scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "headers": list(scope["headers"]) + [(b"x-chefito-traza", b"1")]}
+        await app(scope, receive, send)
+
+    return envoltura
+
+
+def _observaciones(registro) -> int:
+    """Total de observaciones de todos los histogramas del registro."""
+    return sum(
+        serie[2]
+        for metrica in registro._metricas.values()
+        for serie in getattr(metrica, "_series", {}).values()
+    )
+
+
+def mezcla(n: int, estado: dict, azar: random.Random) -> list:
+    ops = []
+    for tipo, peso in TIPOS.items():
+        ops += planificar(tipo, n * peso // 100, estado, azar)
+    azar.shuffle(ops)
+    return ops
+
+
+async def main_async(args) -> dict:
+    from backend import contexto, main
+    from backend.database import async_engine
+    from backend.metricas import Histograma, _trazas, metricas, span
+
+    estado = sembrar(args, cargar_turnos())
+    azar = random.Random(args.semilla)
+    apps = {"apagadas": main.app, "activas": main.app, "activas+traza": con_traza(main.app)}
+    medidas = {m: {"cpu_us": [], "rps": []} for m in MODOS}
+
+    # Calentamiento con todo encendido
+    await escenario(main.app, "mixto", mezcla(200, estado, azar), estado, args.clientes)
+    for ronda in range(args.rondas):
+        # Orden rotado en cada ronda para repartir la deriva de la máquina
+        orden = MODOS[ronda % len(MODOS):] + MODOS[: ronda % len(MODOS)]
+        for modo in orden:
+            metricas.activa = modo != "apagadas"
+            ops = mezcla(args.peticiones, estado, azar)
+            await main.cola_turnos.detener()
+            cpu0 = time.process_time()
+            r = await escenario(apps[modo], "mixto", ops, estado, args.clientes)
+            await main.cola_turnos.detener()
+            cpu = time.process_time() - cpu0
+            medidas[modo]["cpu_us"].append(cpu / r["n"] * 1e6)
+            medidas[modo]["rps"].append(r["rps"])
+    metricas.activa = True
+
+    def cambio_pct(modo: str, campo: str) -> float:
+        # Mediana de las diferencias por ronda: cada pareja comparte la
+        # deriva de la máquina y el tamaño de la base de datos
+        pares = zip(medidas[modo][campo], medidas["apagadas"][campo])
+        return round(statistics.median((v - b) / b * 100 for v, b in pares), 2)
+
+    resultados = {"extremo_a_extremo": {}}
+    for modo in MODOS:
+        resultados["extremo_a_extremo"][modo] = {
+            "cpu_us_por_peticion": round(statistics.median(medidas[modo]["cpu_us"]), 1),
+            "rps": round(statistics.median(medidas[modo]["rps"]), 1),
+            **(
+                {
+                    "sobrecoste_cpu_pct": cambio_pct(modo, "cpu_us"),
+                    "cambio_rps_pct": cambio_pct(modo, "rps"),
+                }
+                if modo != "apagadas"
+                else {}
+            ),
+        }
+
+    # --- Por partes ---
+    # Observaciones de histograma y spans por petición de la mezcla
+    metricas.activa = True
+    antes = _observaciones(metricas)
+    ops = mezcla(args.peticiones, estado, azar)
+    r = await escenario(con_traza(main.app), "mixto", ops, estado, args.clientes)
+    await main.cola_turnos.detener()
+    obs_por_peticion = (_observaciones(metricas) - antes) / r["n"]
+    trazas = list(_trazas.values())
+    # Cada traza incluye el span "peticion" y las marcas, que sin traza no existen
+    spans_por_peticion = statistics.mean(
+        sum(1 for sp in t.spans if sp[2] > 0 and sp[0] != "peticion") for t in trazas
+    )
+
+    middleware_us = []
+    for ronda in range(args.rondas):
+        por_modo = {}
+        for activa in ((True, False) if ronda % 2 else (False, True)):
+            metricas.activa = activa
+            t0 = time.perf_counter()
+            for _ in range(args.minimas):
+                await peticion(main.app, "GET", "/no-existe")
+            por_modo[activa] = (time.perf_counter() - t0) / args.minimas * 1e6
+        middleware_us.append(por_modo[True] - por_modo[False])
+    metricas.activa = True
+
+    h = Histograma(metricas, "bench", "bench", etiquetas=("ruta",))
+
+    def un_span():
+        with span("x"):
+            pass
+
+    n = 200_000
+    observar_us = timeit.timeit(lambda: h.observar(0.012, "/c/"), number=n) / n * 1e6
+    span_us = timeit.timeit(un_span, number=n) / n * 1e6
+    # Contar los bytes del contexto de un chat con el historial sembrado
+    historial = [
+        {"user": p, "bot": b} for p, b in random.Random(1).sample(cargar_turnos(), args.turnos)
+    ]
+    contents, _ = contexto.construir_contexto(historial, None)
+    prompt = main.SYSTEM_PROMPT.format(username="bench")
+    contexto_us = (
+        timeit.timeit(lambda: main.bytes_al_modelo(prompt, contents, None), number=2000)
+        / 2000 * 1e6
+    )
+    fraccion_chat = TIPOS["chat"] / sum(TIPOS.values())
+    coste_us = (
+        statistics.median(middleware_us)
+        + obs_por_peticion * observar_us
+        + spans_por_peticion * span_us
+        + fraccion_chat * contexto_us
+    )
+    cpu_base = statistics.median(medidas["apagadas"]["cpu_us"])
+    resultados["por_partes"] = {
+        "middleware_us": round(statistics.median(middleware_us), 2),
+        "histograma_observar_us": round(observar_us, 3),
+        "span_sin_traza_us": round(span_us, 3),
+        "observaciones_por_peticion": round(obs_por_peticion, 2),
+        "spans_por_peticion": round(spans_por_peticion, 2),
+        "bytes_contexto_por_chat_us": round(contexto_us, 2),
+        "coste_por_peticion_us": round(coste_us, 2),
+        "cpu_por_peticion_us": round(cpu_base, 1),
+        "sobrecoste_estimado_pct": round(coste_us / cpu_base * 100, 3),
+        "exportar_metrics_us": round(timeit.timeit(metricas.exportar, number=200) / 200 * 1e6),
+    }
+
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usuarios", type=int, default=30)
+    parser.add_argument("--conversaciones", type=int, default=20)
+    parser.add_argument("--turnos", type=int, default=6)
+    parser.add_argument("--rondas", type=int, default=12)
+    parser.add_argument("--peticiones", type=int, default=300)
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--minimas", type=int, default=2000, help="peticiones por ronda del middleware")
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ["MODELO_FALSO_TTFT_MS"] = "0"
+    os.environ["MODELO_FALSO_TOKENS_POR_S"] = "0"
+    os.environ["MODELO_FALSO_TOKENS_RESPUESTA"] = "60"
+    preparar_entorno()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Pasarela del modelo frente a un pico de tráfico, contra el servidor falso
+de Gemini (servidor_gemini_falso.py) con el cliente real de google-genai.
+
+    python -m benchmarks.bench_model_gateway --capacidad 8 --prob-503 0.05
+
+El servidor responde 503 por encima de `--capacidad` peticiones
+simultáneas (y al azar con `--prob-503`). Llegan a la vez las peticiones
+de un usuario insistente y las de varios usuarios normales:
+
+  - "antes": como el código previo, 32 streams por worker y sin reintentos,
+  - "pasarela": tope igual a la capacidad, cola justa y reintentos.
+
+Se mide cuántas respuestas acaban en "sobrecargado" y la latencia de los
+usuarios normales frente a la del insistente.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(args, puerto: int) -> subprocess.Popen:
+    import httpx
+
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.servidor_gemini_falso", "--puerto", str(puerto),
+         "--capacidad", str(args.capacidad), "--prob-503", str(args.prob_503),
+         "--chunks", str(args.chunks), "--delay", str(args.delay)],
+        cwd=raiz,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{puerto}/stats", timeout=0.5)
+            return proceso
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proceso.kill()
+    raise RuntimeError("el servidor falso no arrancó")
+
+
+async def escenario(main, c, tokens, args, puerto: int, nombre: str, pasarela) -> dict:
+    import httpx
+
+    main.pasarela = pasarela
+    main.RESPUESTAS_CACHE_ACTIVA = False
+    main.CLASIFICADOR_ACTIVO = False
+    stats_antes = httpx.get(f"http://127.0.0.1:{puerto}/stats").json()
+
+    latencias = {"normal": [], "insistente": []}
+    resultados = {"completas": 0, "sobrecargado": 0, "otros_errores": 0}
+
+    async def envio(quien: str, token: str, i: int):
+        t0 = ahora()
+        r = await c.post(
+            "/stream_chat/sse/",
+            data={"user_message": f"receta número {i}", "conversation_id": f"{nombre}-{quien}-{i}"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        latencias["normal" if quien != "insistente" else "insistente"].append(ahora() - t0)
+        if "event: done" in r.text:
+            resultados["completas"] += 1
+        elif '"overloaded"' in r.text:
+            resultados["sobrecargado"] += 1
+        else:
+            resultados["otros_errores"] += 1
+
+    trabajos = [envio("insistente", tokens[0], i) for i in range(args.insistente)]
+    for u, token in enumerate(tokens[1:]):
+        trabajos += [envio(f"u{u}", token, i) for i in range(args.por_usuario)]
+    await asyncio.gather(*trabajos)
+
+    stats = httpx.get(f"http://127.0.0.1:{puerto}/stats").json()
+    return {
+        **resultados,
+        "latencia_normales": resumen_ms(latencias["normal"]),
+        "latencia_insistente": resumen_ms(latencias["insistente"]),
+        "servidor": {
+            "peticiones": stats["peticiones"] - stats_antes["peticiones"],
+            "servidos_503": stats["servidos_503"] - stats_antes["servidos_503"],
+            "max_en_curso": stats["max_en_curso"],
+        },
+        "pasarela": pasarela.resumen(),
+    }
+
+
+async def main_async(args, puerto: int) -> None:
+    import httpx
+    from google.genai import Client, types
+
+    from backend import main
+    from backend.database import async_engine
+    from backend.pasarela import PasarelaModelo
+    from backend.proveedores import ProveedorGemini
+
+    main.proveedor = ProveedorGemini(
+        Client(
+            api_key="bench",
+            http_options=types.HttpOptions(base_url=f"http://127.0.0.1:{puerto}"),
+        )
+    )
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as c:
+        tokens = []
+        for u in range(args.usuarios + 1):
+            r = await c.post("/auth/register", json={"username": f"bench{u}", "password": "bench123"})
+            tokens.append(r.json()["access_token"])
+
+        proveedor = lambda: main.proveedor  # noqa: E731
+        resultados = {
+            "antes": await escenario(
+                main, c, tokens, args, puerto, "antes",
+                PasarelaModelo(proveedor, max_concurrentes=32, reintentos=0),
+            ),
+        }
+        await asyncio.sleep(1)
+        resultados["pasarela"] = await escenario(
+            main, c, tokens, args, puerto, "pasarela",
+            PasarelaModelo(proveedor, max_concurrentes=args.capacidad, backoff_base_s=0.2),
+        )
+    main.servicio_claves.detener()
+    await async_engine.dispose()
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacidad", type=int, default=8)
+    parser.add_argument("--prob-503", type=float, default=0.05)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.03)
+    parser.add_argument("--insistente", type=int, default=60, help="peticiones del usuario insistente")
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--por-usuario", type=int, default=2)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    os.environ.setdefault("HASH_PROCESOS", "0")
+    puerto = puerto_libre()
+    servidor = arrancar_servidor(args, puerto)
+    try:
+        asyncio.run(main_async(args, puerto))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Camino completo del chat (auth, imagen/clasificador, pasarela, stream SSE,
+guardado) con el modelo local de proveedores.py en vez de Gemini: sin red
+ni GEMINI_API_KEY. Para C streams simultáneos mide el tiempo hasta el
+primer byte y el total frente a lo que tarda el propio modelo falso
+(TTFT y el envío del último trozo); la diferencia es coste del worker.
+
+    python -m benchmarks.bench_proveedor_falso --concurrencia 1 32 128 --ttft-ms 300 --tokens-por-s 150
+
+La pasarela se abre del todo para que no haya cola: se mide el worker.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+from .bench_sse_frames import una_peticion
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+    from backend.database import async_engine
+    from backend.pasarela import PasarelaModelo
+    from backend.proveedores import ProveedorFalso
+
+    main.proveedor = ProveedorFalso(
+        ttft_ms=args.ttft_ms,
+        tokens_por_s=args.tokens_por_s,
+        tokens_por_trozo=args.tokens_por_trozo,
+        tokens_respuesta=args.tokens,
+    )
+    main.pasarela = PasarelaModelo(lambda: main.proveedor, max_concurrentes=100_000)
+    # Siempre por el modelo
+    main.RESPUESTAS_CACHE_ACTIVA = False
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        token = r.json()["access_token"]
+
+    esperado_ttft = args.ttft_ms / 1000
+    # El último trozo sale cuando se han generado los tokens anteriores
+    trozos = -(-args.tokens // args.tokens_por_trozo)
+    esperado_total = esperado_ttft + (trozos - 1) * args.tokens_por_trozo / args.tokens_por_s
+    resultados = {
+        "modelo_falso": {
+            "ttft_ms": args.ttft_ms,
+            "total_ms": round(esperado_total * 1000, 1),
+        }
+    }
+    n = 0
+    for concurrencia in args.concurrencia:
+        t0 = ahora()
+        medidas = await asyncio.gather(
+            *(
+                una_peticion(main.app, "/stream_chat/sse/", token, f"bench-{n + i}")
+                for i in range(concurrencia)
+            )
+        )
+        n += concurrencia
+        duracion = ahora() - t0
+        primer_byte = [m["primer_byte"] for m in medidas]
+        total = [m["total"] for m in medidas]
+        resultados[f"concurrencia={concurrencia}"] = {
+            "respuestas_por_s": round(concurrencia / duracion, 1),
+            "primer_byte": resumen_ms(primer_byte),
+            "total": resumen_ms(total),
+            "sobrecoste_primer_byte_p50_ms": round(
+                (sorted(primer_byte)[len(primer_byte) // 2] - esperado_ttft) * 1000, 1
+            ),
+            "sobrecoste_total_p50_ms": round(
+                (sorted(total)[len(total) // 2] - esperado_total) * 1000, 1
+            ),
+        }
+
+    resultados["tokens_generados"] = main.proveedor.stats["tokens"]
+    await main.cola_turnos.detener()
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[1, 32, 128])
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-por-s", type=float, default=150)
+    parser.add_argument("--tokens-por-trozo", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=150)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Caché de respuestas: llamadas al modelo ahorradas y latencia del primer
+turno con preguntas repetidas (distribución tipo Zipf, con variantes de
+escritura: mayúsculas, tildes, saludos, alguna errata). Antes comprueba
+que una casi-duplicada con otra negación o cantidad no reutiliza la
+respuesta (falla con AssertionError si lo hace).
+
+    python -m benchmarks.bench_response_cache --peticiones 600 --preguntas 60
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+PLATOS = [
+    "arroz con pollo", "tortilla de patatas", "pasta carbonara", "sopa de lentejas",
+    "pan casero", "brownie de chocolate", "ensalada césar", "arepas de queso",
+    "ceviche de pescado", "lasaña de carne", "crema de calabaza", "flan de huevo",
+]
+PLANTILLAS = [
+    "receta de {}", "cómo hago {}", "qué necesito para {}", "ideas para {} rápido",
+    "{} fácil", "{} para 4 personas",
+]
+
+
+# (guardada, consultada, debe_acertar) con la búsqueda por similitud activa
+CASOS_SIMILARES = [
+    ("brownies de chocolate y nueces con gluten", "brownies de chocolate y nueces sin gluten", False),
+    ("pollo al curry picante", "pollo al curry no picante", False),
+    ("arroz con pollo para 2", "arroz con pollo para 6", False),
+    ("arroz con pollo para 2", "arroz con pollo para dos", False),
+    ("tortilla de patatas fácil", "tortila de patatas fácil", True),
+]
+
+
+def comprobar_casi_duplicadas() -> dict:
+    """Con el umbral por defecto y con uno laxo (0.8) a propósito."""
+    from backend.cache_respuestas import CacheRespuestas
+
+    resultados = {}
+    for similitud in (None, 0.8):
+        cache = CacheRespuestas() if similitud is None else CacheRespuestas(similitud=similitud)
+        for guardada, consultada, debe_acertar in CASOS_SIMILARES:
+            cache.guardar("v", guardada, "ana", f"respuesta a {guardada}")
+            acierto = cache.buscar("v", consultada, "ana") is not None
+            esperado = debe_acertar and similitud is not None
+            assert acierto == esperado, (similitud, guardada, consultada)
+        resultados[f"similitud_{similitud or cache.similitud}"] = cache.resumen()["aciertos_similares"]
+    return resultados
+
+
+def variante(pregunta: str, rnd: random.Random) -> str:
+    r = rnd.random()
+    if r < 0.2:
+        return "Hola, " + pregunta + " por favor"
+    if r < 0.35:
+        return pregunta.capitalize() + "?"
+    if r < 0.45:
+        return pregunta.replace("á", "a").replace("é", "e").replace("ó", "o")
+    if r < 0.5 and "ll" in pregunta:
+        return pregunta.replace("ll", "l", 1)  # errata
+    return pregunta
+
+
+async def escenario(main, c, headers, preguntas, args, activa: bool) -> dict:
+    from backend import cache_respuestas as modulo
+    from backend.cache_respuestas import CacheRespuestas
+
+    main.RESPUESTAS_CACHE_ACTIVA = activa
+    modulo.RESPUESTAS_CACHE_CHUNK_MS = args.chunk_ms
+    main.cache_respuestas = CacheRespuestas()
+    fake = FakeGeminiClient(chunks=args.chunks, delay=args.delay, texto="**Arroz** con pollo ")
+    main.proveedor = fake
+
+    rnd = random.Random(13)
+    pesos = [1 / (i + 1) for i in range(len(preguntas))]
+    latencias = []
+    sem = asyncio.Semaphore(args.concurrencia)
+
+    async def una(i: int):
+        pregunta = variante(rnd.choices(preguntas, weights=pesos)[0], rnd)
+        async with sem:
+            t0 = ahora()
+            r = await c.post(
+                "/stream_chat/",
+                data={"user_message": pregunta, "conversation_id": f"{activa}-{i}"},
+                headers=headers,
+            )
+            r.raise_for_status()
+            latencias.append(ahora() - t0)
+
+    await asyncio.gather(*(una(i) for i in range(args.peticiones)))
+    return {
+        "llamadas_modelo": fake.llamadas,
+        "latencia": resumen_ms(latencias),
+        "cache": main.cache_respuestas.resumen(),
+    }
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+
+    rnd = random.Random(7)
+    preguntas = [rnd.choice(PLANTILLAS).format(rnd.choice(PLATOS)) for _ in range(args.preguntas)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=120
+    ) as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        resultados = {
+            "casi_duplicadas": comprobar_casi_duplicadas(),
+            "sin_cache": await escenario(main, c, headers, preguntas, args, False),
+            "con_cache": await escenario(main, c, headers, preguntas, args, True),
+        }
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peticiones", type=int, default=600)
+    parser.add_argument("--preguntas", type=int, default=60)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.03)
+    parser.add_argument("--chunk-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Tormenta de reintentos: cada turno se envía varias veces casi a la vez
+(doble clic, reintentos del móvil, otra pestaña). Compara llamadas al
+modelo y filas guardadas con y sin generaciones compartidas.
+
+    python -m benchmarks.bench_singleflight --turnos 40 --copias 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def escenario(main, c, headers, args, compartidas: bool) -> dict:
+    from sqlalchemy import func, select
+
+    from backend import models
+    from backend.database import AsyncSessionLocal
+
+    main.GENERACIONES_COMPARTIDAS = compartidas
+    # Turnos con historial: la caché de respuestas no interviene
+    main.RESPUESTAS_CACHE_ACTIVA = False
+    fake = FakeGeminiClient(chunks=args.chunks, delay=args.delay, texto="receta ")
+    main.proveedor = fake
+    prefijo = "sf" if compartidas else "sin"
+
+    rnd = random.Random(11)
+    latencias = []
+    textos = {}
+
+    async def envio(turno: int, copia: int):
+        await asyncio.sleep(rnd.random() * args.jitter)
+        t0 = ahora()
+        r = await c.post(
+            "/stream_chat/",
+            data={
+                "user_message": f"¿y con la receta {turno} qué guarnición va?",
+                "conversation_id": f"{prefijo}-{turno}",
+            },
+            headers=headers,
+        )
+        latencias.append(ahora() - t0)
+        textos.setdefault(turno, set()).add(r.text)
+
+    await asyncio.gather(
+        *(envio(t, k) for t in range(args.turnos) for k in range(args.copias))
+    )
+    await asyncio.sleep(1.5)  # vaciar la cola de escritura
+
+    async with AsyncSessionLocal() as db:
+        filas = await db.scalar(
+            select(func.count(models.Message.id)).where(
+                models.Message.conversation_id.like(f"{prefijo}-%")
+            )
+        )
+    return {
+        "peticiones": args.turnos * args.copias,
+        "llamadas_modelo": fake.llamadas,
+        "mensajes_guardados": filas,
+        "respuestas_distintas_por_turno": max(len(v) for v in textos.values()),
+        "latencia": resumen_ms(latencias),
+    }
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+    from backend.database import async_engine
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=120
+    ) as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        resultados = {
+            "sin_compartir": await escenario(main, c, headers, args, False),
+            "compartidas": await escenario(main, c, headers, args, True),
+        }
+    resultados["registro"] = main.generaciones.stats
+    await async_engine.dispose()
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turnos", type=int, default=40)
+    parser.add_argument("--copias", type=int, default=4)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.03)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Escritores y lectores concurrentes contra el mismo archivo SQLite:
+configuración por defecto (rollback journal, commits directos) frente a
+WAL + pragmas + escritor único.
+
+    python -m benchmarks.bench_sqlite_concurrency --escritores 32 --lectores 16
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+
+
+def preparar_db(ruta: str, n_convs: int):
+    from sqlalchemy.orm import sessionmaker
+
+    from backend import models
+    from backend.database import Base, crear_engine
+
+    engine = crear_engine(f"sqlite:///{ruta}", pragmas={})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(models.User(id=1, username="bench", password_hash="x"))
+        db.add_all(
+            models.Conversation(id=f"conv-{i}", user_id=1, title="bench")
+            for i in range(n_convs)
+        )
+        db.commit()
+    engine.dispose()
+
+
+def escenario(ruta: str, ajustado: bool, args) -> dict:
+    from sqlalchemy import select
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import sessionmaker
+
+    from backend import models
+    from backend.database import crear_engine
+
+    engine = crear_engine(
+        f"sqlite:///{ruta}",
+        pragmas=None if ajustado else {},
+        pool_size=args.escritores + args.lectores,
+    )
+    Session = sessionmaker(bind=engine)
+    escritor = ThreadPoolExecutor(max_workers=1) if ajustado else None
+
+    lat_escritura, lat_lectura = [], []
+    errores = {"locked": 0}
+    lock = threading.Lock()
+    fin = threading.Event()
+
+    def guardar(conv_id: str):
+        with Session() as db:
+            db.add_all(
+                [
+                    models.Message(
+                        conversation_id=conv_id,
+                        role=models.RoleEnum.user,
+                        content="pregunta " * 10,
+                    ),
+                    models.Message(
+                        conversation_id=conv_id,
+                        role=models.RoleEnum.assistant,
+                        content="respuesta " * 200,
+                    ),
+                ]
+            )
+            db.commit()
+
+    def escribir_turnos(i: int):
+        for j in range(args.turnos):
+            conv_id = f"conv-{(i * args.turnos + j) % args.conversaciones}"
+            t0 = ahora()
+            try:
+                if escritor:
+                    escritor.submit(guardar, conv_id).result()
+                else:
+                    guardar(conv_id)
+            except OperationalError:
+                with lock:
+                    errores["locked"] += 1
+                continue
+            with lock:
+                lat_escritura.append(ahora() - t0)
+
+    def leer(i: int):
+        n = 0
+        while not fin.is_set():
+            conv_id = f"conv-{(i + n) % args.conversaciones}"
+            n += 1
+            t0 = ahora()
+            try:
+                with Session() as db:
+                    db.execute(
+                        select(models.Message.role, models.Message.content)
+                        .where(models.Message.conversation_id == conv_id)
+                        .order_by(models.Message.created_at, models.Message.id)
+                    ).all()
+            except OperationalError:
+                with lock:
+                    errores["locked"] += 1
+                continue
+            with lock:
+                lat_lectura.append(ahora() - t0)
+
+    hilos_lectura = [
+        threading.Thread(target=leer, args=(i,)) for i in range(args.lectores)
+    ]
+    for h in hilos_lectura:
+        h.start()
+    t0 = ahora()
+    with ThreadPoolExecutor(max_workers=args.escritores) as pool:
+        list(pool.map(escribir_turnos, range(args.escritores)))
+    duracion = ahora() - t0
+    fin.set()
+    for h in hilos_lectura:
+        h.join()
+    if escritor:
+        escritor.shutdown()
+    engine.dispose()
+
+    return {
+        "turnos_por_s": round(len(lat_escritura) / duracion, 1),
+        "escritura": resumen_ms(lat_escritura),
+        "lectura": resumen_ms(lat_lectura),
+        "errores_locked": errores["locked"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--escritores", type=int, default=32)
+    parser.add_argument("--lectores", type=int, default=16)
+    parser.add_argument("--turnos", type=int, default=50)
+    parser.add_argument("--conversaciones", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = preparar_entorno()
+    resultados = {}
+    for nombre, ajustado in (("por_defecto", False), ("wal_escritor_unico", True)):
+        ruta = os.path.join(tmp, f"{nombre}.db")
+        preparar_db(ruta, args.conversaciones)
+        resultados[nombre] = escenario(ruta, ajustado, args)
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
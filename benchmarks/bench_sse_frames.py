@@ -0,0 +1,106 @@
+"""
+Transporte del chat: escrituras de red por respuesta y tiempo hasta el
+primer byte con el endpoint antiguo (text/plain) y el SSE, variando el
+intervalo mínimo de agrupación de deltas.
+
+    python -m benchmarks.bench_sse_frames --chunks 200 --delay 0.002
+
+Cada mensaje `http.response.body` que la app entrega al servidor ASGI es
+una escritura al socket; se cuentan llamando a la app directamente.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from urllib.parse import urlencode
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def una_peticion(app, ruta: str, token: str, conv_id: str) -> dict:
+    cuerpo = urlencode({"user_message": "receta con arroz", "conversation_id": conv_id}).encode()
+    enviado = False
+    escrituras = 0
+    bytes_cuerpo = 0
+    t0 = ahora()
+    primer_byte = None
+    fin = asyncio.Event()
+
+    async def receive():
+        nonlocal enviado
+        if not enviado:
+            enviado = True
+            return {"type": "http.request", "body": cuerpo, "more_body": False}
+        await fin.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(mensaje):
+        nonlocal escrituras, bytes_cuerpo, primer_byte
+        if mensaje["type"] == "http.response.body" and mensaje.get("body"):
+            escrituras += 1
+            bytes_cuerpo += len(mensaje["body"])
+            if primer_byte is None:
+                primer_byte = ahora() - t0
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": ruta, "raw_path": ruta.encode(),
+        "query_string": b"", "root_path": "", "client": ("bench", 1), "server": ("bench", 80),
+        "headers": [
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"authorization", f"Bearer {token}".encode()),
+        ],
+    }
+    await app(scope, receive, send)
+    fin.set()
+    return {"escrituras": escrituras, "bytes": bytes_cuerpo, "primer_byte": primer_byte, "total": ahora() - t0}
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main, transporte
+
+    main.proveedor = FakeGeminiClient(chunks=args.chunks, delay=args.delay, texto="arroz ")
+    # Siempre por el modelo: la caché de respuestas reproduce en trozos grandes
+    main.RESPUESTAS_CACHE_ACTIVA = False
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        r = await c.post("/auth/register", json={"username": "bench", "password": "bench123"})
+        token = r.json()["access_token"]
+
+    escenarios = [("/stream_chat/", transporte.STREAM_FLUSH_MS)]
+    escenarios += [("/stream_chat/sse/", ms) for ms in args.flush_ms]
+    resultados = {}
+    n = 0
+    for ruta, flush_ms in escenarios:
+        transporte.STREAM_FLUSH_MS = flush_ms
+        medidas = []
+        for _ in range(args.repeticiones):
+            n += 1
+            medidas.append(await una_peticion(main.app, ruta, token, f"bench-{n}"))
+        resultados[f"{ruta} flush={flush_ms}ms"] = {
+            "escrituras_por_respuesta": sum(m["escrituras"] for m in medidas) / len(medidas),
+            "bytes_por_respuesta": sum(m["bytes"] for m in medidas) // len(medidas),
+            "primer_byte": resumen_ms([m["primer_byte"] for m in medidas]),
+            "total": resumen_ms([m["total"] for m in medidas]),
+        }
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.002)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--flush-ms", type=float, nargs="+", default=[0, 20, 40, 100])
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Latencia de endpoints no relacionados mientras hay N streams en vuelo.
+
+    python -m benchmarks.bench_stream_loop --streams 50 --peticiones 200
+
+Compara el p50/p95/p99 de /conversations/ sin streams y con N streams
+falsos (sin red) abiertos en el mismo worker.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def medir(app, headers, n_streams: int, peticiones: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+
+        async def un_stream(i: int):
+            await c.post(
+                "/stream_chat/",
+                data={"user_message": "hola", "conversation_id": f"bench-{i}"},
+                headers=headers,
+            )
+
+        streams = [asyncio.create_task(un_stream(i)) for i in range(n_streams)]
+        await asyncio.sleep(0.05)
+
+        latencias = []
+        for _ in range(peticiones):
+            t0 = ahora()
+            r = await c.get("/conversations/", headers=headers)
+            r.raise_for_status()
+            latencias.append(ahora() - t0)
+
+        await asyncio.gather(*streams)
+    return resumen_ms(latencias)
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from backend import main
+
+    main.proveedor = FakeGeminiClient(chunks=args.chunks, delay=args.delay)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        r = await c.post(
+            "/auth/register",
+            json={"username": "bench", "password": "bench123"},
+        )
+        token = r.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    base = await medir(main.app, headers, 0, args.peticiones)
+    carga = await medir(main.app, headers, args.streams, args.peticiones)
+    print(
+        json.dumps(
+            {"sin_streams": base, f"con_{args.streams}_streams": carga},
+            indent=2,
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
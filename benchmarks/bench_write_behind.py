@@ -0,0 +1,118 @@
+"""
+Throughput de la cola write-behind de turnos según el tamaño de lote.
+
+Antes comprueba que un segundo mensaje enviado justo tras el DONE (con el
+primero aún en la cola) ve el turno anterior, y que la barra lateral
+pedida a continuación ya lo cuenta (falla con AssertionError si no).
+
+    python -m benchmarks.bench_write_behind --turnos 5000 --productores 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+
+from ._comun import FakeGeminiClient, ahora, preparar_entorno, resumen_ms
+
+
+async def escenario(main, max_lote: int, args) -> dict:
+    from backend.persistencia import ColaTurnos, TurnoPendiente
+
+    cola = ColaTurnos(main._guardar_lote, max_lote=max_lote, flush_ms=args.flush_ms)
+    latencias = []
+    por_productor = args.turnos // args.productores
+
+    async def productor(i: int):
+        for j in range(por_productor):
+            t0 = ahora()
+            await cola.encolar(
+                TurnoPendiente(f"conv-{(i + j) % 100}", "pregunta " * 10, "respuesta " * 200)
+            )
+            latencias.append(ahora() - t0)
+            await asyncio.sleep(0)
+
+    t0 = ahora()
+    await asyncio.gather(*(productor(i) for i in range(args.productores)))
+    await cola.detener()
+    duracion = ahora() - t0
+    return {
+        "turnos_por_s": round(cola.stats["guardados"] / duracion, 1),
+        "lotes": cola.stats["lotes"],
+        "encolar": resumen_ms(latencias),
+        "max_pendientes_visto": cola.stats["max_pendientes_visto"],
+    }
+
+
+async def comprobar_lectura_tras_done(main) -> dict:
+    import httpx
+
+    fake = FakeGeminiClient(chunks=2, delay=0, texto="Arroz con pollo ")
+    main.proveedor = fake
+    main.RESPUESTAS_CACHE_ACTIVA = False
+    # Ventana de volcado ancha: el primer turno sigue en cola seguro
+    flush_s, main.cola_turnos.flush_s = main.cola_turnos.flush_s, 0.5
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://bench"
+        ) as c:
+            r = await c.post("/auth/register", json={"username": "seguido", "password": "bench123"})
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            guardados = main.cola_turnos.stats["guardados"]
+            for mensaje in ("receta de arroz con pollo", "y para 4 personas?"):
+                r = await c.post(
+                    "/stream_chat/",
+                    data={"user_message": mensaje, "conversation_id": "seguido-1"},
+                    headers=headers,
+                )
+                r.raise_for_status()
+                if mensaje.startswith("receta"):
+                    assert main.cola_turnos.stats["guardados"] == guardados, "ya se había volcado"
+            # Turno anterior + mensaje actual
+            vistos = sum(1 for content in fake.ultimos_contents if content.role == "user")
+            assert vistos == 2, f"el segundo mensaje vio {vistos - 1} turnos previos"
+            conversacion = (await c.get("/conversations/", headers=headers)).json()[
+                "conversations"
+            ][0]
+            assert conversacion["message_count"] == 4, conversacion
+    finally:
+        main.cola_turnos.flush_s = flush_s
+    return {
+        "turnos_previos_vistos": vistos - 1,
+        "message_count": conversacion["message_count"],
+        "lecturas_esperando": main.cola_turnos.stats["lecturas_esperando"],
+    }
+
+
+async def main_async(args) -> None:
+    from backend import main, models
+    from backend.database import escribir
+
+    async def sembrar(db):
+        db.add(models.User(id=1, username="bench", password_hash="x"))
+        db.add_all(
+            models.Conversation(id=f"conv-{i}", user_id=1, title="bench")
+            for i in range(100)
+        )
+
+    await escribir(sembrar)
+    resultados = {"lectura_tras_done": await comprobar_lectura_tras_done(main)}
+    for lote in args.lotes:
+        resultados[f"lote_{lote}"] = await escenario(main, lote, args)
+    print(json.dumps(resultados, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turnos", type=int, default=5000)
+    parser.add_argument("--productores", type=int, default=50)
+    parser.add_argument("--flush-ms", type=int, default=50)
+    parser.add_argument("--lotes", type=int, nargs="+", default=[1, 8, 64, 256])
+    args = parser.parse_args()
+
+    preparar_entorno()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Evaluación offline del clasificador de fuera de tema contra muestras
+etiquetadas (JSONL con {"texto", "fuera_de_tema"}).
+
+    python -m benchmarks.eval_clasificador
+    python -m benchmarks.eval_clasificador --muestras otras.jsonl --db chefito.db
+
+Informa precisión / recall / F1 de la respuesta local ("fuera de tema")
+para varios umbrales y la latencia por mensaje. Con --validacion-cruzada
+entrena además con las propias muestras (k pliegues); con --db, con los
+mensajes guardados en esa base SQLite, como hace el servidor al arrancar.
+
+Las preguntas de cocina que mezclan palabras de fuera de tema
+(OBLIGATORIOS_COCINA) nunca pueden contestarse en local, con ningún umbral
+desde CLASIFICADOR_UMBRAL: si alguna lo hace, termina con error.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+
+from ._comun import ahora, resumen_ms
+
+MUESTRAS = os.path.join(os.path.dirname(__file__), "datos", "clasificador_muestras.jsonl")
+UMBRALES = [0.5, 0.7, 0.8, 0.9, 0.95, 0.97, 0.99]
+# Cocina con palabras de fuera de tema (también están en MUESTRAS)
+OBLIGATORIOS_COCINA = [
+    "mi novia es celíaca, qué le preparo",
+    "qué juego de cuchillos me recomiendas",
+    "qué país tiene la mejor gastronomía",
+    "cuál es la historia del sushi",
+    "síntomas de intoxicación por mariscos",
+    "traducir al inglés la palabra cilantro",
+]
+
+
+def cargar(ruta: str):
+    with open(ruta, encoding="utf-8") as f:
+        return [
+            (d["texto"], bool(d["fuera_de_tema"]))
+            for d in (json.loads(linea) for linea in f if linea.strip())
+        ]
+
+
+def muestras_db(ruta: str):
+    import sqlite3
+
+    from backend.clasificador import muestras_de_mensajes
+
+    conn = sqlite3.connect(ruta)
+    try:
+        filas = conn.execute(
+            "SELECT conversation_id, role, content, local_reply FROM messages "
+            "ORDER BY conversation_id, created_at, id"
+        ).fetchall()
+    finally:
+        conn.close()
+    return muestras_de_mensajes(filas)
+
+
+def contar(clasificador, muestras, umbral: float):
+    """(verdaderos positivos, falsos positivos, falsos negativos)."""
+    clasificador.umbral = umbral
+    vp = fp = fn = 0
+    for texto, fuera in muestras:
+        pred = clasificador.es_fuera_de_tema(texto)
+        vp += pred and fuera
+        fp += pred and not fuera
+        fn += fuera and not pred
+    return vp, fp, fn
+
+
+def comprobar_obligatorios(clasificador, umbral_min: float) -> list:
+    """Los de OBLIGATORIOS_COCINA que se contestarían en local."""
+    fallos = []
+    for umbral in [u for u in UMBRALES if u >= umbral_min] + [umbral_min]:
+        clasificador.umbral = umbral
+        fallos += [
+            (umbral, texto) for texto in OBLIGATORIOS_COCINA if clasificador.es_fuera_de_tema(texto)
+        ]
+    return fallos
+
+
+def metricas(vp: int, fp: int, fn: int) -> dict:
+    precision = vp / (vp + fp) if vp + fp else 1.0
+    recall = vp / (vp + fn) if vp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "precision": round(precision, 3),
+        "recall": round(recall, 3),
+        "f1": round(f1, 3),
+        "falsos_positivos": fp,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--muestras", default=MUESTRAS)
+    parser.add_argument("--db", help="SQLite con mensajes para entrenar")
+    parser.add_argument("--validacion-cruzada", type=int, default=0, metavar="K")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "eval-sin-red")
+    from backend.clasificador import CLASIFICADOR_UMBRAL, ClasificadorTema
+
+    muestras = cargar(args.muestras)
+    extra = muestras_db(args.db) if args.db else []
+
+    base = ClasificadorTema()
+    base.entrenar(extra)
+    salida = {"muestras": len(muestras), "entrenamiento_db": len(extra)}
+    salida["semillas"] = {
+        str(u): metricas(*contar(base, muestras, u)) for u in UMBRALES
+    }
+    fallos = comprobar_obligatorios(base, CLASIFICADOR_UMBRAL)
+
+    if args.validacion_cruzada > 1:
+        k = args.validacion_cruzada
+        orden = muestras[:]
+        random.Random(5).shuffle(orden)
+        pliegues = [orden[i::k] for i in range(k)]
+        totales = {u: [0, 0, 0] for u in UMBRALES}
+        for i, prueba in enumerate(pliegues):
+            modelo = ClasificadorTema()
+            modelo.entrenar(extra + [m for j, p in enumerate(pliegues) if j != i for m in p])
+            for u in UMBRALES:
+                for n, valor in enumerate(contar(modelo, prueba, u)):
+                    totales[u][n] += valor
+            fallos += comprobar_obligatorios(modelo, CLASIFICADOR_UMBRAL)
+        salida[f"validacion_cruzada_{k}"] = {
+            str(u): metricas(*cuentas) for u, cuentas in totales.items()
+        }
+
+    base.umbral = CLASIFICADOR_UMBRAL
+    tiempos = []
+    for _ in range(20):
+        for texto, _ in muestras:
+            t0 = ahora()
+            base.es_fuera_de_tema(texto)
+            tiempos.append(ahora() - t0)
+    salida["latencia"] = resumen_ms(tiempos)
+    salida["obligatorios_cocina_fallidos"] = sorted(set(fallos))
+    print(json.dumps(salida, indent=2, ensure_ascii=False))
+    if fallos:
+        raise SystemExit("Preguntas de cocina contestadas como fuera de tema")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Servidor HTTP que imita la API REST de Gemini (generateContent y
+streamGenerateContent?alt=sse) para probar el cliente real de google-genai
+sin red: latencia por trozo, capacidad limitada (por encima responde 503,
+como el modelo real en un pico) y 503 aleatorios.
+
+    python -m benchmarks.servidor_gemini_falso --puerto 8765 --capacidad 8 --prob-503 0.05
+
+El cliente se apunta con
+Client(api_key="x", http_options=types.HttpOptions(base_url="http://127.0.0.1:8765")).
+GET /stats devuelve peticiones, 503 servidos y el máximo de peticiones
+simultáneas que llegó a ver.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+
+ERROR_503 = {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}}
+
+
+def crear_app(capacidad: int, prob_503: float, chunks: int, delay: float, semilla: int = 1):
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    rnd = random.Random(semilla)
+    estado = {"en_curso": 0, "max_en_curso": 0, "peticiones": 0, "servidos_503": 0}
+
+    def respuesta(texto: str, tokens: int) -> dict:
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": texto}]}, "index": 0}],
+            "usageMetadata": {"candidatesTokenCount": tokens},
+        }
+
+    def rechazar() -> bool:
+        estado["peticiones"] += 1
+        if estado["en_curso"] >= capacidad or rnd.random() < prob_503:
+            estado["servidos_503"] += 1
+            return True
+        return False
+
+    async def modelo(request: Request):
+        accion = request.path_params["resto"].rsplit(":", 1)[-1]
+        await request.body()
+        if rechazar():
+            # Un 503 real tarda algo en llegar
+            await asyncio.sleep(delay)
+            return JSONResponse(ERROR_503, status_code=503)
+
+        estado["en_curso"] += 1
+        estado["max_en_curso"] = max(estado["max_en_curso"], estado["en_curso"])
+        if accion == "generateContent":
+            try:
+                await asyncio.sleep(delay * 3)
+                return JSONResponse(respuesta("Título de prueba", 4))
+            finally:
+                estado["en_curso"] -= 1
+
+        async def trozos():
+            try:
+                for i in range(chunks):
+                    await asyncio.sleep(delay)
+                    yield f"data: {json.dumps(respuesta('receta ', i + 1))}\r\n\r\n"
+            finally:
+                estado["en_curso"] -= 1
+
+        return StreamingResponse(trozos(), media_type="text/event-stream")
+
+    async def stats(_request):
+        return JSONResponse(estado)
+
+    return Starlette(
+        routes=[
+            Route("/{version}/models/{resto:path}", modelo, methods=["POST"]),
+            Route("/stats", stats),
+        ]
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--capacidad", type=int, default=8)
+    parser.add_argument("--prob-503", type=float, default=0.05)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.03)
+    args = parser.parse_args()
+
+    app = crear_app(args.capacidad, args.prob_503, args.chunks, args.delay)
+    uvicorn.run(app, host="127.0.0.1", port=args.puerto, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
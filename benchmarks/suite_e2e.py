@@ -0,0 +1,482 @@
+"""
+Suite de carga de extremo a extremo contra la app FastAPI en un solo
+worker, con el modelo local (MODELO_PROVEEDOR=falso): sin red y
+reproducible (misma semilla, mismas operaciones en el mismo orden).
+
+1. Siembra usuarios, conversaciones y mensajes a la escala pedida con
+   los textos de backend/data/conversaciones.json.
+2. Lanza cada escenario con C clientes concurrentes: login, sidebar,
+   historial, chat (stream SSE), renombrar, borrar, buscar y uno mixto.
+3. Por escenario: peticiones/s, latencia total y hasta el primer byte
+   (p50/p95/p99), errores y pico de RSS del proceso.
+4. Guarda el JSON en benchmarks/resultados/e2e-<commit>.json para
+   comparar entre commits.
+
+    python -m benchmarks.suite_e2e --usuarios 50 --conversaciones 20 --turnos 6
+    python -m benchmarks.suite_e2e --escenarios chat mixto --clientes 64
+    python -m benchmarks.suite_e2e --comparar benchmarks/resultados/e2e-a.json benchmarks/resultados/e2e-b.json
+
+Las peticiones se hacen llamando a la app ASGI directamente (como haría
+uvicorn) para medir el primer byte de los streams; el cliente comparte
+proceso, así que el RSS incluye su parte (pequeña) pero no los procesos
+de hash de contraseñas.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+from ._comun import ahora, preparar_entorno, resumen_ms
+
+RAIZ = Path(__file__).resolve().parent.parent
+DATOS = RAIZ / "backend" / "data" / "conversaciones.json"
+RESULTADOS = Path(__file__).resolve().parent / "resultados"
+CLAVE = "bench123"
+
+ESCENARIOS = [
+    "login", "sidebar", "historial", "chat", "renombrar", "borrar", "buscar", "mixto",
+]
+# Mezcla del escenario mixto (pesos relativos)
+MEZCLA = {
+    "login": 2,
+    "sidebar": 30,
+    "historial": 30,
+    "chat": 25,
+    "renombrar": 10,
+    "borrar": 3,
+}
+# Peticiones de cada escenario respecto a --peticiones (login y chat son
+# mucho más caros: hash de contraseña y stream del modelo)
+FACTOR = {"login": 0.25, "chat": 0.5, "borrar": 0.25}
+# Métricas que se comparan entre dos resultados
+_COMPARABLES = [
+    ("rps", None),
+    ("latencia", "p50_ms"),
+    ("latencia", "p95_ms"),
+    ("latencia", "p99_ms"),
+    ("primer_byte", "p50_ms"),
+    ("primer_byte", "p95_ms"),
+    ("rss_pico_mb", None),
+]
+
+
+# === MEDIDA ===
+def _status_mb(campo: str) -> float:
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith(campo + ":"):
+                return int(linea.split()[1]) / 1024
+    return 0.0
+
+
+def reiniciar_pico_rss() -> float:
+    """Pone el pico de RSS (VmHWM) al RSS actual (Linux) y lo devuelve."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return _status_mb("VmRSS")
+
+
+async def peticion(
+    app,
+    metodo: str,
+    ruta: str,
+    token: Optional[str] = None,
+    formulario: Optional[dict] = None,
+    cuerpo_json: Optional[dict] = None,
+) -> dict:
+    """
+    Una petición HTTP llamando a la app ASGI. Devuelve estado, tiempo hasta
+    el primer byte del cuerpo, total y si un stream SSE terminó en error.
+    """
+    cabeceras = []
+    cuerpo = b""
+    if formulario is not None:
+        cuerpo = urlencode(formulario).encode()
+        cabeceras.append((b"content-type", b"application/x-www-form-urlencoded"))
+    elif cuerpo_json is not None:
+        cuerpo = json.dumps(cuerpo_json).encode()
+        cabeceras.append((b"content-type", b"application/json"))
+    cabeceras.append((b"content-length", str(len(cuerpo)).encode()))
+    if token:
+        cabeceras.append((b"authorization", f"Bearer {token}".encode()))
+
+    ruta_sin_query, _, query = ruta.partition("?")
+    enviado = False
+    fin = asyncio.Event()
+    estado = 0
+    primer_byte: Optional[float] = None
+    ultimo = b""
+    t0 = ahora()
+
+    async def receive():
+        nonlocal enviado
+        if not enviado:
+            enviado = True
+            return {"type": "http.request", "body": cuerpo, "more_body": False}
+        await fin.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(mensaje):
+        nonlocal estado, primer_byte, ultimo
+        if mensaje["type"] == "http.response.start":
+            estado = mensaje["status"]
+        elif mensaje["type"] == "http.response.body" and mensaje.get("body"):
+            if primer_byte is None:
+                primer_byte = ahora() - t0
+            ultimo = mensaje["body"]
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": metodo, "scheme": "http", "path": ruta_sin_query,
+        "raw_path": ruta_sin_query.encode(), "query_string": query.encode(),
+        "root_path": "", "client": ("bench", 1), "server": ("bench", 80),
+        "headers": cabeceras,
+    }
+    try:
+        await app(scope, receive, send)
+    finally:
+        fin.set()
+    total = ahora() - t0
+    return {
+        "estado": estado,
+        "primer_byte": primer_byte if primer_byte is not None else total,
+        "total": total,
+        "error_stream": b"event: error" in ultimo,
+    }
+
+
+# === SIEMBRA ===
+def cargar_turnos() -> List[tuple]:
+    """Pares (usuario, asistente) de conversaciones.json."""
+    with open(DATOS, encoding="utf-8") as f:
+        datos = json.load(f)
+    turnos = [
+        (t["user"], t["bot"])
+        for conv in datos.values()
+        for t in conv.get("history", [])
+        if t.get("user") and t.get("bot")
+    ]
+    if not turnos:
+        raise SystemExit(f"Sin turnos en {DATOS}")
+    return turnos
+
+
+def sembrar(args, turnos: List[tuple]) -> dict:
+    """
+    Inserta directamente en SQLite (mucho más rápido que por la API) con
+    la misma forma que dejan los endpoints. Devuelve el estado que usan los
+    escenarios: usuarios, tokens y conversaciones (normales y borrables).
+    """
+    from backend import main
+    from backend.claves import contexto_claves
+    from backend.database import engine
+    from backend.titulos import normalizar_titulo
+
+    azar = random.Random(args.semilla)
+    # Mismo hash para todos: el login verifica igual que con uno distinto
+    password_hash = contexto_claves().hash(CLAVE)
+    base = datetime(2025, 1, 1)
+    usuarios = [f"bench{u}" for u in range(args.usuarios)]
+    conversaciones: Dict[str, List[str]] = {}
+    borrables: List[tuple] = []
+    t0 = ahora()
+    n_mensajes = 0
+
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany(
+            "INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+            [(u + 1, nombre, password_hash) for u, nombre in enumerate(usuarios)],
+        )
+        filas_conv = []
+        filas_msg = []
+        instante = 0
+        for u, nombre in enumerate(usuarios):
+            ids = []
+            for c in range(args.conversaciones):
+                conv_id = f"u{u}-c{c}"
+                primero = azar.choice(turnos)[0]
+                titulo = primero[:60]
+                filas_conv.append(
+                    (conv_id, u + 1, titulo, normalizar_titulo(titulo),
+                     base + timedelta(seconds=instante), base + timedelta(seconds=instante + args.turnos * 2))
+                )
+                for _ in range(args.turnos):
+                    pregunta, respuesta = azar.choice(turnos)
+                    filas_msg.append((conv_id, "user", pregunta, base + timedelta(seconds=instante)))
+                    filas_msg.append((conv_id, "assistant", respuesta, base + timedelta(seconds=instante + 1)))
+                    instante += 2
+                ids.append(conv_id)
+            # La última cuarta parte de cada usuario se reserva para borrar
+            corte = max(1, (len(ids) * 3) // 4)
+            conversaciones[nombre] = ids[:corte]
+            borrables.extend((nombre, conv_id) for conv_id in ids[corte:])
+        cur.executemany(
+            "INSERT INTO conversations (id, user_id, title, display_title, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            filas_conv,
+        )
+        for i in range(0, len(filas_msg), 50_000):
+            cur.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                filas_msg[i : i + 50_000],
+            )
+        n_mensajes = len(filas_msg)
+        raw.commit()
+    finally:
+        raw.close()
+    # Lo mismo que haría la CLI sobre una base de datos existente
+    main.busqueda.reconstruir(engine)
+
+    azar.shuffle(borrables)
+    return {
+        "usuarios": usuarios,
+        "tokens": {n: main.create_access_token({"sub": n}) for n in usuarios},
+        "conversaciones": conversaciones,
+        "borrables": borrables,
+        "preguntas": [p for p, _ in turnos],
+        "resumen": {
+            "usuarios": len(usuarios),
+            "conversaciones": len(filas_conv),
+            "mensajes": n_mensajes,
+            "segundos": round(ahora() - t0, 2),
+        },
+    }
+
+
+# === OPERACIONES ===
+def planificar(escenario: str, n: int, estado: dict, azar: random.Random) -> List[tuple]:
+    """Lista fija de operaciones (tipo, usuario, conversación) del escenario."""
+    tipos = list(MEZCLA)
+    pesos = [MEZCLA[t] for t in tipos]
+    ops = []
+    for i in range(n):
+        tipo = azar.choices(tipos, pesos)[0] if escenario == "mixto" else escenario
+        if tipo == "borrar":
+            if not estado["borrables"]:
+                continue
+            usuario, conv_id = estado["borrables"].pop()
+        else:
+            usuario = azar.choice(estado["usuarios"])
+            conv_id = azar.choice(estado["conversaciones"][usuario])
+            if tipo == "chat" and azar.random() < 0.3:
+                # Conversación nueva (primer turno: título, caché de respuestas)
+                conv_id = f"{usuario}-nueva-{escenario}-{i}"
+        mensaje = None
+        if tipo == "chat":
+            mensaje = azar.choice(estado["preguntas"])[:500]
+        elif tipo == "buscar":
+            # Una o dos palabras de alguna pregunta, como buscaría el usuario
+            pregunta = azar.choice(estado["preguntas"])
+            palabras = [p for p in pregunta.split() if len(p) > 3] or pregunta.split()[:1]
+            mensaje = " ".join(azar.sample(palabras, min(len(palabras), azar.randint(1, 2))))
+        ops.append((tipo, usuario, conv_id, mensaje))
+    return ops
+
+
+async def ejecutar(app, op: tuple, estado: dict) -> dict:
+    tipo, usuario, conv_id, mensaje = op
+    token = estado["tokens"][usuario]
+    if tipo == "login":
+        return await peticion(
+            app, "POST", "/auth/login", cuerpo_json={"username": usuario, "password": CLAVE}
+        )
+    if tipo == "sidebar":
+        return await peticion(app, "GET", "/conversations/", token)
+    if tipo == "historial":
+        return await peticion(app, "GET", f"/history/{conv_id}", token)
+    if tipo == "chat":
+        return await peticion(
+            app, "POST", "/stream_chat/sse/", token,
+            formulario={"user_message": mensaje, "conversation_id": conv_id},
+        )
+    if tipo == "renombrar":
+        return await peticion(
+            app, "POST", "/conversations/rename/", token,
+            formulario={"conversation_id": conv_id, "new_title": "Renombrada en bench"},
+        )
+    if tipo == "borrar":
+        return await peticion(app, "DELETE", f"/conversations/{conv_id}", token)
+    if tipo == "buscar":
+        return await peticion(app, "GET", "/search?" + urlencode({"q": mensaje}), token)
+    raise ValueError(tipo)
+
+
+def _agregar(medidas: List[dict]) -> dict:
+    return {
+        "n": len(medidas),
+        "errores": sum(1 for m in medidas if m["estado"] >= 400 or m["error_stream"]),
+        "latencia": resumen_ms([m["total"] for m in medidas]),
+        "primer_byte": resumen_ms([m["primer_byte"] for m in medidas]),
+    }
+
+
+async def escenario(app, nombre: str, ops: List[tuple], estado: dict, clientes: int) -> dict:
+    medidas: Dict[str, List[dict]] = {}
+    pendientes = iter(ops)
+
+    async def cliente():
+        for op in pendientes:
+            medida = await ejecutar(app, op, estado)
+            medidas.setdefault(op[0], []).append(medida)
+
+    rss_inicial = reiniciar_pico_rss()
+    t0 = ahora()
+    await asyncio.gather(*(cliente() for _ in range(clientes)))
+    duracion = ahora() - t0
+    todas = [m for lista in medidas.values() for m in lista]
+    resultado = {
+        "clientes": clientes,
+        "segundos": round(duracion, 2),
+        "rps": round(len(todas) / duracion, 1) if duracion else 0.0,
+        **_agregar(todas),
+        "rss_inicial_mb": round(rss_inicial, 1),
+        "rss_pico_mb": round(_status_mb("VmHWM"), 1),
+    }
+    if nombre == "mixto":
+        resultado["por_operacion"] = {t: _agregar(m) for t, m in sorted(medidas.items())}
+    return resultado
+
+
+# === COMPARACIÓN ===
+def comparar(ruta_base: str, ruta_nueva: str) -> dict:
+    """Cambio en % de cada métrica por escenario (positivo = sube)."""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(ruta_nueva, encoding="utf-8") as f:
+        nueva = json.load(f)
+    cambios = {}
+    for nombre, datos in nueva["escenarios"].items():
+        previo = base["escenarios"].get(nombre)
+        if previo is None:
+            continue
+        fila = {}
+        for grupo, campo in _COMPARABLES:
+            antes = previo[grupo] if campo is None else previo[grupo][campo]
+            despues = datos[grupo] if campo is None else datos[grupo][campo]
+            clave = grupo if campo is None else f"{grupo}_{campo}"
+            fila[clave] = {
+                "antes": antes,
+                "ahora": despues,
+                "cambio_pct": round((despues - antes) / antes * 100, 1) if antes else None,
+            }
+        cambios[nombre] = fila
+    return {
+        "base": {k: base["meta"][k] for k in ("version", "fecha")},
+        "nueva": {k: nueva["meta"][k] for k in ("version", "fecha")},
+        "escenarios": cambios,
+    }
+
+
+def version_git() -> str:
+    try:
+        salida = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=RAIZ, capture_output=True, text=True, timeout=30,
+        )
+        return salida.stdout.strip() or "sin-git"
+    except (OSError, subprocess.SubprocessError):
+        return "sin-git"
+
+
+# === PRINCIPAL ===
+async def main_async(args, version: str) -> dict:
+    from backend import main
+    from backend.database import async_engine
+
+    # Para medir siempre el camino del modelo en los primeros turnos
+    if args.sin_cache_respuestas:
+        main.RESPUESTAS_CACHE_ACTIVA = False
+    estado = sembrar(args, cargar_turnos())
+    azar = random.Random(args.semilla)
+
+    resultados = {
+        "meta": {
+            "version": version,
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "siembra": estado["resumen"],
+        },
+        "escenarios": {},
+    }
+    # Calentamiento (imports perezosos, pool de conexiones, procesos de hash)
+    calentar = random.Random(0)
+    for tipo in ("login", "sidebar", "historial", "chat", "renombrar", "buscar"):
+        for op in planificar(tipo, 4, estado, calentar):
+            await ejecutar(main.app, op, estado)
+
+    for nombre in args.escenarios:
+        n = max(1, int(args.peticiones * FACTOR.get(nombre, 1)))
+        ops = planificar(nombre, n, estado, azar)
+        resultados["escenarios"][nombre] = await escenario(
+            main.app, nombre, ops, estado, args.clientes
+        )
+        # Que los guardados pendientes no caigan en el escenario siguiente
+        await main.cola_turnos.detener()
+        print(f"{nombre}: {resultados['escenarios'][nombre]['rps']} rps", file=sys.stderr)
+
+    resultados["meta"]["pasarela"] = main.pasarela.resumen()
+    main.servicio_claves.detener()
+    await asyncio.sleep(0.2)
+    await async_engine.dispose()
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--conversaciones", type=int, default=20, help="por usuario")
+    parser.add_argument("--turnos", type=int, default=6, help="por conversación")
+    parser.add_argument("--peticiones", type=int, default=400, help="por escenario")
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--escenarios", nargs="+", choices=ESCENARIOS, default=ESCENARIOS)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-por-s", type=float, default=150)
+    parser.add_argument("--tokens", type=int, default=120, help="por respuesta")
+    parser.add_argument("--sin-cache-respuestas", action="store_true")
+    parser.add_argument("--salida", help="ruta del JSON (por defecto resultados/e2e-<commit>.json)")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVA"))
+    args = parser.parse_args()
+
+    if args.comparar:
+        print(json.dumps(comparar(*args.comparar), indent=2, ensure_ascii=False))
+        return
+
+    version = version_git()
+    salida = Path(args.salida).resolve() if args.salida else RESULTADOS / f"e2e-{version}.json"
+    # El modelo falso lee su configuración al importarse
+    os.environ["MODELO_FALSO_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["MODELO_FALSO_TOKENS_POR_S"] = str(args.tokens_por_s)
+    os.environ["MODELO_FALSO_TOKENS_RESPUESTA"] = str(args.tokens)
+    os.environ["MODELO_FALSO_SEMILLA"] = str(args.semilla)
+    preparar_entorno()
+    os.environ["MODELO_PROVEEDOR"] = "falso"
+
+    resultados = asyncio.run(main_async(args, version))
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+    print(f"Guardado en {salida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ const fileLabel = document.querySelector(".file-label");
 const sidebarHistory = document.querySelector(".history-section");
 const newChatBtn = document.querySelector(".new-chat-btn");
 const logoutBtn = document.querySelector("#logoutBtn");
+const stopBtn = document.querySelector("#stopBtn");
 
 // avatar / menú usuario
 const userAvatar = document.getElementById("userAvatar");
@@ -26,6 +27,21 @@ let currentPreviewUrl = null;
 
 let currentConversationId = localStorage.getItem("currentConversationId") || null;
 let conversationJustStarted = false;
+// Permite cortar el stream en curso (el backend aborta la generación)
+let currentStreamController = null;
+
+// Paginación (cursores que devuelve el backend para la página siguiente)
+const CONVERSATIONS_PAGE_SIZE = 50;
+const HISTORY_PAGE_SIZE = 40;
+let conversationsCursor = null;
+let loadingMoreConversations = false;
+let historyCursor = null;
+let loadingOlderHistory = false;
+// Segundo refresco de la barra lateral tras el primer turno (título final)
+const TITLE_REFRESH_DELAY_MS = 2500;
+// Las fotos se reducen antes de subirlas (mismo lado máximo que el backend)
+const IMAGE_MAX_SIDE = 1024;
+const IMAGE_JPEG_QUALITY = 0.85;
 
 // ----------------------------
 // UTILS
@@ -34,93 +50,64 @@ function generateUuid() {
     return "id-" + Date.now().toString(36) + Math.random().toString(36).substr(2, 9);
 }
 
-// Genera un título corto a partir del primer mensaje del usuario
-function createTitleFromMessage(msg) {
-    if (!msg) return "Nueva receta";
-
-    let text = msg.trim();
-
-    // Quitar emojis básicos
-    text = text.replace(/\p{Extended_Pictographic}/gu, "");
-
-    // Quitar palabras de relleno al inicio (ayúdame, hola, oye, necesito, etc.)
-    text = text.replace(
-        /^(hola|buenas|buenos días|buenas tardes|buenas noches|oye|ayuda(me)?|necesito|por favor|podrías|puedes)\s+/i,
-        ""
-    );
-
-    // Cortar en el primer signo de puntuación fuerte o coma
-    const punctIndex = text.search(/[?.!]/);
-    const commaIndex = text.indexOf(",");
-    let cutAt = -1;
-
-    if (punctIndex !== -1 && commaIndex !== -1) {
-        cutAt = Math.min(punctIndex, commaIndex);
-    } else if (punctIndex !== -1) {
-        cutAt = punctIndex;
-    } else if (commaIndex !== -1) {
-        cutAt = commaIndex;
-    }
-
-    if (cutAt !== -1) {
-        text = text.slice(0, cutAt);
-    }
-
-    text = text.trim();
-    if (!text) text = "Nueva receta";
-
-    // Limitar longitud
-    const MAX_LEN = 30;
-    if (text.length > MAX_LEN) {
-        text = text.slice(0, MAX_LEN).trim() + "…";
+/**
+ * Reduce la foto a IMAGE_MAX_SIDE px en JPEG antes de subirla: una foto
+ * de móvil pasa de ~10 MB a ~200 KB. Si el navegador no puede (formato
+ * raro, sin canvas), se sube el archivo original y lo reduce el backend.
+ */
+async function downscaleImage(file) {
+    try {
+        const bitmap = await createImageBitmap(file, { imageOrientation: "from-image" });
+        const scale = Math.min(1, IMAGE_MAX_SIDE / Math.max(bitmap.width, bitmap.height));
+        if (scale === 1 && file.size < 1024 * 1024) {
+            bitmap.close();
+            return file;
+        }
+        const canvas = document.createElement("canvas");
+        canvas.width = Math.round(bitmap.width * scale);
+        canvas.height = Math.round(bitmap.height * scale);
+        const ctx = canvas.getContext("2d");
+        ctx.fillStyle = "#fff";
+        ctx.fillRect(0, 0, canvas.width, canvas.height);
+        ctx.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        bitmap.close();
+        const blob = await new Promise((resolve) =>
+            canvas.toBlob(resolve, "image/jpeg", IMAGE_JPEG_QUALITY)
+        );
+        return blob && blob.size < file.size ? blob : file;
+    } catch (err) {
+        console.warn("No se pudo reducir la imagen, se envía original:", err);
+        return file;
     }
-
-    // Capitalizar primera letra
-    text = text.charAt(0).toUpperCase() + text.slice(1);
-
-    return text;
 }
 
 /**
- * Pide al backend un título creativo generado por la IA.
- * Si algo falla, usa createTitleFromMessage(msg) como fallback.
+ * Lee un cuerpo text/event-stream y va devolviendo { event, data } con
+ * data ya parseado (JSON). Las tramas pueden llegar partidas entre lecturas.
  */
-async function getTitleFromAI(userMessage, assistantText) {
-    const fallback = createTitleFromMessage(userMessage);
-
-    try {
-        const res = await fetch(`${API_BASE}/conversations/suggest_title/`, {
-            method: "POST",
-            headers: {
-                ...getAuthHeaders({ "Content-Type": "application/json" })
-            },
-            body: JSON.stringify({
-                user_message: userMessage,
-                assistant_message: assistantText?.slice(0, 800) || ""
-            })
-        });
-
-        if (!res.ok) {
-            console.warn("Error al pedir título IA, uso fallback");
-            return fallback;
+async function* readSseEvents(body) {
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (value) buffer += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buffer.indexOf("\n\n")) !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+
+            let event = "message";
+            let data = "";
+            for (const line of frame.split("\n")) {
+                if (line.startsWith("event:")) event = line.slice(6).trim();
+                else if (line.startsWith("data:")) data += line.slice(5).trim();
+            }
+            yield { event, data: data ? JSON.parse(data) : {} };
         }
-
-        const data = await res.json();
-        const raw = (data.title || "").trim();
-        if (!raw) return fallback;
-
-        // Limpiar prefijos como "Título: ..."
-        let clean = raw
-            .replace(/^["“”]+/, "")
-            .replace(/["“”]+$/, "")
-            .replace(/^t[ií]tulo[:\-]\s*/i, "")
-            .trim();
-
-        if (!clean) clean = fallback;
-        return clean;
-    } catch (err) {
-        console.error("Error llamando al endpoint de título IA:", err);
-        return fallback;
+        if (done) return;
     }
 }
 
@@ -266,8 +253,7 @@ if (messageInput && chatForm) {
 // ----------------------------
 // RENDER Y PERSISTENCIA
 // ----------------------------
-function appendMessage(text, sender) {
-    if (!chatBox) return;
+function buildMessageElement(text, sender) {
     const div = document.createElement("div");
     div.className = `message ${sender}`;
 
@@ -276,8 +262,12 @@ function appendMessage(text, sender) {
     } else {
         div.textContent = text;
     }
+    return div;
+}
 
-    chatBox.appendChild(div);
+function appendMessage(text, sender) {
+    if (!chatBox) return;
+    chatBox.appendChild(buildMessageElement(text, sender));
     chatBox.scrollTop = chatBox.scrollHeight;
 }
 
@@ -305,8 +295,66 @@ function renderHistoryToChatBox(history) {
     saveChat();
 }
 
+// Inserta una página de mensajes más antiguos justo después del saludo,
+// manteniendo la posición de scroll del usuario.
+function prependHistoryToChatBox(history) {
+    if (!chatBox) return;
+    const anchor = chatBox.firstChild ? chatBox.firstChild.nextSibling : null;
+    const previousHeight = chatBox.scrollHeight;
+
+    const fragment = document.createDocumentFragment();
+    history.forEach((item) => {
+        if (item.user) fragment.appendChild(buildMessageElement(item.user, "user"));
+        if (item.bot) {
+            fragment.appendChild(buildMessageElement(`🍳 ${item.bot}`, "assistant"));
+        }
+    });
+    chatBox.insertBefore(fragment, anchor);
+    chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+    saveChat();
+}
+
+async function fetchHistoryPage(convId, before = null) {
+    const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+    if (before) params.set("before", before);
+
+    const res = await fetch(`${API_BASE}/history/${convId}?${params}`, {
+        headers: getAuthHeaders(),
+    });
+    if (res.status === 401) {
+        forceLogout();
+        return null;
+    }
+    return res.json();
+}
+
+async function loadOlderHistory() {
+    if (!historyCursor || loadingOlderHistory || !currentConversationId) return;
+    loadingOlderHistory = true;
+    const convId = currentConversationId;
+
+    try {
+        const data = await fetchHistoryPage(convId, historyCursor);
+        // El usuario pudo cambiar de conversación mientras tanto
+        if (!data || convId !== currentConversationId) return;
+        historyCursor = data.next_cursor;
+        prependHistoryToChatBox(data.history);
+    } catch (error) {
+        console.error(`Error al cargar mensajes anteriores de ${convId}:`, error);
+    } finally {
+        loadingOlderHistory = false;
+    }
+}
+
+if (chatBox) {
+    chatBox.addEventListener("scroll", () => {
+        if (chatBox.scrollTop < 40) loadOlderHistory();
+    });
+}
+
 function startNewConversation() {
     currentConversationId = generateUuid();
+    historyCursor = null;
     localStorage.setItem("currentConversationId", currentConversationId);
     conversationJustStarted = true;
 
@@ -330,6 +378,12 @@ if (newChatBtn) {
     newChatBtn.addEventListener("click", startNewConversation);
 }
 
+if (stopBtn) {
+    stopBtn.addEventListener("click", () => {
+        if (currentStreamController) currentStreamController.abort();
+    });
+}
+
 // ----------------------------
 // LOGOUT
 // ----------------------------
@@ -362,16 +416,23 @@ if (chatForm && messageInput) {
         formData.append("conversation_id", currentConversationId);
 
         if (fileInput && fileInput.files.length > 0) {
-            formData.append("image", fileInput.files[0]);
+            const file = fileInput.files[0];
+            formData.append("image", await downscaleImage(file), file.name);
         }
 
         appendMessage("🤖 Pensando en una receta...", "assistant");
 
+        currentStreamController = new AbortController();
+        if (stopBtn) stopBtn.classList.remove("hidden");
+        let botResponseDiv = null;
+        let fullText = "";
+
         try {
-            const res = await fetch(`${API_BASE}/stream_chat/`, {
+            const res = await fetch(`${API_BASE}/stream_chat/sse/`, {
                 method: "POST",
                 headers: getAuthHeaders(),
                 body: formData,
+                signal: currentStreamController.signal,
             });
 
             if (res.status === 401) {
@@ -383,6 +444,12 @@ if (chatForm && messageInput) {
                 return;
             }
 
+            if (res.status === 413 || res.status === 415) {
+                const data = await res.json().catch(() => ({}));
+                appendMessage(`❌ ${data.detail || "No se pudo usar la imagen"}`, "error");
+                return;
+            }
+
             if (!res.ok) {
                 throw new Error(`Error HTTP! Estado: ${res.status}`);
             }
@@ -390,26 +457,26 @@ if (chatForm && messageInput) {
             const lastMsg = document.querySelector(".assistant:last-child");
             if (lastMsg && lastMsg.textContent.includes("Pensando")) lastMsg.remove();
 
-            const botResponseDiv = document.createElement("div");
+            botResponseDiv = document.createElement("div");
             botResponseDiv.className = "message assistant";
             botResponseDiv.innerHTML = "🍳 ";
             chatBox.appendChild(botResponseDiv);
             chatBox.scrollTop = chatBox.scrollHeight;
 
-            const reader = res.body.getReader();
-            const decoder = new TextDecoder();
-            let done = false;
-            let fullText = "";
             const updateInterval = 50;
             let lastUpdateTime = Date.now();
-
-            while (!done) {
-                const { value, done: streamDone } = await reader.read();
-                done = streamDone;
-                if (!value) continue;
-
-                const chunk = decoder.decode(value, { stream: true });
-                fullText += chunk;
+            let streamError = null;
+
+            // Tramas tipadas: sólo "delta" es texto de la respuesta
+            for await (const { event, data } of readSseEvents(res.body)) {
+                if (event === "delta") {
+                    fullText += data.text;
+                } else if (event === "error") {
+                    streamError = data.message;
+                } else {
+                    // heartbeat / usage / done: nada que pintar
+                    continue;
+                }
 
                 if (Date.now() - lastUpdateTime > updateInterval) {
                     if (typeof marked !== "undefined") {
@@ -429,36 +496,46 @@ if (chatForm && messageInput) {
                 botResponseDiv.textContent = "🍳 " + fullText;
             }
 
-            // ====== RENOMBRE AUTOMÁTICO DEL CHAT (con ayuda de la IA) ======
-            if (conversationJustStarted) {
-                conversationJustStarted = false;
-
-                const title = await getTitleFromAI(userMessage, fullText);
-
-                const fd = new FormData();
-                fd.append("conversation_id", currentConversationId);
-                fd.append("new_title", title);
-
-                try {
-                    await fetch(`${API_BASE}/conversations/rename/`, {
-                        method: "POST",
-                        headers: getAuthHeaders(),
-                        body: fd,
-                    });
-                    loadConversations(currentConversationId);
-                } catch (err) {
-                    console.error("Error renombrando conversación:", err);
-                }
+            if (streamError) {
+                // El error va aparte, no mezclado con el texto de la respuesta
+                if (!fullText) botResponseDiv.remove();
+                appendMessage(streamError, "error");
             } else {
+                // El backend pone el título al guardar el primer turno (y lo
+                // afina en segundo plano si hace falta): sólo refrescamos la lista
                 loadConversations(currentConversationId);
+                if (conversationJustStarted) {
+                    conversationJustStarted = false;
+                    setTimeout(() => loadConversations(), TITLE_REFRESH_DELAY_MS);
+                }
             }
 
             saveChat();
         } catch (error) {
-            console.error("Error al procesar el stream:", error);
-            const lastMsg = document.querySelector(".assistant:last-child");
-            if (lastMsg) lastMsg.remove();
-            appendMessage(`❌ Error de conexión: ${error.message}.`, "error");
+            if (error.name === "AbortError") {
+                // Cortado por el usuario: dejamos lo recibido hasta ahora
+                if (botResponseDiv) {
+                    const partial = fullText + "\n\n_(respuesta interrumpida)_";
+                    if (typeof marked !== "undefined") {
+                        botResponseDiv.innerHTML = "🍳 " + marked.parse(partial);
+                    } else {
+                        botResponseDiv.textContent = "🍳 " + partial;
+                    }
+                } else {
+                    const lastMsg = document.querySelector(".assistant:last-child");
+                    if (lastMsg) lastMsg.remove();
+                }
+                saveChat();
+                loadConversations(currentConversationId);
+            } else {
+                console.error("Error al procesar el stream:", error);
+                const lastMsg = document.querySelector(".assistant:last-child");
+                if (lastMsg) lastMsg.remove();
+                appendMessage(`❌ Error de conexión: ${error.message}.`, "error");
+            }
+        } finally {
+            currentStreamController = null;
+            if (stopBtn) stopBtn.classList.add("hidden");
         }
 
         messageInput.value = "";
@@ -480,63 +557,95 @@ if (chatForm && messageInput) {
 // ----------------------------
 // SIDEBAR: CARGAR LISTA
 // ----------------------------
+function renderConversationItem(conv, activeId) {
+    const div = document.createElement("div");
+    const textDiv = document.createElement("div");
+    const titleSpan = document.createElement("span");
+    const deleteBtn = document.createElement("button");
+
+    const isActive = conv.id === activeId;
+    div.className = `history-item ${isActive ? "active" : ""}`;
+
+    textDiv.className = "history-item-text";
+    titleSpan.className = "history-item-title";
+    titleSpan.textContent = conv.title;
+    textDiv.appendChild(titleSpan);
+
+    // Extracto del último mensaje y contadores (vienen en la misma fila)
+    if (conv.message_count) {
+        const previewSpan = document.createElement("span");
+        previewSpan.className = "history-item-preview";
+        const meta = [`💬 ${conv.message_count}`];
+        if (conv.has_image) meta.push("📷");
+        previewSpan.textContent = conv.preview
+            ? `${meta.join(" ")} · ${conv.preview}`
+            : meta.join(" ");
+        if (conv.preview) textDiv.title = conv.preview;
+        textDiv.appendChild(previewSpan);
+    }
+
+    deleteBtn.className = "history-item-delete";
+    deleteBtn.innerHTML = "🗑";
+
+    // Click en el título = abrir conversación
+    textDiv.addEventListener("click", () =>
+        handleHistoryClick(conv.id, conv.username, div)
+    );
+    // Doble click = renombrar
+    textDiv.addEventListener("dblclick", () =>
+        enableRename(div, conv.id, conv.title)
+    );
+    // Click en papelera = eliminar
+    deleteBtn.addEventListener("click", (e) => {
+        e.stopPropagation();
+        deleteConversation(conv.id);
+    });
+
+    div.appendChild(textDiv);
+    div.appendChild(deleteBtn);
+    return div;
+}
+
+async function fetchConversationsPage(before = null) {
+    const params = new URLSearchParams({ limit: CONVERSATIONS_PAGE_SIZE });
+    if (before) params.set("before", before);
+
+    const res = await fetch(`${API_BASE}/conversations/?${params}`, {
+        headers: getAuthHeaders(),
+    });
+    if (res.status === 401) {
+        forceLogout();
+        return null;
+    }
+    return res.json();
+}
+
 async function loadConversations(activeId = null) {
     const token = getToken();
     if (!token) return;
 
     try {
-        const res = await fetch(`${API_BASE}/conversations/`, {
-            headers: getAuthHeaders(),
-        });
-
-        if (res.status === 401) {
-            forceLogout();
-            return;
-        }
-
-        const data = await res.json();
-        if (!sidebarHistory) return;
+        // Primera página (la más reciente); el resto se pide al hacer scroll
+        const data = await fetchConversationsPage();
+        if (!data || !sidebarHistory) return;
 
+        conversationsCursor = data.next_cursor;
         sidebarHistory.innerHTML = "";
         activeId = activeId || currentConversationId;
         let activeConvFound = false;
 
         data.conversations.forEach((conv) => {
-            const div = document.createElement("div");
-            const titleSpan = document.createElement("span");
-            const deleteBtn = document.createElement("button");
-
-            const isActive = conv.id === activeId;
-            div.className = `history-item ${isActive ? "active" : ""}`;
-
-            titleSpan.className = "history-item-title";
-            titleSpan.textContent = conv.title;
-
-            deleteBtn.className = "history-item-delete";
-            deleteBtn.innerHTML = "🗑";
-
-            if (isActive) activeConvFound = true;
-
-            // Click en el título = abrir conversación
-            titleSpan.addEventListener("click", () =>
-                handleHistoryClick(conv.id, conv.username, div)
-            );
-            // Doble click = renombrar
-            titleSpan.addEventListener("dblclick", () =>
-                enableRename(div, conv.id, conv.title)
-            );
-            // Click en papelera = eliminar
-            deleteBtn.addEventListener("click", (e) => {
-                e.stopPropagation();
-                deleteConversation(conv.id);
-            });
-
-            div.appendChild(titleSpan);
-            div.appendChild(deleteBtn);
-            sidebarHistory.appendChild(div);
+            if (conv.id === activeId) activeConvFound = true;
+            sidebarHistory.appendChild(renderConversationItem(conv, activeId));
         });
 
-        if (activeId && !activeConvFound) {
+        // Si hay más páginas, la activa puede estar en otra: sólo marcamos
+        // "(Nueva Receta)" cuando sabemos que aún no está guardada.
+        if (
+            activeId &&
+            !activeConvFound &&
+            (conversationJustStarted || !conversationsCursor)
+        ) {
             const div = document.createElement("div");
             div.textContent = "(Nueva Receta)";
             div.className = "history-item active unsaved";
@@ -560,6 +669,37 @@ async function loadConversations(activeId = null) {
     }
 }
 
+async function loadMoreConversations() {
+    if (!conversationsCursor || loadingMoreConversations) return;
+    loadingMoreConversations = true;
+
+    try {
+        const data = await fetchConversationsPage(conversationsCursor);
+        if (!data || !sidebarHistory) return;
+
+        conversationsCursor = data.next_cursor;
+        data.conversations.forEach((conv) => {
+            sidebarHistory.appendChild(
+                renderConversationItem(conv, currentConversationId)
+            );
+        });
+    } catch (error) {
+        console.error("Error al cargar más conversaciones:", error);
+    } finally {
+        loadingMoreConversations = false;
+    }
+}
+
+if (sidebarHistory) {
+    sidebarHistory.addEventListener("scroll", () => {
+        const remaining =
+            sidebarHistory.scrollHeight -
+            sidebarHistory.scrollTop -
+            sidebarHistory.clientHeight;
+        if (remaining < 80) loadMoreConversations();
+    });
+}
+
 // ----------------------------
 // ELIMINAR CONVERSACIÓN
 // ----------------------------
@@ -658,17 +798,14 @@ async function handleHistoryClick(convId, username, element) {
         .forEach((item) => item.classList.remove("active"));
     element.classList.add("active");
 
-    try {
-        const res = await fetch(`${API_BASE}/history/${convId}`, {
-            headers: getAuthHeaders(),
-        });
+    historyCursor = null;
 
-        if (res.status === 401) {
-            forceLogout();
-            return;
-        }
+    try {
+        // Página más reciente; las anteriores se cargan al subir el scroll
+        const data = await fetchHistoryPage(convId);
+        if (!data) return;
 
-        const data = await res.json();
+        historyCursor = data.next_cursor;
         renderHistoryToChatBox(data.history);
     } catch (error) {
         console.error(`Error al cargar historial de ${convId}:`, error);